@@ -0,0 +1,121 @@
+import functools
+import os
+import threading
+import time
+
+import psycopg2.errors
+from flask import Response
+
+import db
+import metrics
+
+# Per-class concurrency limits for the Flask app, so a burst of one kind of
+# request (say, searches) cannot take every worker thread and pool
+# connection from the others.
+#
+# Each class admits up to LIMIT requests at once. Up to QUEUE more wait, each
+# for at most WAIT seconds; anything beyond that, or still waiting at its
+# deadline, gets an immediate 503 with Retry-After instead of piling up.
+# Admitted requests run with statement_timeout = TIMEOUT_MS on every
+# connection they borrow, and a cancelled statement is also a 503. All four
+# are read from ADMISSION_<CLASS>_LIMIT/_QUEUE/_WAIT/_TIMEOUT_MS.
+
+DEFAULTS = {
+    # class: (limit, queue, wait seconds, statement_timeout ms)
+    'search': (4, 16, 2, 3000),
+    'booking': (8, 32, 5, 5000),
+    'listing': (8, 32, 3, 5000),
+    'auth': (8, 64, 5, 2000),
+}
+
+class AdmissionClass:
+    def __init__(self, name, limit, queue, wait, timeout_ms):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.timeout_ms = timeout_ms
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        # None once admitted, otherwise the reason it was not: 'queue_full' or 'deadline'.
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue:
+                return 'queue_full'
+            deadline = time.monotonic() + self.wait
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'deadline'
+                    self._cond.wait(remaining)
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def retry_after(self):
+        return str(max(1, round(self.wait)))
+
+def _setting(name, key, default, convert):
+    return convert(os.getenv(f'ADMISSION_{name.upper()}_{key}', default))
+
+def _configure():
+    classes = {}
+    for name, (limit, queue, wait, timeout_ms) in DEFAULTS.items():
+        admission_class = AdmissionClass(
+            name,
+            _setting(name, 'LIMIT', limit, int),
+            _setting(name, 'QUEUE', queue, int),
+            _setting(name, 'WAIT', wait, float),
+            _setting(name, 'TIMEOUT_MS', timeout_ms, int) or None
+        )
+        metrics.gauge('admission_in_flight', lambda c=admission_class: c.active, **{'class': name})
+        metrics.gauge('admission_queued', lambda c=admission_class: c.waiting, **{'class': name})
+        classes[name] = admission_class
+    return classes
+
+CLASSES = _configure()
+
+def _busy(admission_class):
+    return Response('Server busy, try again shortly.\n', status=503, mimetype='text/plain',
+                    headers={'Retry-After': admission_class.retry_after()})
+
+def admit(name):
+    # Goes under @app.route so the whole view runs inside the class's limit.
+    admission_class = CLASSES[name]
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            reason = admission_class.acquire()
+            if reason:
+                metrics.increment('admission_rejected_total', reason=reason, **{'class': name})
+                return _busy(admission_class)
+            metrics.increment('admission_admitted_total', **{'class': name})
+            try:
+                with db.statement_timeout(admission_class.timeout_ms):
+                    return view(*args, **kwargs)
+            except psycopg2.errors.QueryCanceled:
+                metrics.increment('admission_timeouts_total', **{'class': name})
+                return _busy(admission_class)
+            finally:
+                admission_class.release()
+        return wrapped
+    return decorate
+
+metrics.describe('admission_admitted_total', 'Requests admitted, by admission class.')
+metrics.describe('admission_rejected_total', 'Requests refused with 503, by admission class and reason (queue_full, deadline).')
+metrics.describe('admission_timeouts_total', 'Admitted requests whose statements hit statement_timeout, by admission class.')
+metrics.describe('admission_in_flight', 'Requests currently admitted, by admission class.')
+metrics.describe('admission_queued', 'Requests waiting for admission, by admission class.')
@@ -1,6 +1,19 @@
-from flask import Flask, request, redirect, url_for, session, render_template_string, flash, abort
-import psycopg2
+from flask import Flask, request, redirect, url_for, session, render_template_string, flash, abort, Response, stream_with_context, g
+import contextlib
 import os
+import time
+from datetime import datetime, timedelta
+import admission
+import bulk
+import caches
+import db
+import invalidation
+import jobs
+import metrics
+import ratelimit
+import repository
+import shards
+from db import get_db_connection
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,26 +24,48 @@ app = Flask(__name__)
 # 2. THEN, set the secret key on that instance
 app.secret_key = os.getenv('SECRET_KEY', 'supersecretkey')
 
-# AND UPDATE get_db_connection() function to:
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('DB_HOST', 'localhost'),
-        port=int(os.getenv('DB_PORT', '5432')),
-        database=os.getenv('DB_NAME', 'realestate_db'),
-        user=os.getenv('DB_USER', 'postgres'),
-        password=os.getenv('DB_PASSWORD', '1234')
-    )
+# Statements sent per page, for /metrics: divide db_round_trips_total by
+# http_requests_total for the same endpoint.
+@app.before_request
+def start_round_trip_count():
+    g.round_trips_start = db.round_trips()
+
+@app.after_request
+def record_round_trips(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.increment('http_requests_total', endpoint=endpoint)
+    metrics.increment('db_round_trips_total', db.round_trips() - g.get('round_trips_start', 0), endpoint=endpoint)
+    return response
+
+# After a write, the user reads from the primary for DB_PRIMARY_PIN_SECONDS so
+# the next page (e.g. /bookings after booking) shows it even if the replicas
+# have not replayed it yet. Endpoints here write on the methods listed.
+PRIMARY_PIN_SECONDS = float(os.getenv('DB_PRIMARY_PIN_SECONDS', '10'))
+WRITE_ENDPOINTS = {
+    'register': ('POST',), 'add_address': ('POST',), 'edit_address': ('POST',), 'delete_address': ('GET',),
+    'add_card': ('POST',), 'edit_card': ('POST',), 'delete_card': ('GET',),
+    'add_property': ('POST',), 'edit_property': ('POST',), 'bulk_adjust_properties': ('POST',),
+    'delete_property': ('GET',), 'book_property': ('POST',), 'cancel_booking': ('GET',),
+    'add_neighborhood': ('POST',), 'edit_neighborhood': ('POST',),
+}
+
+@app.after_request
+def pin_writers_to_primary(response):
+    if request.method in WRITE_ENDPOINTS.get(request.endpoint, ()):
+        session['primary_until'] = time.time() + PRIMARY_PIN_SECONDS
+    return response
+
+def read_connection(shard=None):
+    # For pages that only read: a replica, unless this user wrote recently.
+    # Reads of sharded data go to the owning shard.
+    if shard is not None:
+        return get_db_connection(shard=shard)
+    return get_db_connection(replica=time.time() >= session.get('primary_until', 0))
 
 def get_user_role(email):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('SELECT Email FROM Renter WHERE Email = %s', (email,))
-            if cur.fetchone():
-                return 'renter'
-            cur.execute('SELECT Email FROM Agent WHERE Email = %s', (email,))
-            if cur.fetchone():
-                return 'agent'
-    return None
+            return repository.get_user_role(cur, email)
 
 @app.route('/')
 def home():
@@ -76,6 +111,7 @@ def home():
                         {% elif role == 'agent' %}
                             <a href="/properties">Manage Properties</a>
                             <a href="/bookings">View Bookings</a>
+                            <a href="/analytics">Analytics</a>
                             <a href="/search">Search Properties</a>
                             <a href="/neighborhoods">Manage Neighborhoods</a>
                         {% endif %}
@@ -95,6 +131,8 @@ def home():
 # --- Authentication ---
 
 @app.route('/login', methods=['GET', 'POST'])
+@ratelimit.limit('auth', methods=['POST'])
+@admission.admit('auth')
 def login():
     if request.method == 'POST':
         email = request.form['email']
@@ -145,6 +183,8 @@ def logout():
     return redirect(url_for('home'))
 
 @app.route('/register', methods=['GET', 'POST'])
+@ratelimit.limit('auth', methods=['POST'])
+@admission.admit('auth')
 def register():
     if request.method == 'POST':
         email = request.form['email']
@@ -157,6 +197,7 @@ def register():
                     flash('Registration failed: Email already exists.')
                     return redirect(url_for('register'))
                 cur.execute('INSERT INTO "User" (Email, Name) VALUES (%s, %s)', (email, name))
+                invalidation.publish(cur, 'user', email)
                 if user_type == 'agent':
                     job_title = request.form.get('job_title')
                     agency = request.form.get('agency')
@@ -261,14 +302,14 @@ def register():
 # --- Address Management (Renter) ---
 
 @app.route('/addresses')
+@admission.admit('listing')
 def addresses():
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('SELECT AddressID, Street, City, State, Zip, Primary_Address FROM Address WHERE Email = %s', (email,))
-            addresses = cur.fetchall()
+            addresses = repository.list_addresses(cur, email)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -292,12 +333,12 @@ def addresses():
                 <div class="property-details">
                     {% for addr in addresses %}
                         <div class="address-card">
-                            <h3>Address ID: {{ addr[0] }}</h3>
-                            <p>{{ addr[1] }}, {{ addr[2] }}, {{ addr[3] }} {{ addr[4] }}</p>
-                            <p>Primary: {{ 'Yes' if addr[5] else 'No' }}</p>
+                            <h3>Address ID: {{ addr.address_id }}</h3>
+                            <p>{{ addr.street }}, {{ addr.city }}, {{ addr.state }} {{ addr.zip }}</p>
+                            <p>Primary: {{ 'Yes' if addr.primary_address else 'No' }}</p>
                             <div class="btn-group">
-                                <a href="{{ url_for('edit_address', address_id=addr[0]) }}" class="btn">Edit</a>
-                                <a href="{{ url_for('delete_address', address_id=addr[0]) }}" class="btn btn-danger">Delete</a>
+                                <a href="{{ url_for('edit_address', address_id=addr.address_id) }}" class="btn">Edit</a>
+                                <a href="{{ url_for('delete_address', address_id=addr.address_id) }}" class="btn btn-danger">Delete</a>
                             </div>
                         </div>
                     {% endfor %}
@@ -321,10 +362,9 @@ def add_address():
         email = session['user']
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                if primary:
-                    cur.execute('UPDATE Address SET Primary_Address = FALSE WHERE Email = %s', (email,))
-                cur.execute('INSERT INTO Address (Street, City, State, Zip, Email, Primary_Address) VALUES (%s, %s, %s, %s, %s, %s)', (street, city, state, zip_code, email, primary))
+                repository.add_address(cur, email, street, city, state, zip_code, primary)
                 conn.commit()
+        caches.cards.invalidate(email)
         flash('Address added!')
         return redirect(url_for('addresses'))
     return render_template_string('''
@@ -385,8 +425,7 @@ def edit_address(address_id):
     email = session['user']
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('SELECT Street, City, State, Zip, Primary_Address FROM Address WHERE Email = %s AND AddressID = %s', (email, address_id))
-            addr = cur.fetchone()
+            addr = repository.get_address(cur, email, address_id)
             if not addr:
                 abort(404)
             if request.method == 'POST':
@@ -395,11 +434,9 @@ def edit_address(address_id):
                 state = request.form['state']
                 zip_code = request.form['zip']
                 primary = request.form.get('primary') == 'on'
-                if primary:
-                    cur.execute('UPDATE Address SET Primary_Address = FALSE WHERE Email = %s', (email,))
-                cur.execute('UPDATE Address SET Street=%s, City=%s, State=%s, Zip=%s, Primary_Address=%s WHERE Email=%s AND AddressID=%s',
-                            (street, city, state, zip_code, primary, email, address_id))
+                repository.update_address(cur, email, address_id, street, city, state, zip_code, primary)
                 conn.commit()
+                caches.cards.invalidate(email)
                 flash('Address updated!')
                 return redirect(url_for('addresses'))
     return render_template_string('''
@@ -415,23 +452,23 @@ def edit_address(address_id):
                 <form method="post">
                     <div>
                         <label for="street">Street:</label>
-                        <input type="text" id="street" name="street" value="{{ addr[0] }}" required>
+                        <input type="text" id="street" name="street" value="{{ addr.street }}" required>
                     </div>
                     <div>
                         <label for="city">City:</label>
-                        <input type="text" id="city" name="city" value="{{ addr[1] }}" required>
+                        <input type="text" id="city" name="city" value="{{ addr.city }}" required>
                     </div>
                     <div>
                         <label for="state">State:</label>
-                        <input type="text" id="state" name="state" value="{{ addr[2] }}" required>
+                        <input type="text" id="state" name="state" value="{{ addr.state }}" required>
                     </div>
                     <div>
                         <label for="zip">Zip:</label>
-                        <input type="text" id="zip" name="zip" value="{{ addr[3] }}" required>
+                        <input type="text" id="zip" name="zip" value="{{ addr.zip }}" required>
                     </div>
                     <div>
                         <label>
-                            <input type="checkbox" name="primary" {% if addr[4] %}checked{% endif %}> Primary Address
+                            <input type="checkbox" name="primary" {% if addr.primary_address %}checked{% endif %}> Primary Address
                         </label>
                     </div>
                     <input type="submit" value="Update">
@@ -450,11 +487,7 @@ def delete_address(address_id):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             # Check if address is used as billing address for any credit cards
-            cur.execute('''
-                SELECT 1 FROM CreditCard 
-                WHERE Billing_Address = %s AND Renter_Email = %s
-            ''', (address_id, email))
-            if cur.fetchone():
+            if repository.address_is_billing(cur, email, address_id):
                 flash('Cannot delete: Address is used as billing address for a credit card.')
                 return redirect(url_for('addresses'))
             
@@ -472,28 +505,21 @@ def delete_address(address_id):
                 return redirect(url_for('addresses'))
             
             # If no dependencies, delete the address
-            cur.execute('DELETE FROM Address WHERE Email = %s AND AddressID = %s', (email, address_id))
+            repository.delete_address(cur, email, address_id)
             conn.commit()
+    caches.cards.invalidate(email)
     flash('Address deleted!')
     return redirect(url_for('addresses'))
 
 # --- Credit Card Management (Renter) ---
 
 @app.route('/cards')
+@admission.admit('listing')
 def cards():
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('''
-                SELECT c.Card_Number, c.CVV, c.Expiry_Date, c.Billing_Address,
-                       a.Street, a.City, a.State, a.Zip
-                FROM CreditCard c
-                LEFT JOIN Address a ON c.Billing_Address = a.AddressID AND c.Renter_Email = a.Email
-                WHERE c.Renter_Email = %s
-            ''', (email,))
-            cards = cur.fetchall()
+    cards = caches.cards.get(email)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -517,13 +543,13 @@ def cards():
                 <div class="property-details">
                     {% for card in cards %}
                         <div class="credit-card">
-                            <h3>Card Number: {{ card[0] }}</h3>
-                            <p>CVV: {{ card[1] }}</p>
-                            <p>Expiry: {{ card[2].strftime('%m/%Y') }}</p>
-                            <p>Billing Address: {{ card[4] }}, {{ card[5] }}, {{ card[6] }} {{ card[7] if card[4] else 'N/A' }}</p>
+                            <h3>Card Number: {{ card.card_number }}</h3>
+                            <p>CVV: {{ card.cvv }}</p>
+                            <p>Expiry: {{ card.expiry_date.strftime('%m/%Y') }}</p>
+                            <p>Billing Address: {{ card.street }}, {{ card.city }}, {{ card.state }} {{ card.zip if card.street else 'N/A' }}</p>
                             <div class="btn-group">
-                                <a href="{{ url_for('edit_card', card_number=card[0]) }}" class="btn">Edit</a>
-                                <a href="{{ url_for('delete_card', card_number=card[0]) }}" class="btn btn-danger">Delete</a>
+                                <a href="{{ url_for('edit_card', card_number=card.card_number) }}" class="btn">Edit</a>
+                                <a href="{{ url_for('delete_card', card_number=card.card_number) }}" class="btn btn-danger">Delete</a>
                             </div>
                         </div>
                     {% endfor %}
@@ -539,10 +565,6 @@ def add_card():
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT AddressID, Street, City, State, Zip FROM Address WHERE Email = %s', (email,))
-            addresses = cur.fetchall()
     if request.method == 'POST':
         card_number = request.form['card_number']
         cvv = request.form['cvv']
@@ -568,22 +590,20 @@ def add_card():
             
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT 1 FROM Address WHERE Email = %s AND AddressID = %s', (email, billing_address))
-                if not cur.fetchone():
+                address_ok, added = repository.add_card(cur, email, card_number, cvv, expiry_date, billing_address)
+                if not address_ok:
                     flash('Billing address does not exist or does not belong to you.')
                     return redirect(url_for('add_card'))
-                # Check if card already exists
-                cur.execute('SELECT 1 FROM CreditCard WHERE Renter_Email = %s AND Card_Number = %s', (email, card_number))
-                if cur.fetchone():
+                if not added:
                     flash('This card is already registered.')
                     return redirect(url_for('add_card'))
-                cur.execute('''
-                    INSERT INTO CreditCard (Card_Number, CVV, Expiry_Date, Renter_Email, Billing_Address)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (card_number, cvv, expiry_date, email, billing_address))
                 conn.commit()
+        caches.cards.invalidate(email)
         flash('Credit card added!')
         return redirect(url_for('cards'))
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            addresses = repository.list_addresses(cur, email)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -632,7 +652,7 @@ def add_card():
                         <label for="billing_address">Billing Address:</label>
                         <select id="billing_address" name="billing_address" required>
                             {% for addr in addresses %}
-                                <option value="{{ addr[0] }}">{{ addr[1] }}, {{ addr[2] }}, {{ addr[3] }} {{ addr[4] }}</option>
+                                <option value="{{ addr.address_id }}">{{ addr.street }}, {{ addr.city }}, {{ addr.state }} {{ addr.zip }}</option>
                             {% endfor %}
                         </select>
                     </div>
@@ -653,12 +673,10 @@ def edit_card(card_number):
     email = session['user']
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('SELECT CVV, Expiry_Date, Billing_Address FROM CreditCard WHERE Renter_Email = %s AND Card_Number = %s', (email, card_number))
-            card = cur.fetchone()
+            card = repository.get_card(cur, email, card_number)
             if not card:
                 abort(404)
-            cur.execute('SELECT AddressID, Street, City, State, Zip FROM Address WHERE Email = %s', (email,))
-            addresses = cur.fetchall()
+            addresses = repository.list_addresses(cur, email)
     if request.method == 'POST':
         cvv = request.form['cvv']
         expiry_month = request.form['expiry_month']
@@ -677,9 +695,9 @@ def edit_card(card_number):
             return redirect(url_for('edit_card', card_number=card_number))
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('UPDATE CreditCard SET CVV=%s, Expiry_Date=%s, Billing_Address=%s WHERE Renter_Email=%s AND Card_Number=%s',
-                            (cvv, expiry_date, billing_address, email, card_number))
+                repository.update_card(cur, email, card_number, cvv, expiry_date, billing_address)
                 conn.commit()
+        caches.cards.invalidate(email)
         flash('Credit card updated!')
         return redirect(url_for('cards'))
     return render_template_string('''
@@ -708,13 +726,13 @@ def edit_card(card_number):
                     </div>
                     <div>
                         <label for="cvv">CVV:</label>
-                        <input type="text" id="cvv" name="cvv" maxlength="3" value="{{ card[0] }}" required>
+                        <input type="text" id="cvv" name="cvv" maxlength="3" value="{{ card.cvv }}" required>
                     </div>
                     <div>
                         <label for="expiry_month">Expiry Month:</label>
                         <select id="expiry_month" name="expiry_month" required>
                             {% for month in range(1, 13) %}
-                                <option value="{{ '%02d' % month }}" {% if card[1].month == month %}selected{% endif %}>{{ '%02d' % month }}</option>
+                                <option value="{{ '%02d' % month }}" {% if card.expiry_date.month == month %}selected{% endif %}>{{ '%02d' % month }}</option>
                             {% endfor %}
                         </select>
                     </div>
@@ -722,7 +740,7 @@ def edit_card(card_number):
                         <label for="expiry_year">Expiry Year:</label>
                         <select id="expiry_year" name="expiry_year" required>
                             {% for year in range(datetime.now().year, datetime.now().year + 10) %}
-                                <option value="{{ year }}" {% if card[1].year == year %}selected{% endif %}>{{ year }}</option>
+                                <option value="{{ year }}" {% if card.expiry_date.year == year %}selected{% endif %}>{{ year }}</option>
                             {% endfor %}
                         </select>
                     </div>
@@ -730,7 +748,7 @@ def edit_card(card_number):
                         <label for="billing_address">Billing Address:</label>
                         <select id="billing_address" name="billing_address" required>
                             {% for addr in addresses %}
-                                <option value="{{ addr[0] }}" {% if addr[0] == card[2] %}selected{% endif %}>{{ addr[1] }}, {{ addr[2] }}, {{ addr[3] }} {{ addr[4] }}</option>
+                                <option value="{{ addr.address_id }}" {% if addr.address_id == card.billing_address %}selected{% endif %}>{{ addr.street }}, {{ addr.city }}, {{ addr.state }} {{ addr.zip }}</option>
                             {% endfor %}
                         </select>
                     </div>
@@ -749,14 +767,24 @@ def delete_card(card_number):
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
+    with get_db_connection() as conn, contextlib.ExitStack() as stack:
+        # With shards, each shard's card lock is held until the delete has
+        # committed, so no booking can start using the card in between.
+        checks = [conn]
+        for shard in db.SHARDS:
+            shard_conn = stack.enter_context(get_db_connection(shard=shard))
+            with shard_conn.cursor() as shard_cur:
+                repository.lock_card(shard_cur, email, card_number)
+            checks.append(shard_conn)
+        for check in checks:
+            with check.cursor() as cur:
+                if repository.card_in_use(cur, email, card_number):
+                    flash('Cannot delete: Card is used in a booking.')
+                    return redirect(url_for('cards'))
         with conn.cursor() as cur:
-            cur.execute('SELECT 1 FROM Booking WHERE Renter_Email = %s AND Card_Number = %s', (email, card_number))
-            if cur.fetchone():
-                flash('Cannot delete: Card is used in a booking.')
-                return redirect(url_for('cards'))
-            cur.execute('DELETE FROM CreditCard WHERE Renter_Email = %s AND Card_Number = %s', (email, card_number))
-            conn.commit()
+            repository.delete_card(cur, email, card_number)
+        conn.commit()
+    caches.cards.invalidate(email)
     flash('Credit card deleted!')
     return redirect(url_for('cards'))
 
@@ -766,27 +794,14 @@ def delete_card(card_number):
 # --- Property Management (Agent) ---
 
 @app.route('/properties')
+@admission.admit('listing')
 def properties():
     if session.get('role') != 'agent':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
+    with read_connection(db.shard_for_agent(email)) as conn:
         with conn.cursor() as cur:
-            cur.execute('''
-                SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Price, p.Availability, 
-                       p.Square_Footage, p.Description, p.Type, n.Name,
-                       COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, NULL) as Bedrooms,
-                       a.Floor, l.Purpose_of_land, c.Business_Type
-                FROM Property p
-                LEFT JOIN House h ON p.Property_ID = h.Property_ID
-                LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
-                LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
-                LEFT JOIN Land l ON p.Property_ID = l.Property_ID
-                LEFT JOIN Commercial_Building c ON p.Property_ID = c.Property_ID
-                LEFT JOIN Neighborhood n ON p.Neighborhood = n.Name
-                WHERE p.Agent_Email = %s
-            ''', (email,))
-            properties = cur.fetchall()
+            properties = repository.list_agent_properties(cur, email)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -807,30 +822,31 @@ def properties():
                   {% endif %}
                 {% endwith %}
                 <a href="{{ url_for('add_property') }}" class="btn">Add Property</a>
+                <a href="{{ url_for('bulk_adjust_properties') }}" class="btn">Bulk Update</a>
                 <div class="property-details">
                     {% for prop in properties %}
                         <div class="property-card">
-                            <h3>Property ID: {{ prop[0] }}</h3>
-                            <p>Address: {{ prop[1] }}, {{ prop[2] }}, {{ prop[3] }} {{ prop[4] }}</p>
-                            <p>Price: ${{ prop[5] }}</p>
-                            <p>Status: {{ 'Available' if prop[6] else 'Unavailable' }}</p>
-                            <p>Square Footage: {{ prop[7] }}</p>
-                            <p>Description: {{ prop[8] }}</p>
-                            <p>Type: {{ prop[9] }}</p>
-                            <p>Neighborhood: {{ prop[10] if prop[10] else 'N/A' }}</p>
-                            {% if prop[11] %}
-                                <p>Bedrooms: {{ prop[11] }}</p>
+                            <h3>Property ID: {{ prop.property_id }}</h3>
+                            <p>Address: {{ prop.street }}, {{ prop.city }}, {{ prop.state }} {{ prop.zip }}</p>
+                            <p>Price: ${{ prop.price }}</p>
+                            <p>Status: {{ 'Available' if prop.availability else 'Unavailable' }}</p>
+                            <p>Square Footage: {{ prop.square_footage }}</p>
+                            <p>Description: {{ prop.description }}</p>
+                            <p>Type: {{ prop.type }}</p>
+                            <p>Neighborhood: {{ prop.neighborhood if prop.neighborhood else 'N/A' }}</p>
+                            {% if prop.bedrooms %}
+                                <p>Bedrooms: {{ prop.bedrooms }}</p>
                             {% endif %}
-                            {% if prop[9] == 'Apartment' and prop[12] %}
-                                <p>Floor: {{ prop[12] }}</p>
-                            {% elif prop[9] == 'Land' and prop[13] %}
-                                <p>Purpose: {{ prop[13] }}</p>
-                            {% elif prop[9] == 'Commercial Building' and prop[14] %}
-                                <p>Business Type: {{ prop[14] }}</p>
+                            {% if prop.type == 'Apartment' and prop.floor %}
+                                <p>Floor: {{ prop.floor }}</p>
+                            {% elif prop.type == 'Land' and prop.purpose_of_land %}
+                                <p>Purpose: {{ prop.purpose_of_land }}</p>
+                            {% elif prop.type == 'Commercial Building' and prop.business_type %}
+                                <p>Business Type: {{ prop.business_type }}</p>
                             {% endif %}
                             <div class="btn-group">
-                                <a href="{{ url_for('edit_property', property_id=prop[0]) }}" class="btn">Edit</a>
-                                <a href="{{ url_for('delete_property', property_id=prop[0]) }}" class="btn btn-danger">Delete</a>
+                                <a href="{{ url_for('edit_property', property_id=prop.property_id) }}" class="btn">Edit</a>
+                                <a href="{{ url_for('delete_property', property_id=prop.property_id) }}" class="btn btn-danger">Delete</a>
                             </div>
                         </div>
                     {% endfor %}
@@ -846,10 +862,7 @@ def add_property():
     if session.get('role') != 'agent':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT Name FROM Neighborhood')
-            neighborhoods = cur.fetchall()
+    neighborhoods = caches.neighborhoods.all()
     if request.method == 'POST':
         street = request.form['street']
         city = request.form['city']
@@ -877,7 +890,7 @@ def add_property():
             flash('Invalid numeric values provided.')
             return redirect(url_for('add_property'))
             
-        with get_db_connection() as conn:
+        with get_db_connection(shard=db.shard_for_agent(email)) as conn:
             with conn.cursor() as cur:
                 # Insert into Property table
                 cur.execute('''
@@ -906,6 +919,7 @@ def add_property():
                     cur.execute('INSERT INTO Vacation_Home (Property_ID, Number_of_rooms) VALUES (%s, %s)',
                               (property_id, number_of_rooms))
                 
+                invalidation.publish(cur, 'property', property_id, city)
                 conn.commit()
         flash('Property added!')
         return redirect(url_for('properties'))
@@ -991,7 +1005,7 @@ def add_property():
                         <label for="neighborhood">Neighborhood:</label>
                         <select id="neighborhood" name="neighborhood" required>
                             {% for n in neighborhoods %}
-                                <option value="{{ n[0] }}">{{ n[0] }}</option>
+                                <option value="{{ n.name }}">{{ n.name }}</option>
                             {% endfor %}
                         </select>
                     </div>
@@ -1025,26 +1039,13 @@ def edit_property(property_id):
     if session.get('role') != 'agent':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
+    shard = db.shard_for_agent(email)
+    with get_db_connection(shard=shard) as conn:
         with conn.cursor() as cur:
-            cur.execute('''
-                SELECT p.Street, p.City, p.State, p.Zip, p.Price, p.Availability, p.Square_Footage, 
-                       p.Description, p.Type, p.Neighborhood,
-                       COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, NULL) as Bedrooms,
-                       a.Floor, l.Purpose_of_land, c.Business_Type
-                FROM Property p
-                LEFT JOIN House h ON p.Property_ID = h.Property_ID
-                LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
-                LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
-                LEFT JOIN Land l ON p.Property_ID = l.Property_ID
-                LEFT JOIN Commercial_Building c ON p.Property_ID = c.Property_ID
-                WHERE p.Property_ID = %s AND p.Agent_Email = %s
-            ''', (property_id, email))
-            property = cur.fetchone()
+            property = repository.get_agent_property(cur, email, property_id)
             if not property:
                 abort(404)
-            cur.execute('SELECT Name FROM Neighborhood')
-            neighborhoods = cur.fetchall()
+    neighborhoods = caches.neighborhoods.all()
     if request.method == 'POST':
         street = request.form['street']
         city = request.form['city']
@@ -1066,49 +1067,30 @@ def edit_property(property_id):
         try:
             price = float(price)
             square_footage = float(square_footage)
-            if number_of_rooms:
-                number_of_rooms = int(number_of_rooms)
+            number_of_rooms = int(number_of_rooms) if number_of_rooms else None
+            floor = int(building_type) if building_type else None
         except ValueError:
             flash('Invalid numeric values provided.')
             return redirect(url_for('edit_property', property_id=property_id))
             
-        with get_db_connection() as conn:
+        changes = {
+            'street': street, 'city': city, 'state': state, 'zip': zip_code, 'price': price,
+            'availability': available, 'square_footage': square_footage, 'description': description,
+            'type': property_type, 'neighborhood': neighborhood, 'bedrooms': number_of_rooms, 'floor': floor,
+            'purpose_of_land': purpose_of_land or None, 'business_type': business_type or None,
+        }
+        with get_db_connection(shard=shard) as conn:
             with conn.cursor() as cur:
-                # Update Property table
-                cur.execute('''
-                    UPDATE Property
-                    SET Street = %s, City = %s, State = %s, Zip = %s, Price = %s, 
-                        Availability = %s, Square_Footage = %s, Description = %s, 
-                        Type = %s, Neighborhood = %s
-                    WHERE Property_ID = %s AND Agent_Email = %s
-                ''', (street, city, state, zip_code, price, available, square_footage, 
-                      description, property_type, neighborhood, property_id, email))
-                
-                # Delete old property type record
-                cur.execute('DELETE FROM House WHERE Property_ID = %s', (property_id,))
-                cur.execute('DELETE FROM Apartment WHERE Property_ID = %s', (property_id,))
-                cur.execute('DELETE FROM Commercial_Building WHERE Property_ID = %s', (property_id,))
-                cur.execute('DELETE FROM Land WHERE Property_ID = %s', (property_id,))
-                cur.execute('DELETE FROM Vacation_Home WHERE Property_ID = %s', (property_id,))
-                
-                # Insert new property type record
-                if property_type == 'House':
-                    cur.execute('INSERT INTO House (Property_ID, Number_of_rooms) VALUES (%s, %s)',
-                              (property_id, number_of_rooms))
-                elif property_type == 'Apartment':
-                    cur.execute('INSERT INTO Apartment (Property_ID, Number_of_rooms, Floor) VALUES (%s, %s, %s)',
-                              (property_id, number_of_rooms, building_type))
-                elif property_type == 'Commercial Building':
-                    cur.execute('INSERT INTO Commercial_Building (Property_ID, Business_Type) VALUES (%s, %s)',
-                              (property_id, business_type))
-                elif property_type == 'Land':
-                    cur.execute('INSERT INTO Land (Property_ID, Purpose_of_land) VALUES (%s, %s)',
-                              (property_id, purpose_of_land))
-                elif property_type == 'Vacation Home':
-                    cur.execute('INSERT INTO Vacation_Home (Property_ID, Number_of_rooms) VALUES (%s, %s)',
-                              (property_id, number_of_rooms))
-                
+                # Only the columns and subtype row that actually changed are written.
+                touched = repository.update_property(cur, email, property, changes)
                 conn.commit()
+        caches.property_details.invalidate(property_id)
+        metrics.increment('property_edits_total', changed='yes' if touched else 'no')
+        for table, count in touched.items():
+            metrics.increment('property_edit_rows_total', count, table=table)
+        if not touched:
+            flash('No changes to save.')
+            return redirect(url_for('properties'))
         flash('Property updated!')
         return redirect(url_for('properties'))
     return render_template_string('''
@@ -1133,67 +1115,67 @@ def edit_property(property_id):
                 <form method="post">
                     <div>
                         <label for="street">Street:</label>
-                        <input type="text" id="street" name="street" value="{{ property[0] }}" required>
+                        <input type="text" id="street" name="street" value="{{ property.street }}" required>
                     </div>
                     <div>
                         <label for="city">City:</label>
-                        <input type="text" id="city" name="city" value="{{ property[1] }}" required>
+                        <input type="text" id="city" name="city" value="{{ property.city }}" required>
                     </div>
                     <div>
                         <label for="state">State:</label>
-                        <input type="text" id="state" name="state" value="{{ property[2] }}" required>
+                        <input type="text" id="state" name="state" value="{{ property.state }}" required>
                     </div>
                     <div>
                         <label for="zip">Zip:</label>
-                        <input type="text" id="zip" name="zip" value="{{ property[3] }}" required>
+                        <input type="text" id="zip" name="zip" value="{{ property.zip }}" required>
                     </div>
                     <div>
                         <label for="price">Price:</label>
-                        <input type="number" id="price" name="price" step="0.01" value="{{ property[4] }}" required>
+                        <input type="number" id="price" name="price" step="0.01" value="{{ property.price }}" required>
                     </div>
                     <div>
                         <label for="available">Available:</label>
-                        <input type="checkbox" id="available" name="available" {% if property[5] %}checked{% endif %}>
+                        <input type="checkbox" id="available" name="available" {% if property.availability %}checked{% endif %}>
                     </div>
                     <div>
                         <label for="square_footage">Square Footage:</label>
-                        <input type="number" id="square_footage" name="square_footage" step="0.01" value="{{ property[6] }}" required>
+                        <input type="number" id="square_footage" name="square_footage" step="0.01" value="{{ property.square_footage }}" required>
                     </div>
                     <div>
                         <label for="description">Description:</label>
-                        <textarea id="description" name="description" required>{{ property[7] }}</textarea>
+                        <textarea id="description" name="description" required>{{ property.description }}</textarea>
                     </div>
                     <div>
                         <label for="type">Type:</label>
                         <select id="type" name="type" required onchange="showTypeSpecificFields()">
-                            <option value="House" {% if property[8] == 'House' %}selected{% endif %}>House</option>
-                            <option value="Apartment" {% if property[8] == 'Apartment' %}selected{% endif %}>Apartment</option>
-                            <option value="Commercial Building" {% if property[8] == 'Commercial Building' %}selected{% endif %}>Commercial Building</option>
-                            <option value="Vacation Home" {% if property[8] == 'Vacation Home' %}selected{% endif %}>Vacation Home</option>
-                            <option value="Land" {% if property[8] == 'Land' %}selected{% endif %}>Land</option>
+                            <option value="House" {% if property.type == 'House' %}selected{% endif %}>House</option>
+                            <option value="Apartment" {% if property.type == 'Apartment' %}selected{% endif %}>Apartment</option>
+                            <option value="Commercial Building" {% if property.type == 'Commercial Building' %}selected{% endif %}>Commercial Building</option>
+                            <option value="Vacation Home" {% if property.type == 'Vacation Home' %}selected{% endif %}>Vacation Home</option>
+                            <option value="Land" {% if property.type == 'Land' %}selected{% endif %}>Land</option>
                         </select>
                     </div>
                     <div id="rooms-field" style="display: none;">
                         <label for="number_of_rooms">Number of Rooms:</label>
-                        <input type="number" id="number_of_rooms" name="number_of_rooms" min="1" value="{{ property[10] if property[10] else '' }}">
+                        <input type="number" id="number_of_rooms" name="number_of_rooms" min="1" value="{{ property.bedrooms if property.bedrooms else '' }}">
                     </div>
                     <div id="building-type-field" style="display: none;">
                         <label for="building_type">Floor:</label>
-                        <input type="number" id="building_type" name="building_type" min="1" value="{{ property[11] if property[8] == 'Apartment' and property[11] else '' }}">
+                        <input type="number" id="building_type" name="building_type" min="1" value="{{ property.floor if property.type == 'Apartment' and property.floor else '' }}">
                     </div>
                     <div id="business-type-field" style="display: none;">
                         <label for="business_type">Business Type:</label>
-                        <input type="text" id="business_type" name="business_type" value="{{ property[13] if property[8] == 'Commercial Building' and property[13] else '' }}">
+                        <input type="text" id="business_type" name="business_type" value="{{ property.business_type if property.type == 'Commercial Building' and property.business_type else '' }}">
                     </div>
                     <div id="purpose-field" style="display: none;">
                         <label for="purpose_of_land">Purpose of Land:</label>
-                        <textarea id="purpose_of_land" name="purpose_of_land">{{ property[12] if property[8] == 'Land' and property[12] else '' }}</textarea>
+                        <textarea id="purpose_of_land" name="purpose_of_land">{{ property.purpose_of_land if property.type == 'Land' and property.purpose_of_land else '' }}</textarea>
                     </div>
                     <div>
                         <label for="neighborhood">Neighborhood:</label>
                         <select id="neighborhood" name="neighborhood" required>
                             {% for n in neighborhoods %}
-                                <option value="{{ n[0] }}" {% if n[0] == property[9] %}selected{% endif %}>{{ n[0] }}</option>
+                                <option value="{{ n.name }}" {% if n.name == property.neighborhood %}selected{% endif %}>{{ n.name }}</option>
                             {% endfor %}
                         </select>
                     </div>
@@ -1222,15 +1204,129 @@ def edit_property(property_id):
         </html>
     ''', property=property, neighborhoods=neighborhoods)
 
+@app.route('/properties/bulk', methods=['GET', 'POST'])
+@ratelimit.limit('bulk', methods=['POST'])
+@admission.admit('listing')
+def bulk_adjust_properties():
+    if session.get('role') != 'agent':
+        abort(403)
+    email = session['user']
+    form = request.form
+    preview = None
+    if request.method == 'POST':
+        try:
+            property_ids = [int(i) for i in form.get('property_ids', '').replace(',', ' ').split()]
+            change = float(form['price_change']) if form.get('price_change') else None
+        except ValueError:
+            flash('Property IDs and the price change must be numbers.')
+            return redirect(url_for('bulk_adjust_properties'))
+        filters = dict(city=form.get('city') or None, neighborhood=form.get('neighborhood') or None,
+                       property_type=form.get('type') or None, property_ids=property_ids or None)
+        availability = {'available': True, 'unavailable': False}.get(form.get('availability'))
+        percent = change if form.get('price_mode') == 'percent' else None
+        amount = change if form.get('price_mode') == 'amount' else None
+        if percent is None and amount is None and availability is None:
+            flash('Choose a price change and/or an availability.')
+            return redirect(url_for('bulk_adjust_properties'))
+        with get_db_connection(shard=db.shard_for_agent(email)) as conn:
+            if form.get('action') == 'apply':
+                updated = bulk.adjust_properties(conn, email, percent=percent, amount=amount,
+                                                 availability=availability, **filters)
+                caches.property_details.clear()
+                flash(f'{updated} properties updated.')
+                return redirect(url_for('properties'))
+            with conn.cursor() as cur:
+                preview = bulk.preview_adjustment(cur, email, **filters)
+    return render_template_string('''
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Bulk Update Properties - Real Estate Management</title>
+            <link rel="stylesheet" href="{{ url_for('static', filename='style.css') }}">
+        </head>
+        <body>
+            <div class="container">
+                <h2>Bulk Update Properties</h2>
+                {% with messages = get_flashed_messages() %}
+                  {% if messages %}
+                    <div class="flash-messages">
+                        {% for msg in messages %}
+                            <div class="flash-message">{{ msg }}</div>
+                        {% endfor %}
+                    </div>
+                  {% endif %}
+                {% endwith %}
+                {% if preview %}
+                    <div class="property-card">
+                        <p>{{ preview[0] }} properties match{% if preview[0] %} (prices ${{ preview[1] }} to ${{ preview[2] }}){% endif %}.</p>
+                    </div>
+                {% endif %}
+                <form method="post">
+                    <div>
+                        <label for="city">City:</label>
+                        <input type="text" id="city" name="city" value="{{ form.get('city', '') }}">
+                    </div>
+                    <div>
+                        <label for="neighborhood">Neighborhood:</label>
+                        <select id="neighborhood" name="neighborhood">
+                            <option value="">Any</option>
+                            {% for n in neighborhoods %}
+                                <option value="{{ n.name }}" {% if n.name == form.get('neighborhood') %}selected{% endif %}>{{ n.name }}</option>
+                            {% endfor %}
+                        </select>
+                    </div>
+                    <div>
+                        <label for="type">Property Type:</label>
+                        <select id="type" name="type">
+                            <option value="">Any</option>
+                            {% for t in ['House', 'Apartment', 'Commercial Building', 'Vacation Home', 'Land'] %}
+                                <option value="{{ t }}" {% if t == form.get('type') %}selected{% endif %}>{{ t }}</option>
+                            {% endfor %}
+                        </select>
+                    </div>
+                    <div>
+                        <label for="property_ids">Property IDs (comma separated):</label>
+                        <input type="text" id="property_ids" name="property_ids" value="{{ form.get('property_ids', '') }}">
+                    </div>
+                    <div>
+                        <label for="price_mode">Price Change:</label>
+                        <select id="price_mode" name="price_mode">
+                            <option value="">No change</option>
+                            <option value="percent" {% if form.get('price_mode') == 'percent' %}selected{% endif %}>Percent (%)</option>
+                            <option value="amount" {% if form.get('price_mode') == 'amount' %}selected{% endif %}>Amount ($)</option>
+                        </select>
+                        <input type="number" id="price_change" name="price_change" step="0.01" value="{{ form.get('price_change', '') }}">
+                    </div>
+                    <div>
+                        <label for="availability">Availability:</label>
+                        <select id="availability" name="availability">
+                            <option value="">No change</option>
+                            <option value="available" {% if form.get('availability') == 'available' %}selected{% endif %}>Available</option>
+                            <option value="unavailable" {% if form.get('availability') == 'unavailable' %}selected{% endif %}>Unavailable</option>
+                        </select>
+                    </div>
+                    <div class="btn-group">
+                        <button type="submit" name="action" value="preview" class="btn">Preview</button>
+                        {% if preview and preview[0] %}
+                            <button type="submit" name="action" value="apply" class="btn btn-danger">Apply to {{ preview[0] }} properties</button>
+                        {% endif %}
+                        <a href="{{ url_for('properties') }}" class="btn">Back</a>
+                    </div>
+                </form>
+            </div>
+        </body>
+        </html>
+    ''', preview=preview, form=form, neighborhoods=sorted(caches.neighborhoods.all()))
+
 @app.route('/properties/delete/<int:property_id>')
 def delete_property(property_id):
     if session.get('role') != 'agent':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
+    with get_db_connection(shard=db.shard_for_agent(email)) as conn:
         with conn.cursor() as cur:
             # First check if property exists and belongs to the agent
-            cur.execute('SELECT Type FROM Property WHERE Property_ID = %s AND Agent_Email = %s', (property_id, email))
+            cur.execute('SELECT Type, City FROM Property WHERE Property_ID = %s AND Agent_Email = %s', (property_id, email))
             property_type = cur.fetchone()
             if not property_type:
                 flash('Property not found or you do not have permission to delete it.')
@@ -1256,13 +1352,17 @@ def delete_property(property_id):
 
             # Finally delete from Property table
             cur.execute('DELETE FROM Property WHERE Property_ID = %s', (property_id,))
+            invalidation.publish(cur, 'property', property_id, property_type[1])
             conn.commit()
+    caches.property_details.invalidate(property_id)
     flash('Property deleted!')
     return redirect(url_for('properties'))
 
 @app.route('/search', methods=['GET', 'POST'])
+@ratelimit.limit('search', methods=['POST'])
+@admission.admit('search')
 def search():
-    results = []
+    found = repository.SearchResults([], None, None, None, None)
     if request.method == 'POST':
         location = request.form['location']
         ptype = request.form.get('ptype')
@@ -1271,45 +1371,16 @@ def search():
         min_price = request.form.get('min_price')
         max_price = request.form.get('max_price')
         order_by = request.form.get('order_by')
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                query = '''
-                    SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description, 
-                        COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, NULL) as Bedrooms,
-                        p.Square_Footage, p.Neighborhood, n.Crime_Rate, n.Nearby_Schools,
-                        a.Floor, l.Purpose_of_land, c.Business_Type
-                    FROM Property p
-                    LEFT JOIN House h ON p.Property_ID = h.Property_ID
-                    LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
-                    LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
-                    LEFT JOIN Land l ON p.Property_ID = l.Property_ID
-                    LEFT JOIN Commercial_Building c ON p.Property_ID = c.Property_ID
-                    LEFT JOIN Neighborhood n ON p.Neighborhood = n.Name
-                    WHERE p.Availability = TRUE
-                '''
-                params = []
-                if location:
-                    query += ' AND p.City = %s'
-                    params.append(location)
-                if ptype:
-                    query += ' AND p.Type = %s'
-                    params.append(ptype)
-                if min_bed:
-                    query += ' AND COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, 0) >= %s'
-                    params.append(min_bed)
-                if max_bed:
-                    query += ' AND COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, 100) <= %s'
-                    params.append(max_bed)
-                if min_price:
-                    query += ' AND p.Price >= %s'
-                    params.append(min_price)
-                if max_price:
-                    query += ' AND p.Price <= %s'
-                    params.append(max_price)
-                if order_by in ['price', 'bedrooms']:
-                    query += f' ORDER BY { "p.Price" if order_by == "price" else "Bedrooms" }'
-                cur.execute(query, params)
-                results = cur.fetchall()
+        keywords = request.form.get('keywords')
+        neighborhood = request.form.get('neighborhood')
+        if db.SHARDS:
+            found = shards.search_properties(location, None, ptype, min_bed, max_bed,
+                                             min_price, max_price, order_by, keywords, neighborhood)
+        else:
+            with read_connection() as conn:
+                with conn.cursor() as cur:
+                    found = repository.search_properties(cur, location, None, ptype, min_bed, max_bed,
+                                                         min_price, max_price, order_by, keywords, neighborhood)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -1325,6 +1396,14 @@ def search():
                         <label for="location">City:</label>
                         <input type="text" id="location" name="location">
                     </div>
+                    <div>
+                        <label for="neighborhood">Neighborhood:</label>
+                        <input type="text" id="neighborhood" name="neighborhood">
+                    </div>
+                    <div>
+                        <label for="keywords">Keywords:</label>
+                        <input type="text" id="keywords" name="keywords" placeholder="pool, &quot;ocean view&quot;, pet friendly">
+                    </div>
                     <div>
                         <label for="ptype">Type:</label>
                         <select id="ptype" name="ptype">
@@ -1364,31 +1443,39 @@ def search():
                         <input type="submit" value="Search" class="btn">
                     </div>
                 </form>
+                {% if found.suggested_city or found.suggested_neighborhood %}
+                    <p>Did you mean {{ [found.suggested_city, found.suggested_neighborhood]|select|join(', ') }}?
+                       Showing results for that instead.</p>
+                {% endif %}
                 <div class="property-details">
-                    {% for r in results %}
+                    {% for r in found.results %}
                         <div class="property-card">
-                            <h3>Property ID: {{ r[0] }}</h3>
-                            <p>Address: {{ r[1] }}, {{ r[2] }}, {{ r[3] }} {{ r[4] }}</p>
-                            <p class="price">Price: ${{ r[5] }}</p>
-                            <p>Type: {{ r[6] }}</p>
-                            <p>Description: {{ r[7] }}</p>
-                            <p>Bedrooms: {{ r[8] if r[8] else 'N/A' }}</p>
-                            <p>Square Footage: {{ r[9] }}</p>
+                            <h3>Property ID: {{ r.property_id }}</h3>
+                            <p>Address: {{ r.street }}, {{ r.city }}, {{ r.state }} {{ r.zip }}</p>
+                            <p class="price">Price: ${{ r.price }}</p>
+                            <p>Type: {{ r.type }}</p>
+                            <p>Description: {{ r.description }}</p>
+                            <p>Bedrooms: {{ r.bedrooms if r.bedrooms else 'N/A' }}</p>
+                            <p>Square Footage: {{ r.square_footage }}</p>
                             <div class="neighborhood-info">
-                                <p>Neighborhood: {{ r[10] if r[10] else 'N/A' }}</p>
-                                <p>Crime Rate: {{ r[11] if r[11] else 'N/A' }}</p>
-                                <p>Nearby Schools: {{ r[12] if r[12] else 'N/A' }}</p>
+                                <p>Neighborhood: {{ r.neighborhood if r.neighborhood else 'N/A' }}</p>
+                                <p>Crime Rate: {{ r.crime_rate if r.crime_rate else 'N/A' }}</p>
+                                <p>Nearby Schools: {{ r.nearby_schools if r.nearby_schools else 'N/A' }}</p>
+                                {% if r.neighborhood_listings %}
+                                    <p>Listings nearby: {{ r.neighborhood_listings }}, average ${{ r.neighborhood_average_price }}</p>
+                                    <p>Bookings nearby (last 30 days): {{ r.neighborhood_bookings_30d }}</p>
+                                {% endif %}
                             </div>
-                            {% if r[6] == 'Apartment' and r[13] %}
-                                <p>Floor: {{ r[13] }}</p>
-                            {% elif r[6] == 'Land' and r[14] %}
-                                <p>Purpose: {{ r[14] }}</p>
-                            {% elif r[6] == 'Commercial Building' and r[15] %}
-                                <p>Business Type: {{ r[15] }}</p>
+                            {% if r.type == 'Apartment' and r.floor %}
+                                <p>Floor: {{ r.floor }}</p>
+                            {% elif r.type == 'Land' and r.purpose_of_land %}
+                                <p>Purpose: {{ r.purpose_of_land }}</p>
+                            {% elif r.type == 'Commercial Building' and r.business_type %}
+                                <p>Business Type: {{ r.business_type }}</p>
                             {% endif %}
                             {% if session.get('role') == 'renter' %}
                                 <div class="btn-group">
-                                    <a href="{{ url_for('book_property', property_id=r[0]) }}" class="btn">Book</a>
+                                    <a href="{{ url_for('book_property', property_id=r.property_id) }}" class="btn">Book</a>
                                 </div>
                             {% endif %}
                         </div>
@@ -1398,31 +1485,20 @@ def search():
             </div>
         </body>
         </html>
-    ''', results=results)
+    ''', found=found)
 
 @app.route('/bookings')
+@admission.admit('listing')
 def bookings():
     role = session.get('role')
     email = session.get('user')
     bookings = []
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            if role == 'renter':
-                cur.execute('''
-                    SELECT b.Booking_ID, b.Property_ID, b.Booking_Date, b.Card_Number, p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description
-                    FROM Booking b
-                    JOIN Property p ON b.Property_ID = p.Property_ID
-                    WHERE b.Renter_Email = %s
-                ''', (email,))
-                bookings = cur.fetchall()
-            elif role == 'agent':
-                cur.execute('''
-                    SELECT b.Booking_ID, b.Property_ID, b.Booking_Date, b.Card_Number, b.Renter_Email, p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description
-                    FROM Booking b
-                    JOIN Property p ON b.Property_ID = p.Property_ID
-                    WHERE p.agent_email = %s
-                ''', (email,))
-                bookings = cur.fetchall()
+    if role == 'renter' and db.SHARDS:
+        bookings = shards.renter_bookings(email)
+    elif role in ('renter', 'agent'):
+        with read_connection(db.shard_for_agent(email) if role == 'agent' else None) as conn:
+            with conn.cursor() as cur:
+                bookings = repository.list_bookings(cur, email, role)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -1445,19 +1521,19 @@ def bookings():
                 <div class="property-details">
                     {% for b in bookings %}
                         <div class="property-card">
-                            <h3>Booking ID: {{ b[0] }}</h3>
-                            <p>Property ID: {{ b[1] }}</p>
-                            <p>Booking Date: {{ b[2] }}</p>
-                            <p>Card: {{ b[3] }}</p>
+                            <h3>Booking ID: {{ b.booking_id }}</h3>
+                            <p>Property ID: {{ b.property_id }}</p>
+                            <p>Booking Date: {{ b.booking_date }}</p>
+                            <p>Card: {{ b.card_number }}</p>
                             {% if session.get('role') == 'agent' %}
-                                <p>Renter: {{ b[4] }}</p>
+                                <p>Renter: {{ b.renter_email }}</p>
                             {% endif %}
-                            <p>Address: {{ b[4 if session.get('role') == 'renter' else 5] }}, {{ b[5 if session.get('role') == 'renter' else 6] }}, {{ b[6 if session.get('role') == 'renter' else 7] }} {{ b[7 if session.get('role') == 'renter' else 8] }}</p>
-                            <p class="price">Price: {{ b[8 if session.get('role') == 'renter' else 9] }}</p>
-                            <p>Type: {{ b[9 if session.get('role') == 'renter' else 10] }}</p>
-                            <p>Description: {{ b[10 if session.get('role') == 'renter' else 11] }}</p>
+                            <p>Address: {{ b.street }}, {{ b.city }}, {{ b.state }} {{ b.zip }}</p>
+                            <p class="price">Price: {{ b.price }}</p>
+                            <p>Type: {{ b.type }}</p>
+                            <p>Description: {{ b.description }}</p>
                             <div class="btn-group">
-                                <a href="{{ url_for('cancel_booking', booking_id=b[0]) }}" class="btn btn-danger">Cancel</a>
+                                <a href="{{ url_for('cancel_booking', booking_id=b.booking_id) }}" class="btn btn-danger">Cancel</a>
                             </div>
                         </div>
                     {% endfor %}
@@ -1469,13 +1545,19 @@ def bookings():
     ''', bookings=bookings)
 
 @app.route('/bookings/cancel/<int:booking_id>')
+@ratelimit.limit('booking')
+@admission.admit('booking')
 def cancel_booking(booking_id):
     role = session.get('role')
     email = session.get('user')
-    with get_db_connection() as conn:
+    shard = db.shard_for_id(booking_id)
+    with get_db_connection(shard=shard) as conn:
         with conn.cursor() as cur:
             if role == 'renter':
-                cur.execute('DELETE FROM Booking WHERE Booking_ID = %s AND Renter_Email = %s', (booking_id, email))
+                cur.execute('''
+                    DELETE FROM Booking WHERE Booking_ID = %s AND Renter_Email = %s
+                    RETURNING Property_ID, Renter_Email, COALESCE(End_Date::date - Start_Date::date, 1)
+                ''', (booking_id, email))
             elif role == 'agent':
                 cur.execute('''
                     DELETE FROM Booking
@@ -1483,19 +1565,141 @@ def cancel_booking(booking_id):
                         SELECT 1 FROM Property p
                         WHERE p.Property_ID = Booking.Property_ID AND p.agent_email = %s
                     )
+                    RETURNING Property_ID, Renter_Email, COALESCE(End_Date::date - Start_Date::date, 1)
                 ''', (booking_id, email))
+            if role in ('renter', 'agent'):
+                for property_id, renter, nights in cur.fetchall():
+                    invalidation.publish(cur, 'booking', property_id)
+                    jobs.enqueue(cur, 'booking_cancelled', email=renter, property_id=property_id,
+                                 booking_id=booking_id, nights=nights)
             conn.commit()
     flash('Booking canceled!')
     return redirect(url_for('bookings'))
 
+@app.route('/analytics')
+@admission.admit('listing')
+def analytics():
+    if session.get('role') != 'agent':
+        abort(403)
+    email = session['user']
+    today = datetime.now().date()
+    try:
+        last_night = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else today
+        first_night = (datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() if request.args.get('start_date')
+                       else last_night - timedelta(days=364))
+    except ValueError:
+        flash('Invalid date format. Use YYYY-MM-DD.')
+        return redirect(url_for('analytics'))
+    if first_night > last_night:
+        flash('Start date must be on or before end date.')
+        return redirect(url_for('analytics'))
+    with get_db_connection(shard=db.shard_for_agent(email)) as conn:
+        with conn.cursor() as cur:
+            stats = repository.agent_analytics(cur, email, first_night, last_night)
+    days = (last_night - first_night).days + 1
+    totals = dict(nights=sum(s.nights for s in stats), revenue=sum(s.revenue for s in stats),
+                  stays=sum(s.stays for s in stats))
+    return render_template_string('''
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Analytics - Real Estate Management</title>
+            <link rel="stylesheet" href="{{ url_for('static', filename='style.css') }}">
+        </head>
+        <body>
+            <div class="container">
+                <h2>Analytics</h2>
+                {% with messages = get_flashed_messages() %}
+                  {% if messages %}
+                    <div class="flash-messages">
+                        {% for msg in messages %}
+                            <div class="flash-message">{{ msg }}</div>
+                        {% endfor %}
+                    </div>
+                  {% endif %}
+                {% endwith %}
+                <form method="get">
+                    <div>
+                        <label for="start_date">From:</label>
+                        <input type="date" id="start_date" name="start_date" value="{{ first_night }}">
+                    </div>
+                    <div>
+                        <label for="end_date">To:</label>
+                        <input type="date" id="end_date" name="end_date" value="{{ last_night }}">
+                    </div>
+                    <button type="submit" class="btn">Show</button>
+                </form>
+                <div class="property-card">
+                    <h3>All Properties ({{ days }} nights)</h3>
+                    <p>Occupancy: {{ '%.1f'|format(100 * totals.nights / (days * stats|length)) if stats else '0.0' }}%</p>
+                    <p class="price">Revenue: ${{ '%.2f'|format(totals.revenue) }}</p>
+                    <p>Average nightly revenue: ${{ '%.2f'|format(totals.revenue / totals.nights) if totals.nights else '0.00' }}</p>
+                    <p>Bookings: {{ totals.stays }}</p>
+                </div>
+                <div class="property-details">
+                    {% for s in stats %}
+                        <div class="property-card">
+                            <h3>Property ID: {{ s.property_id }} ({{ s.type }})</h3>
+                            <p>Address: {{ s.street }}, {{ s.city }}, {{ s.state }} {{ s.zip }}</p>
+                            <p>Occupancy: {{ '%.1f'|format(100 * s.nights / days) }}% ({{ s.nights }} nights)</p>
+                            <p class="price">Revenue: ${{ '%.2f'|format(s.revenue) }}</p>
+                            <p>Average nightly revenue: ${{ '%.2f'|format(s.revenue / s.nights) if s.nights else '0.00' }}</p>
+                            <p>Bookings: {{ s.stays }}</p>
+                        </div>
+                    {% endfor %}
+                </div>
+                <a href="/" class="btn">Back to Home</a>
+            </div>
+        </body>
+        </html>
+    ''', stats=stats, totals=totals, days=days, first_night=first_night, last_night=last_night)
+
+@app.route('/admin/export/<kind>')
+def export_data(kind):
+    if session.get('role') != 'agent' or not repository.is_admin(session.get('user')):
+        abort(403)
+    fmt = request.args.get('format', 'csv')
+    if kind not in bulk.EXPORTS or fmt not in ('csv', 'ndjson'):
+        abort(400)
+    try:
+        start_date = request.args.get('start_date') and datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        end_date = request.args.get('end_date') and datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+    except ValueError:
+        abort(400)
+    filters = dict(agent_email=request.args.get('agent') or None, start_date=start_date or None, end_date=end_date or None)
+
+    def generate():
+        if db.SHARDS:
+            yield from bulk.stream_rows(kind, fmt, shards.export_rows(kind, **filters))
+            return
+        with get_db_connection() as conn:
+            yield from bulk.stream_export(conn, kind, fmt, **filters)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Scraped from the host itself; admins can also look at it in the browser.
+    if request.remote_addr not in ('127.0.0.1', '::1') and not (
+            session.get('role') == 'agent' and repository.is_admin(session.get('user'))):
+        abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/neighborhoods')
+@admission.admit('listing')
 def neighborhoods():
     if session.get('role') != 'agent':
         abort(403)
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT Name, Crime_Rate, Nearby_Schools FROM Neighborhood')
-            neighborhoods = cur.fetchall()
+    neighborhoods = sorted(caches.neighborhoods.all())
+    # Rollup rows change with every listing and booking, so they are not cached.
+    if db.SHARDS:
+        stats = shards.neighborhood_summaries()
+    else:
+        with read_connection() as conn:
+            with conn.cursor() as cur:
+                stats = repository.neighborhood_summaries(cur)
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -1510,12 +1714,16 @@ def neighborhoods():
                 <div class="property-details">
                     {% for n in neighborhoods %}
                         <div class="property-card">
-                            <h3>{{ n[0] }}</h3>
+                            <h3>{{ n.name }}</h3>
                             <div class="neighborhood-info">
-                                <p>Crime Rate: {{ n[1] }}</p>
-                                <p>Nearby Schools: {{ n[2] }}</p>
+                                <p>Crime Rate: {{ n.crime_rate }}</p>
+                                <p>Nearby Schools: {{ n.nearby_schools }}</p>
                             </div>
-                            <a href="{{ url_for('edit_neighborhood', name=n[0]) }}" class="btn">Edit</a>
+                            {% set s = stats.get(n.name) %}
+                            <p>Listings: {{ s.listings if s else 0 }} ({{ s.available if s else 0 }} available)</p>
+                            <p class="price">Average Price: {{ '$%s'|format(s.average_price) if s else 'N/A' }}</p>
+                            <p>Bookings (last 30 days): {{ s.bookings_30d if s else 0 }}</p>
+                            <a href="{{ url_for('edit_neighborhood', name=n.name) }}" class="btn">Edit</a>
                         </div>
                     {% endfor %}
                 </div>
@@ -1523,7 +1731,7 @@ def neighborhoods():
             </div>
         </body>
         </html>
-    ''', neighborhoods=neighborhoods)
+    ''', neighborhoods=neighborhoods, stats=stats)
 
 @app.route('/neighborhoods/add', methods=['GET', 'POST'])
 def add_neighborhood():
@@ -1542,7 +1750,9 @@ def add_neighborhood():
                     return redirect(url_for('neighborhoods'))
                 cur.execute('INSERT INTO Neighborhood (Name, Crime_Rate, Nearby_Schools) VALUES (%s, %s, %s)', 
                           (name, crime, schools))
+                invalidation.publish(cur, 'neighborhood', name)
                 conn.commit()
+        caches.neighborhoods.invalidate()
         flash('Neighborhood added!')
         return redirect(url_for('neighborhoods'))
     return render_template_string('''
@@ -1589,10 +1799,7 @@ def add_neighborhood():
 def edit_neighborhood(name):
     if session.get('role') != 'agent':
         abort(403)
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT Name, Crime_Rate, Nearby_Schools FROM Neighborhood WHERE Name = %s', (name,))
-            n = cur.fetchone()
+    n = caches.neighborhoods.get(name)
     if not n:
         abort(404)
     if request.method == 'POST':
@@ -1601,7 +1808,9 @@ def edit_neighborhood(name):
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('UPDATE Neighborhood SET Crime_Rate=%s, Nearby_Schools=%s WHERE Name=%s', (crime, schools, name))
+                invalidation.publish(cur, 'neighborhood', name)
                 conn.commit()
+        caches.neighborhoods.invalidate()
         flash('Neighborhood updated!')
         return redirect(url_for('neighborhoods'))
     return render_template_string('''
@@ -1626,15 +1835,15 @@ def edit_neighborhood(name):
                 <form method="post">
                     <div>
                         <label for="name">Name:</label>
-                        <input type="text" id="name" value="{{ n[0] }}" disabled>
+                        <input type="text" id="name" value="{{ n.name }}" disabled>
                     </div>
                     <div>
                         <label for="crime">Crime Rate (0-100):</label>
-                        <input type="number" id="crime" name="crime" min="0" max="100" value="{{ n[1] }}" required>
+                        <input type="number" id="crime" name="crime" min="0" max="100" value="{{ n.crime_rate }}" required>
                     </div>
                     <div>
                         <label for="schools">Nearby Schools:</label>
-                        <input type="number" id="schools" name="schools" min="0" value="{{ n[2] }}" required>
+                        <input type="number" id="schools" name="schools" min="0" value="{{ n.nearby_schools }}" required>
                     </div>
                     <input type="submit" value="Update" class="btn">
                 </form>
@@ -1645,17 +1854,15 @@ def edit_neighborhood(name):
     ''', n=n)
 
 @app.route('/rewards')
+@admission.admit('listing')
 def rewards():
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('''
-                SELECT Points FROM RewardProgram WHERE Email = %s
-            ''', (email,))
-            points = cur.fetchone()
-            if not points:
+            points = repository.reward_balance(cur, email)
+            if points is None:
                 flash('You are not enrolled in the reward program.')
                 return redirect(url_for('home'))
     return render_template_string('''
@@ -1679,7 +1886,7 @@ def rewards():
                 {% endwith %}
                 <div class="property-card">
                     <h3>Your Current Points</h3>
-                    <p class="points">{{ points[0]|int }}</p>
+                    <p class="points">{{ points|int }}</p>
                 </div>
                 <a href="{{ url_for('rewards_history') }}" class="btn">View History</a>
                 <a href="/" class="btn">Back to Home</a>
@@ -1689,51 +1896,20 @@ def rewards():
     ''', points=points)
 
 @app.route('/rewards/history')
+@admission.admit('listing')
 def rewards_history():
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
+    with read_connection() as conn:
         with conn.cursor() as cur:
-            # Check if user is enrolled in reward program
-            cur.execute('SELECT 1 FROM RewardProgram WHERE Email = %s', (email,))
-            if not cur.fetchone():
+            total_points, bookings = repository.get_reward_page(cur, email)
+            if total_points is None:
                 flash('You are not enrolled in the reward program.')
                 return redirect(url_for('home'))
-            
-            # Get current total points
-            cur.execute('SELECT Points FROM RewardProgram WHERE Email = %s', (email,))
-            total_points = cur.fetchone()[0]
-            
-            # Get booking history with points earned and duration
-            cur.execute('''
-                WITH BookingGroups AS (
-                    SELECT 
-                        MIN(b.Booking_ID) as Booking_ID,
-                        MIN(b.Booking_Date) as Booking_Date,
-                        b.Property_ID,
-                        b.Renter_Email,
-                        COUNT(*) as Duration
-                    FROM Booking b
-                    WHERE b.Renter_Email = %s
-                    GROUP BY b.Property_ID, b.Renter_Email, b.Booking_Date::date
-                )
-                SELECT 
-                    bg.Booking_ID,
-                    bg.Booking_Date,
-                    p.Property_ID,
-                    p.Street,
-                    p.City,
-                    p.State,
-                    p.Zip,
-                    p.Price,
-                    (bg.Duration * p.Price) as Points_Earned,
-                    bg.Duration
-                FROM BookingGroups bg
-                JOIN Property p ON bg.Property_ID = p.Property_ID
-                ORDER BY bg.Booking_Date DESC
-            ''', (email,))
-            bookings = cur.fetchall()
+    if db.SHARDS:
+        # The ledger is on the primary and the properties on the shards.
+        bookings = [shards.with_property(entry) for entry in bookings]
     return render_template_string('''
         <!DOCTYPE html>
         <html>
@@ -1761,13 +1937,19 @@ def rewards_history():
                 <div class="property-details">
                     {% for b in bookings %}
                         <div class="property-card">
-                            <h3>Booking ID: {{ b[0] }}</h3>
-                            <p>Date: {{ b[1] }}</p>
-                            <p>Property ID: {{ b[2] }}</p>
-                            <p>Address: {{ b[3] }}, {{ b[4] }}, {{ b[5] }} {{ b[6] }}</p>
-                            <p>Price per day: ${{ b[7] }}</p>
-                            <p>Duration: {{ b[9] }} days</p>
-                            <p class="points">Points Earned: {{ b[8]|int }}</p>
+                            {% if b.reason == 'booking' %}
+                            <h3>Booking ID: {{ b.booking_id }}</h3>
+                            <p>Date: {{ b.created_at }}</p>
+                            <p>Property ID: {{ b.property_id }}</p>
+                            <p>Address: {{ b.street }}, {{ b.city }}, {{ b.state }} {{ b.zip }}</p>
+                            <p>Price per day: ${{ b.price }}</p>
+                            <p>Duration: {{ b.nights }} days</p>
+                            <p class="points">Points Earned: {{ b.points|int }}</p>
+                            {% else %}
+                            <h3>{{ 'Cancellation' if b.reason == 'cancellation' else 'Adjustment' }}</h3>
+                            <p>Date: {{ b.created_at }}</p>
+                            <p class="points">Points: {{ b.points|int }}</p>
+                            {% endif %}
                         </div>
                     {% endfor %}
                 </div>
@@ -1779,22 +1961,19 @@ def rewards_history():
     ''', bookings=bookings, total_points=total_points)
 
 @app.route('/book/<int:property_id>', methods=['GET', 'POST'])
+@ratelimit.limit('booking', methods=['POST'])
+@admission.admit('booking')
 def book_property(property_id):
     if session.get('role') != 'renter':
         abort(403)
     email = session['user']
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT Card_Number FROM CreditCard WHERE Renter_Email = %s', (email,))
-            cards = [c[0] for c in cur.fetchall()]
-            cur.execute('''
-                SELECT p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description,
-                       n.Crime_Rate, n.Nearby_Schools
-                FROM Property p
-                LEFT JOIN Neighborhood n ON p.Neighborhood = n.Name
-                WHERE p.Property_ID = %s
-            ''', (property_id,))
-            prop = cur.fetchall()
+    # Served from the per-process caches; a miss costs one statement for the
+    # property and the cards together.
+    prop, card_list = caches.booking_page(email, property_id)
+    if not prop:
+        abort(404)
+    cards = [c.card_number for c in card_list]
+    neighborhood = caches.neighborhoods.get(prop.neighborhood) if prop.neighborhood else None
     if request.method == 'POST':
         card = request.form['card']
         start_date = request.form['start_date']
@@ -1809,43 +1988,42 @@ def book_property(property_id):
             flash('Invalid date format. Use YYYY-MM-DD.')
             return redirect(url_for('book_property', property_id=property_id))
             
-        with get_db_connection() as conn:
+        shard = db.shard_for_id(property_id)
+        with get_db_connection(shard=shard) as conn:
             with conn.cursor() as cur:
-                # Check for overlapping bookings
-                for i in range(duration):
-                    check_date = start + timedelta(days=i)
-                    cur.execute('''
-                        SELECT 1 FROM Booking 
-                        WHERE Property_ID = %s 
-                        AND Booking_Date = %s
-                    ''', (property_id, check_date))
-                    if cur.fetchone():
-                        flash('Property is not available for the selected dates.')
+                if shard is not None:
+                    # No foreign key to CreditCard on a shard; the lock keeps
+                    # delete_card from removing the card until this commits.
+                    repository.lock_card(cur, email, card)
+                    with get_db_connection() as primary:
+                        with primary.cursor() as primary_cur:
+                            card_ok = repository.get_card(primary_cur, email, card)
+                    if not card_ok:
+                        flash('Card not found.')
                         return redirect(url_for('book_property', property_id=property_id))
+                if repository.booking_overlaps(cur, property_id, start.date(), (start + timedelta(days=duration - 1)).date()):
+                    flash('Property is not available for the selected dates.')
+                    return redirect(url_for('book_property', property_id=property_id))
                 
-                # Calculate rental cost
-                price = float(prop[0][4])  # prop[0][4] is the price
-                total_cost = price * duration
+                # Charged at the price in the database; the cached one is for display
+                price = repository.lock_property_price(cur, property_id)
+                if price is None:
+                    abort(404)
+                total_cost = float(price) * duration
                 
-                # Create bookings for each day
-                for i in range(duration):
-                    booking_date = start + timedelta(days=i)
-                    cur.execute('''
-                        INSERT INTO Booking (Property_ID, Renter_Email, Booking_Date, Card_Number)
-                        VALUES (%s, %s, %s, %s)
-                    ''', (property_id, email, booking_date, card))
+                # Create bookings for each day, in one statement
+                cur.execute('''
+                    INSERT INTO Booking (Property_ID, Renter_Email, Booking_Date, Card_Number, Stay_Date)
+                    SELECT %s, %s, night, %s, night::date FROM generate_series(%s::timestamp, %s::timestamp, interval '1 day') night
+                    RETURNING Booking_ID
+                ''', (property_id, email, card, start, start + timedelta(days=duration - 1)))
+                booking_ids = sorted(booking_id for (booking_id,) in cur.fetchall())
+                invalidation.publish(cur, 'booking', property_id, prop.city)
                 
-                # Update reward points only if user is enrolled
-                cur.execute('SELECT 1 FROM RewardProgram WHERE Email = %s', (email,))
-                if cur.fetchone():
-                    cur.execute('''
-                        UPDATE RewardProgram 
-                        SET Points = Points + %s 
-                        WHERE Email = %s
-                    ''', (int(total_cost), email))
-                    flash(f'Booking successful! You earned {int(total_cost)} reward points.')
-                else:
-                    flash('Booking successful!')
+                # Points are credited by the job worker; unenrolled renters get none.
+                jobs.enqueue(cur, 'booking_reward', email=email, points=int(total_cost), property_id=property_id,
+                             booking_id=booking_ids[0], nights=duration, booking_ids=booking_ids)
+                flash(f'Booking successful! Reward program members earn {int(total_cost)} points for this stay.')
                 
                 conn.commit()
         return redirect(url_for('bookings'))
@@ -1870,13 +2048,13 @@ def book_property(property_id):
                 {% endwith %}
                 <div class="property-card">
                     <h3>Property Details</h3>
-                    <p>Address: {{ prop[0][0] }}, {{ prop[0][1] }}, {{ prop[0][2] }} {{ prop[0][3] }}</p>
-                    <p class="price">Price: ${{ prop[0][4] }}/day</p>
-                    <p>Type: {{ prop[0][5] }}</p>
-                    <p>Description: {{ prop[0][6] }}</p>
+                    <p>Address: {{ prop.street }}, {{ prop.city }}, {{ prop.state }} {{ prop.zip }}</p>
+                    <p class="price">Price: ${{ prop.price }}/day</p>
+                    <p>Type: {{ prop.type }}</p>
+                    <p>Description: {{ prop.description }}</p>
                     <div class="neighborhood-info">
-                        <p>Crime Rate: {{ prop[0][7] if prop[0][7] else 'N/A' }}</p>
-                        <p>Nearby Schools: {{ prop[0][8] if prop[0][8] else 'N/A' }}</p>
+                        <p>Crime Rate: {{ neighborhood.crime_rate if neighborhood and neighborhood.crime_rate else 'N/A' }}</p>
+                        <p>Nearby Schools: {{ neighborhood.nearby_schools if neighborhood and neighborhood.nearby_schools else 'N/A' }}</p>
                     </div>
                 </div>
                 <form method="post" class="booking-form">
@@ -1902,7 +2080,7 @@ def book_property(property_id):
             </div>
         </body>
         </html>
-    ''', cards=cards, prop=prop)
+    ''', cards=cards, prop=prop, neighborhood=neighborhood)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import decimal
+import json
+import os
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import asyncpg
+from dotenv import load_dotenv
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+import db
+import repository
+
+# Read-only JSON endpoints served from asyncio on an asyncpg pool:
+#
+#   GET /api/search?city=&date=&type=&min_bed=&max_bed=&min_price=&max_price=&order_by=&q=
+#   GET /api/properties/<id>          (renters; the property shown on /book/<id>)
+#   GET /api/neighborhoods            (agents; the data behind /neighborhoods)
+#
+#   uvicorn async_app:app --port 8000
+#
+# A request waiting on Postgres is a suspended coroutine rather than a
+# blocked thread, so one process can hold thousands of searches in flight;
+# at most ASYNC_POOL_MAX of them are on the database at once, the rest queue
+# for a connection. Queries are repository.STATEMENTS, which asyncpg prepares
+# once per connection. Logins come from the Flask session cookie, checked
+# with the same SECRET_KEY.
+
+load_dotenv()
+
+ACQUIRE_TIMEOUT = float(os.getenv('ASYNC_ACQUIRE_TIMEOUT', '10'))
+SESSION_MAX_AGE = int(datetime.timedelta(days=31).total_seconds())
+
+_cookie = SecureCookieSessionInterface()
+_sessions = URLSafeTimedSerializer(
+    os.getenv('SECRET_KEY', 'supersecretkey'),
+    salt=_cookie.salt,
+    serializer=_cookie.serializer,
+    signer_kwargs=dict(key_derivation=_cookie.key_derivation, digest_method=_cookie.digest_method)
+)
+
+_pool = None
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+async def startup():
+    global _pool
+    # Property and Booking rows live on the shards, which this app does not read.
+    if db.SHARDS:
+        raise RuntimeError('async_app does not support DB_SHARD_DSNS; serve /search from the Flask app')
+    _pool = await asyncpg.create_pool(
+        min_size=int(os.getenv('ASYNC_POOL_MIN', '1')),
+        max_size=int(os.getenv('ASYNC_POOL_MAX', '20')),
+        **db.connection_params()
+    )
+
+async def shutdown():
+    if _pool is not None:
+        await _pool.close()
+
+async def fetch(name, *params):
+    try:
+        async with _pool.acquire(timeout=ACQUIRE_TIMEOUT) as conn:
+            return await conn.fetch(repository.STATEMENTS[name], *params)
+    except asyncio.TimeoutError:
+        raise HTTPError(503, 'Database busy, try again.')
+
+def load_session(headers):
+    cookie = SimpleCookie()
+    cookie.load(headers.get('cookie', ''))
+    if 'session' not in cookie:
+        return {}
+    try:
+        return _sessions.loads(cookie['session'].value, max_age=SESSION_MAX_AGE)
+    except BadSignature:
+        return {}
+
+def require_role(session, role):
+    if session.get('role') != role:
+        raise HTTPError(403, 'Forbidden')
+
+def _arg(query, name, convert=str):
+    value = query.get(name, [''])[0]
+    if value == '':
+        return None
+    try:
+        return convert(value)
+    except (ValueError, decimal.InvalidOperation):
+        raise HTTPError(400, f'Invalid {name}')
+
+def _date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+# --- Endpoints ---
+
+async def search(query, session):
+    params = [_arg(query, 'city'), _arg(query, 'date', _date), _arg(query, 'type'),
+              _arg(query, 'min_bed', int), _arg(query, 'max_bed', int),
+              _arg(query, 'min_price', decimal.Decimal), _arg(query, 'max_price', decimal.Decimal),
+              _arg(query, 'order_by'), _arg(query, 'q'), _arg(query, 'neighborhood')]
+    found = repository.search_results(await fetch('search_properties', *params), params[0], params[9])
+    return {'results': [result._asdict() for result in found.results],
+            'did_you_mean': {'city': found.suggested_city, 'neighborhood': found.suggested_neighborhood}}
+
+async def property_detail(query, session, property_id):
+    require_role(session, 'renter')
+    rows = await fetch('property_detail', int(property_id))
+    if not rows:
+        raise HTTPError(404, 'Property not found')
+    return repository.PropertyDetail._make(rows[0])._asdict()
+
+async def neighborhoods(query, session):
+    require_role(session, 'agent')
+    names, summaries = await asyncio.gather(fetch('neighborhoods'), fetch('neighborhood_summary'))
+    stats = {row[0]: repository.NeighborhoodSummary._make(row) for row in summaries}
+    result = []
+    for row in names:
+        neighborhood = repository.Neighborhood._make(row)
+        summary = stats.get(neighborhood.name)
+        result.append({**neighborhood._asdict(),
+                       'listings': summary.listings if summary else 0,
+                       'available': summary.available if summary else 0,
+                       'average_price': summary.average_price if summary else None,
+                       'bookings_30d': summary.bookings_30d if summary else 0})
+    return {'neighborhoods': result}
+
+ROUTES = [
+    (re.compile(r'/api/search'), search),
+    (re.compile(r'/api/properties/(\d+)'), property_detail),
+    (re.compile(r'/api/neighborhoods'), neighborhoods),
+]
+
+# --- ASGI ---
+
+async def _send_json(send, status, body, headers=()):
+    payload = json.dumps(body, default=_json_value).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await _send_json(send, 405, {'error': 'Method not allowed'}, [(b'allow', b'GET')])
+    for pattern, endpoint in ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if match:
+            break
+    else:
+        return await _send_json(send, 404, {'error': 'Not found'})
+    headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    try:
+        body = await endpoint(query, load_session(headers), *match.groups())
+    except HTTPError as e:
+        extra = [(b'retry-after', b'1')] if e.status == 503 else []
+        return await _send_json(send, e.status, {'error': str(e)}, extra)
+    await _send_json(send, 200, body)
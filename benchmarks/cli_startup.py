@@ -0,0 +1,56 @@
+# Measures connect_db.py startup for every subcommand using `python -X importtime`.
+#
+#   python benchmarks/cli_startup.py                 # current tree
+#   python benchmarks/cli_startup.py --script old.py # e.g. git show <rev>:connect_db.py > old.py
+#
+# Each subcommand runs with --help so no database is needed; this is the fixed
+# cost every invocation pays before doing any work.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBCOMMANDS = ['login', 'register', 'manage_payment', 'manage_properties', 'search_properties',
+               'book_property', 'manage_bookings', 'manage_address', 'import_properties',
+               'export_data', 'bulk_adjust', 'analytics', 'view_rewards', 'migrate', 'init_shards',
+               'compact_rewards', 'check_neighborhood_stats', 'booking_partitions', 'archive_bookings',
+               'batch', 'shell']
+
+def run_once(script, subcommand):
+    argv = [sys.executable, '-X', 'importtime', script] + ([subcommand] if subcommand else []) + ['--help']
+    start = time.perf_counter()
+    proc = subprocess.run(argv, cwd=ROOT, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            modules[name.strip()] = int(cumulative_us)
+    return wall_ms, sum(modules.values()) / 1000, modules
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure CLI startup time per subcommand')
+    parser.add_argument('--script', default=os.path.join(ROOT, 'connect_db.py'), help='CLI script to measure')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per subcommand')
+    parser.add_argument('--top', type=int, default=3, help='Slowest top-level imports to show')
+    args = parser.parse_args()
+
+    print(f"{'subcommand':<20} {'wall ms':>9} {'import ms':>10}  slowest imports")
+    for subcommand in [''] + SUBCOMMANDS:
+        walls, imports, modules = [], [], {}
+        for _ in range(args.runs):
+            wall_ms, import_ms, modules = run_once(args.script, subcommand)
+            walls.append(wall_ms)
+            imports.append(import_ms)
+        slowest = sorted(modules.items(), key=lambda item: -item[1])[:args.top]
+        print(f"{subcommand or '(--help)':<20} {statistics.median(walls):>9.1f} {statistics.median(imports):>10.1f}  "
+              + ', '.join(f"{name} {us / 1000:.1f}" for name, us in slowest))
+
+if __name__ == '__main__':
+    main()
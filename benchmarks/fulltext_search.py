@@ -0,0 +1,93 @@
+# Compares keyword search on a GIN-indexed tsvector (as in
+# 006_property_search_vector.sql) with the ILIKE scan it replaces, on a
+# seeded catalog.
+#
+#   python benchmarks/fulltext_search.py                  # 200k listings
+#   python benchmarks/fulltext_search.py --rows 1000000 --runs 20
+#
+# The catalog goes into a temporary table in one transaction that is rolled
+# back, so the real Property table is not touched. Uses the DB_* settings
+# from .env. Reports median ms per query and how many listings each matched
+# (full text matches stems, "views" for "view"; ILIKE matches substrings,
+# "pool" in "carpool").
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+import db
+
+PHRASES = ['bright corner unit', 'ocean view', 'mountain views', 'renovated kitchen', 'hardwood floors',
+           'walk to downtown', 'quiet street', 'pet friendly', 'no pets', 'close to schools', 'new roof',
+           'open floor plan', 'private garden', 'carpool lane access', 'sunny deck', 'finished basement',
+           'steps from the beach', 'updated bathrooms', 'large closets', 'shared laundry']
+AMENITIES = ['pool', 'hot tub', 'fireplace', 'garage', 'gym', 'ocean view', 'wifi', 'pet friendly', 'sauna']
+QUERIES = ['pool', 'ocean view', 'pet friendly', 'fireplace garage', 'renovated kitchen hardwood']
+
+def catalog(rows, seed=1):
+    rng = random.Random(seed)
+    out = io.StringIO()
+    for property_id in range(1, rows + 1):
+        description = ', '.join(rng.sample(PHRASES, rng.randint(2, 6)))
+        amenities = ', '.join(rng.sample(AMENITIES, rng.randint(1, 4))) if rng.random() < 0.3 else '\\N'
+        out.write(f'{property_id}\t{description}\t{amenities}\n')
+    out.seek(0)
+    return out
+
+def timed(cur, statement, params, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cur.execute(statement, params)
+        found = len(cur.fetchall())
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), found
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text vs ILIKE keyword search on a seeded catalog')
+    parser.add_argument('--rows', type=int, default=200000, help='Listings to seed')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per query')
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = db.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute('CREATE TEMP TABLE bench_property (Property_ID integer, Description text, Amenities text)')
+            cur.copy_expert('COPY bench_property FROM STDIN', catalog(args.rows))
+            cur.execute('''
+                ALTER TABLE bench_property ADD COLUMN Search_Vector tsvector;
+                UPDATE bench_property
+                SET Search_Vector = setweight(to_tsvector('english', COALESCE(Amenities, '')), 'A')
+                                 || setweight(to_tsvector('english', Description), 'B');
+                CREATE INDEX ON bench_property USING GIN (Search_Vector);
+                ANALYZE bench_property;
+            ''')
+            print(f"{'query':<28} {'tsvector ms':>11} {'ILIKE ms':>9} {'matches':>8} {'ILIKE':>7}")
+            for query in QUERIES:
+                fts_ms, fts_found = timed(cur, '''
+                    SELECT Property_ID, ts_rank_cd(Search_Vector, q) AS Rank
+                    FROM bench_property, websearch_to_tsquery('english', %s) q
+                    WHERE Search_Vector @@ q
+                    ORDER BY Rank DESC, Property_ID
+                ''', (query,), args.runs)
+                patterns = [f'%{word}%' for word in query.split()]
+                ilike_ms, ilike_found = timed(cur, '''
+                    SELECT Property_ID FROM bench_property
+                    WHERE Description || ' ' || COALESCE(Amenities, '') ILIKE ALL (%s)
+                    ORDER BY Property_ID
+                ''', (patterns,), args.runs)
+                print(f'{query:<28} {fts_ms:>11.1f} {ilike_ms:>9.1f} {fts_found:>8} {ilike_found:>7}')
+    finally:
+        conn.rollback()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Compares memory held by an agent's property listing as plain driver tuples
+# (plus the float() conversions the old code did) against rows.Property.
+#
+#   python benchmarks/row_memory.py             # 100k synthetic rows
+#   python benchmarks/row_memory.py --rows 500000
+#
+# Rows are generated the way psycopg2 returns them: every value is a fresh
+# object, so repeated cities or prices are not shared unless we share them.
+import argparse
+import decimal
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rows
+
+CITIES = [('Boston', 'MA'), ('Cambridge', 'MA'), ('Austin', 'TX'), ('Denver', 'CO'), ('Seattle', 'WA')]
+TYPES = ['House', 'Apartment', 'Vacation Home', 'Land', 'Commercial Building']
+NEIGHBORHOODS = ['Back Bay', 'Downtown', 'Riverside', 'Old Town', 'Hillcrest']
+
+def fresh(value):
+    # A new str object with the same contents, like a decoded column value.
+    return ''.join(list(value))
+
+def generate(count, seed=1):
+    rng = random.Random(seed)
+    for property_id in range(1, count + 1):
+        city, state = rng.choice(CITIES)
+        property_type = rng.choice(TYPES)
+        rooms = rng.randint(1, 6) if property_type in ('House', 'Apartment', 'Vacation Home') else None
+        yield (property_id, f'{rng.randint(1, 9999)} Main St', fresh(city), fresh(state), fresh(f'0{rng.randint(1000, 1099)}'),
+               decimal.Decimal(f'{rng.randint(50, 500)}.00'), True, decimal.Decimal(f'{rng.randint(5, 40) * 100}.00'),
+               f'Listing {property_id}', fresh(property_type), fresh(rng.choice(NEIGHBORHOODS)), rooms,
+               rng.randint(1, 20) if property_type == 'Apartment' else None,
+               fresh('Farming') if property_type == 'Land' else None,
+               fresh('Retail') if property_type == 'Commercial Building' else None)
+
+class FakeCursor:
+    def __init__(self, count):
+        self._rows = generate(count)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self._rows)]
+
+def tuples_with_conversions(count):
+    listing = FakeCursor(count).fetchall()
+    prices = [float(row[5]) for row in listing]
+    footage = [float(row[7]) for row in listing]
+    return listing, prices, footage
+
+def slotted_rows(count):
+    return rows.Property.from_cursor(FakeCursor(count))
+
+def measure(build, count):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(count)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure memory of listing row representations')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of property rows')
+    args = parser.parse_args()
+
+    print(f"{'approach':<26} {'retained MB':>12} {'peak MB':>9} {'build s':>8}")
+    for name, build in [('tuples + float()', tuples_with_conversions), ('rows.Property', slotted_rows)]:
+        current, peak, elapsed = measure(build, args.rows)
+        print(f'{name:<26} {current / 2**20:>12.1f} {peak / 2**20:>9.1f} {elapsed:>8.2f}')
+
+if __name__ == '__main__':
+    main()
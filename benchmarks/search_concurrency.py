@@ -0,0 +1,93 @@
+# Compares how the sync Flask search (POST /search) and the asyncio one
+# (GET /api/search, async_app.py) hold up as concurrent searches grow.
+#
+#   RATE_LIMIT_SEARCH_RATE=0 ADMISSION_SEARCH_LIMIT=64 ADMISSION_SEARCH_QUEUE=4096 \
+#       gunicorn -w 4 --threads 8 -b :5000 app:app     # or `flask run --with-threads`
+#   uvicorn async_app:app --workers 4 --port 8000
+#   python benchmarks/search_concurrency.py --city Boston --concurrency 10,100,1000
+#
+# /search is rate limited and admission controlled (ratelimit.py,
+# admission.py); the settings above switch the limit off and widen admission
+# so the sync numbers measure searches rather than refusals. Leave them at
+# their defaults to see how the guards shed load instead.
+#
+# Each level opens that many connections at once, each running searches
+# back to back for --seconds. Reports completed searches/s, p50/p99 latency,
+# 429 and 503 responses, and other failures (refused connections, timeouts,
+# other non-200 responses).
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlencode, urlsplit
+
+async def request(url, method='GET', body=b'', timeout=30):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+    try:
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        head = (f'{method} {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n'
+                f'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(body)}\r\n\r\n')
+        writer.write(head.encode() + body)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+        return int(response.split(b' ', 2)[1])
+    finally:
+        writer.close()
+
+async def client(target, deadline, latencies, failures):
+    url, method, body = target
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            status = await request(url, method, body)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            failures.append(status)
+            await asyncio.sleep(0.05)
+
+async def run_level(target, concurrency, seconds):
+    latencies, failures = [], []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[client(target, deadline, latencies, failures) for _ in range(concurrency)])
+    return latencies, failures
+
+def count_failures(failures):
+    throttled = failures.count(429)
+    shed = failures.count(503)
+    return throttled, shed, len(failures) - throttled - shed
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent search load: sync Flask vs asyncio endpoint')
+    parser.add_argument('--sync_base', default='http://localhost:5000', help='Flask app base URL ("" to skip)')
+    parser.add_argument('--async_base', default='http://localhost:8000', help='async_app base URL ("" to skip)')
+    parser.add_argument('--city', default='Boston', help='City to search')
+    parser.add_argument('--concurrency', default='10,100,1000', help='Comma-separated concurrency levels')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each level')
+    args = parser.parse_args()
+
+    targets = []
+    if args.sync_base:
+        targets.append(('sync /search', (args.sync_base + '/search', 'POST', urlencode({'location': args.city}).encode())))
+    if args.async_base:
+        targets.append(('async /api/search', (args.async_base + '/api/search?' + urlencode({'city': args.city}), 'GET', b'')))
+
+    print(f"{'target':<20} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'429':>7} {'503':>7} {'failed':>7}")
+    for name, target in targets:
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            latencies, failures = asyncio.run(run_level(target, concurrency, args.seconds))
+            if latencies:
+                ordered = sorted(latencies)
+                p50 = statistics.median(ordered) * 1000
+                p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+            else:
+                p50 = p99 = float('nan')
+            throttled, shed, failed = count_failures(failures)
+            print(f'{name:<20} {concurrency:>7} {len(latencies) / args.seconds:>8.1f} {p50:>8.1f} {p99:>8.1f} '
+                  f'{throttled:>7} {shed:>7} {failed:>7}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+import os
+
+import psycopg2
+
+import invalidation
+
+PROPERTY_TYPES = {
+    'house': 'House',
+    'apartment': 'Apartment',
+    'vacation home': 'Vacation Home',
+    'land': 'Land',
+    'commercial building': 'Commercial Building',
+}
+
+IMPORT_COLUMNS = ['street', 'city', 'state', 'zip', 'price', 'availability', 'square_footage',
+                  'description', 'type', 'neighborhood', 'number_of_rooms', 'floor', 'amenities',
+                  'purpose_of_land', 'business_type']
+
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1'}
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0'}
+
+# Subtype rows are fanned out from the staging table one statement per table.
+SUBTYPE_INSERTS = [
+    ('House', 'INSERT INTO House (Property_ID, Number_of_rooms) SELECT property_id, number_of_rooms'),
+    ('Apartment', 'INSERT INTO Apartment (Property_ID, Number_of_rooms, Floor) SELECT property_id, number_of_rooms, floor'),
+    ('Vacation Home', 'INSERT INTO Vacation_Home (Property_ID, Number_of_rooms, Amenities) SELECT property_id, number_of_rooms, amenities'),
+    ('Land', 'INSERT INTO Land (Property_ID, Purpose_of_land) SELECT property_id, purpose_of_land'),
+    ('Commercial Building', 'INSERT INTO Commercial_Building (Property_ID, Business_Type) SELECT property_id, business_type'),
+]
+
+def read_import_rows(path, fmt=None):
+    fmt = fmt or ('ndjson' if os.path.splitext(path)[1].lower() in ('.ndjson', '.jsonl') else 'csv')
+    with open(path, newline='') as f:
+        if fmt == 'csv':
+            for row_no, row in enumerate(csv.DictReader(f), 1):
+                yield row_no, {(k or '').strip().lower(): v for k, v in row.items()}
+        else:
+            for row_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield row_no, ValueError(f"invalid JSON: {str(e)}")
+                    continue
+                if not isinstance(row, dict):
+                    yield row_no, ValueError("expected a JSON object")
+                    continue
+                yield row_no, {k.strip().lower(): v for k, v in row.items()}
+
+def _text(row, field, required=False):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f"{field} is required")
+    return value or None
+
+def _number(row, field, cast, required=False):
+    value = _text(row, field, required)
+    if value is None:
+        return None
+    try:
+        number = cast(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a number")
+    if number < 0:
+        raise ValueError(f"{field} must not be negative")
+    return number
+
+def validate_import_row(row):
+    property_type = PROPERTY_TYPES.get(_text(row, 'type', True).lower().replace('_', ' '))
+    if property_type is None:
+        raise ValueError(f"type must be one of: {', '.join(PROPERTY_TYPES.values())}")
+    availability = (_text(row, 'availability') or 'true').lower()
+    if availability not in TRUE_VALUES | FALSE_VALUES:
+        raise ValueError("availability must be true or false")
+    values = {
+        'street': _text(row, 'street', True),
+        'city': _text(row, 'city', True),
+        'state': _text(row, 'state', True),
+        'zip': _text(row, 'zip', True),
+        'price': _number(row, 'price', float, True),
+        'availability': availability in TRUE_VALUES,
+        'square_footage': _number(row, 'square_footage', float, True),
+        'description': _text(row, 'description'),
+        'type': property_type,
+        'neighborhood': _text(row, 'neighborhood', True),
+        'number_of_rooms': _number(row, 'number_of_rooms', int, property_type in ('House', 'Apartment', 'Vacation Home')),
+        'floor': _number(row, 'floor', int, property_type == 'Apartment'),
+        'amenities': _text(row, 'amenities'),
+        'purpose_of_land': _text(row, 'purpose_of_land'),
+        'business_type': _text(row, 'business_type'),
+    }
+    return [values[column] for column in IMPORT_COLUMNS]
+
+def _fan_out(cur, agent_email, row_no=None):
+    where = '' if row_no is None else cur.mogrify(' AND row_no = %s', (row_no,)).decode()
+    cur.execute(f'''
+        INSERT INTO Property (Property_ID, Street, City, State, Zip, Price, Availability, Square_Footage,
+                              Description, Type, Agent_Email, Neighborhood)
+        SELECT property_id, street, city, state, zip, price, availability, square_footage,
+               description, type, %s, neighborhood
+        FROM property_import WHERE TRUE{where}
+    ''', (agent_email,))
+    inserted = cur.rowcount
+    for property_type, insert in SUBTYPE_INSERTS:
+        cur.execute(f'{insert} FROM property_import WHERE type = %s{where}', (property_type,))
+    return inserted
+
+def import_properties(conn, agent_email, path, fmt=None):
+    errors = []
+    staged = io.StringIO()
+    writer = csv.writer(staged)
+    for row_no, row in read_import_rows(path, fmt):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            writer.writerow([row_no] + validate_import_row(row))
+        except ValueError as e:
+            errors.append((row_no, str(e)))
+    staged.seek(0)
+
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TEMP TABLE property_import (
+                row_no integer PRIMARY KEY, street text, city text, state text, zip text,
+                price numeric, availability boolean, square_footage numeric, description text,
+                type text, neighborhood text, number_of_rooms integer, floor integer,
+                amenities text, purpose_of_land text, business_type text, property_id integer
+            ) ON COMMIT DROP
+        ''')
+        cur.copy_expert(f"COPY property_import (row_no, {', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", staged)
+
+        cur.execute('''
+            DELETE FROM property_import s
+            WHERE NOT EXISTS (SELECT 1 FROM Neighborhood n WHERE n.Name = s.neighborhood)
+            RETURNING row_no, neighborhood
+        ''')
+        errors.extend((row_no, f"unknown neighborhood: {name}") for row_no, name in cur.fetchall())
+        cur.execute("UPDATE property_import SET property_id = nextval(pg_get_serial_sequence('property', 'property_id'))")
+
+        cur.execute('SAVEPOINT property_import')
+        try:
+            imported = _fan_out(cur, agent_email)
+            cur.execute('RELEASE SAVEPOINT property_import')
+        except psycopg2.Error:
+            # Something the validation did not catch; isolate the offending rows.
+            cur.execute('ROLLBACK TO SAVEPOINT property_import')
+            imported = 0
+            cur.execute('SELECT row_no FROM property_import ORDER BY row_no')
+            for (row_no,) in cur.fetchall():
+                cur.execute('SAVEPOINT property_import_row')
+                try:
+                    imported += _fan_out(cur, agent_email, row_no)
+                    cur.execute('RELEASE SAVEPOINT property_import_row')
+                except psycopg2.Error as e:
+                    cur.execute('ROLLBACK TO SAVEPOINT property_import_row')
+                    errors.append((row_no, str(e).strip()))
+        if imported:
+            # One event per city rather than one per row.
+            cur.execute('SELECT DISTINCT city FROM property_import')
+            for (city,) in cur.fetchall():
+                invalidation.publish(cur, 'property', city=city)
+        cur.execute('DROP TABLE property_import')
+    errors.sort()
+    return imported, errors
+
+EXPORT_BATCH_SIZE = 5000
+
+# Stay length in nights. Web bookings are one row per night (no Start/End dates).
+NIGHTS = 'COALESCE(b.End_Date::date - b.Start_Date::date, 1)'
+STAY_START = 'COALESCE(b.Start_Date::date, b.Booking_Date::date)'
+STAY_END = 'COALESCE(b.End_Date::date, b.Booking_Date::date + 1)'
+
+EXPORTS = {
+    'bookings': {
+        'columns': [('booking_id', 'int64'), ('property_id', 'int64'), ('agent_email', 'string'),
+                    ('renter_email', 'string'), ('card_number', 'string'), ('start_date', 'date32'),
+                    ('end_date', 'date32'), ('nights', 'int64'), ('price', 'float64'), ('total', 'float64'),
+                    ('street', 'string'), ('city', 'string'), ('state', 'string'), ('zip', 'string'),
+                    ('type', 'string')],
+        'query': f'''
+            SELECT b.Booking_ID, b.Property_ID, p.Agent_Email, b.Renter_Email, b.Card_Number,
+                   {STAY_START}, {STAY_END}, {NIGHTS}, p.Price, {NIGHTS} * p.Price,
+                   p.Street, p.City, p.State, p.Zip, p.Type
+            FROM Booking b
+            JOIN Property p ON b.Property_ID = p.Property_ID
+            WHERE TRUE{{filters}}
+            ORDER BY b.Booking_ID
+        ''',
+        'agent_filter': 'p.Agent_Email = %s',
+    },
+    'properties': {
+        'columns': [('property_id', 'int64'), ('agent_email', 'string'), ('street', 'string'),
+                    ('city', 'string'), ('state', 'string'), ('zip', 'string'), ('price', 'float64'),
+                    ('availability', 'bool_'), ('square_footage', 'float64'), ('type', 'string'),
+                    ('neighborhood', 'string'), ('bedrooms', 'int64'), ('bookings', 'int64'),
+                    ('nights_booked', 'int64'), ('revenue', 'float64')],
+        'query': f'''
+            SELECT p.Property_ID, p.Agent_Email, p.Street, p.City, p.State, p.Zip, p.Price,
+                   p.Availability, p.Square_Footage, p.Type, p.Neighborhood,
+                   COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, NULL),
+                   t.Bookings, t.Nights_Booked, t.Nights_Booked * p.Price
+            FROM Property p
+            LEFT JOIN House h ON p.Property_ID = h.Property_ID
+            LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
+            LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) AS Bookings, COALESCE(SUM({NIGHTS}), 0) AS Nights_Booked
+                FROM Booking b
+                WHERE b.Property_ID = p.Property_ID{{filters}}
+            ) t
+            WHERE TRUE{{agent_filter}}
+            ORDER BY p.Property_ID
+        ''',
+        'agent_filter': 'p.Agent_Email = %s',
+    },
+}
+
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')
+
+def _export_query(kind, agent_email=None, start_date=None, end_date=None):
+    export = EXPORTS[kind]
+    date_filters, date_params = '', []
+    if start_date:
+        date_filters += f' AND {STAY_END} > %s'
+        date_params.append(start_date)
+    if end_date:
+        date_filters += f' AND {STAY_START} <= %s'
+        date_params.append(end_date)
+    agent_filter = f" AND {export['agent_filter']}" if agent_email else ''
+    agent_params = [agent_email] if agent_email else []
+    if kind == 'bookings':
+        return export['query'].format(filters=agent_filter + date_filters), agent_params + date_params
+    return export['query'].format(filters=date_filters, agent_filter=agent_filter), date_params + agent_params
+
+def export_rows(conn, kind, agent_email=None, start_date=None, end_date=None):
+    query, params = _export_query(kind, agent_email, start_date, end_date)
+    # A named cursor keeps the result set on the server and fetches it in batches.
+    with conn.cursor(name=f'{kind}_export') as cur:
+        cur.itersize = EXPORT_BATCH_SIZE
+        cur.execute(query, params)
+        yield from cur
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+def stream_export(conn, kind, fmt, **filters):
+    return stream_rows(kind, fmt, export_rows(conn, kind, **filters))
+
+def stream_rows(kind, fmt, rows):
+    # Formats export rows from any source, e.g. several shards merged.
+    columns = [name for name, _ in EXPORTS[kind]['columns']]
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = writer.writerow
+    elif fmt == 'ndjson':
+        def write(row):
+            buffer.write(json.dumps(dict(zip(columns, map(_json_value, row)))) + '\n')
+    else:
+        raise ValueError(f"Streaming is not supported for {fmt} exports.")
+    for count, row in enumerate(rows, 1):
+        write(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def write_parquet(conn, kind, out, **filters):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow).")
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in EXPORTS[kind]['columns']])
+    rows = export_rows(conn, kind, **filters)
+    with pq.ParquetWriter(out, schema) as writer:
+        while True:
+            batch = [row for _, row in zip(range(EXPORT_BATCH_SIZE), rows)]
+            if not batch:
+                break
+            columns = [pa.array([float(v) if isinstance(v, decimal.Decimal) else v for v in column], type=field.type)
+                       for field, column in zip(schema, zip(*batch))]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+def write_export(conn, kind, fmt, out, **filters):
+    if fmt == 'parquet':
+        write_parquet(conn, kind, out, **filters)
+    else:
+        for chunk in stream_export(conn, kind, fmt, **filters):
+            out.write(chunk)
+
+ADJUST_BATCH_SIZE = 500
+
+def normalize_type(value):
+    return PROPERTY_TYPES.get(value.strip().lower().replace('_', ' '), value.strip())
+
+def _adjust_filter(agent_email, city=None, neighborhood=None, property_type=None, property_ids=None):
+    clauses, params = ['Agent_Email = %s'], [agent_email]
+    if city:
+        clauses.append('City = %s')
+        params.append(city)
+    if neighborhood:
+        clauses.append('Neighborhood = %s')
+        params.append(neighborhood)
+    if property_type:
+        clauses.append('Type = %s')
+        params.append(normalize_type(property_type))
+    if property_ids:
+        clauses.append('Property_ID = ANY(%s)')
+        params.append(list(property_ids))
+    return ' AND '.join(clauses), params
+
+def _adjust_set(percent=None, amount=None, availability=None):
+    assignments, params = [], []
+    if percent is not None:
+        assignments.append('Price = GREATEST(ROUND(p.Price * (1 + %s / 100.0), 2), 0)')
+        params.append(percent)
+    elif amount is not None:
+        assignments.append('Price = GREATEST(p.Price + %s, 0)')
+        params.append(amount)
+    if availability is not None:
+        assignments.append('Availability = %s')
+        params.append(availability)
+    return ', '.join(assignments), params
+
+def preview_adjustment(cur, agent_email, **filters):
+    where, params = _adjust_filter(agent_email, **filters)
+    cur.execute(f'SELECT COUNT(*), MIN(Price), MAX(Price) FROM Property WHERE {where}', params)
+    return cur.fetchone()
+
+def adjust_properties(conn, agent_email, percent=None, amount=None, availability=None,
+                      batch_size=ADJUST_BATCH_SIZE, **filters):
+    # Applies the change in keyset-ordered batches, committing after each one so
+    # row locks are held for at most batch_size rows. Returns the number of
+    # properties updated.
+    if percent is not None and amount is not None:
+        raise ValueError("Give either a percentage or an absolute price change, not both.")
+    assignments, set_params = _adjust_set(percent, amount, availability)
+    if not assignments:
+        raise ValueError("Nothing to change: give a price change and/or an availability.")
+    where, where_params = _adjust_filter(agent_email, **filters)
+    query = f'''
+        WITH batch AS (
+            SELECT Property_ID FROM Property
+            WHERE {where} AND Property_ID > %s
+            ORDER BY Property_ID
+            LIMIT %s
+        )
+        UPDATE Property p SET {assignments}
+        FROM batch
+        WHERE p.Property_ID = batch.Property_ID
+        RETURNING p.Property_ID, p.City
+    '''
+    updated, last_id = 0, 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(query, set_params + where_params + [last_id, batch_size])
+            changed = cur.fetchall()
+            if not changed:
+                return updated
+            invalidation.publish_many(cur, 'property', changed)
+        conn.commit()
+        updated += len(changed)
+        last_id = max(property_id for property_id, _ in changed)
@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict
+
+import db
+import invalidation
+import repository
+
+# Process-local caches for reference data, kept fresh by invalidation.py.
+# Notifications reach this process's listener only after its batch window, so
+# a route that writes also invalidates its own entries right after commit and
+# the redirect that follows sees the change.
+
+class NeighborhoodCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name = None
+        # Bumped on every invalidation so a load that raced with one is not kept.
+        self._generation = 0
+        invalidation.subscribe('neighborhood', lambda events: self.invalidate(), self.invalidate)
+
+    def all(self):
+        return list(self._load().values())
+
+    def get(self, name):
+        return self._load().get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._by_name = None
+
+    def _load(self):
+        # Do not load before LISTEN is in place or a change could be missed.
+        invalidation.ensure_listening()
+        by_name = self._by_name
+        if by_name is not None:
+            return by_name
+        generation = self._generation
+        with db.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                by_name = {n.name: n for n in repository.list_neighborhoods(cur)}
+        with self._lock:
+            if generation == self._generation:
+                self._by_name = by_name
+        return by_name
+
+class KeyedCache:
+    # Bounded LRU of load(cur, key) results. Every invalidation bumps _version;
+    # a load only stores its result if no invalidation happened while it ran,
+    # so a value read before a concurrent write can never be cached.
+    # connect(key) picks the database a key is loaded from.
+    def __init__(self, entities, load, max_entries, key=str, connect=lambda key: db.get_db_connection()):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        self._load_value = load
+        self._max_entries = max_entries
+        self._key = key
+        self._connect = connect
+        for entity in entities:
+            invalidation.subscribe(entity, self._on_events, self.clear)
+
+    def get(self, key):
+        value, version = self.lookup(key)
+        if version is None:
+            return value
+        with self._connect(key) as conn:
+            with conn.cursor() as cur:
+                value = self._load_value(cur, key)
+        self.store(key, value, version)
+        return value
+
+    def lookup(self, key):
+        # (value, None) on a hit; (None, version) on a miss, to pass to store()
+        # once the value has been loaded some other way.
+        invalidation.ensure_listening()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key], None
+            return None, self._version
+
+    def store(self, key, value, version):
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = value
+                if len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._version += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def _on_events(self, events):
+        for event in events:
+            if event.id is None:
+                self.clear()
+                return
+            self.invalidate(self._key(event.id))
+
+neighborhoods = NeighborhoodCache()
+
+# Neighborhood stats are joined in from `neighborhoods` when rendering, so a
+# neighborhood edit does not have to touch every cached property.
+property_details = KeyedCache(['property'], repository.get_property_detail,
+                              int(os.getenv('PROPERTY_CACHE_SIZE', '10000')), key=int,
+                              connect=lambda property_id: db.get_db_connection(shard=db.shard_for_id(property_id)))
+
+# Card lists include the billing address, so address edits invalidate them too.
+cards = KeyedCache(['card', 'address'], repository.list_cards,
+                   int(os.getenv('CARD_CACHE_SIZE', '10000')))
+
+def booking_page(email, property_id):
+    # The booking page needs both the property and the renter's cards; if
+    # either is missing, one statement loads both and fills both caches. With
+    # shards the property and the cards are in different databases.
+    if db.SHARDS:
+        return property_details.get(property_id), cards.get(email)
+    prop, property_version = property_details.lookup(property_id)
+    card_list, cards_version = cards.lookup(email)
+    if property_version is None and cards_version is None:
+        return prop, card_list
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            prop, card_list = repository.get_booking_page(cur, email, property_id)
+    if property_version is not None:
+        property_details.store(property_id, prop, property_version)
+    if cards_version is not None:
+        cards.store(email, card_list, cards_version)
+    return prop, card_list
@@ -1,28 +1,96 @@
+# psycopg2, bulk and json are imported where they are used so that --help and
+# argument errors do not pay for them.
 import argparse
-import psycopg2
+import cmd
+import shlex
+import sys
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import re
 
 SESSION_FILE = 'session.txt'
 
+# Set while a batch is running so every command reuses one connection.
+_shared_conn = None
+
+# Set while the shell is running: its ReferenceCache, which commands read
+# neighborhoods, cards and addresses from instead of querying each time.
+_reference_cache = None
+
+# Commands that commit as they go so their locks stay short (batches of
+# bulk_adjust, one month at a time for archive_bookings). In batch and shell
+# mode they still get a connection of their own with real commits, after the
+# commands before them have been committed.
+OWN_CONNECTION = {'bulk_adjust', 'archive_bookings', 'compact_rewards', 'booking_partitions',
+                  'check_neighborhood_stats', 'migrate', 'init_shards'}
+
+# Long-lived connections (batch, shell) track server-side prepared statements;
+# one-shot commands run their few statements unprepared. Both use the DB_*
+# settings the web app reads.
+def connect(prepared=False):
+    import db
+    if prepared:
+        return db.connect()
+    import psycopg2
+    return psycopg2.connect(**db.connection_params())
+
 @contextmanager
 def get_db_connection():
+    if _shared_conn is not None:
+        yield _shared_conn
+        return
     conn = None
     try:
-        conn = psycopg2.connect(
-            host="localhost",
-            port=5433,
-            database="realestate_db",
-            user="postgres",
-            password="1234"
-        )
+        conn = connect()
         yield conn
     finally:
         if conn is not None:
             conn.close()
 
+# Runs each command inside a savepoint on a long-lived connection. A command's
+# commit() only releases its savepoint and anything it leaves uncommitted is
+# rolled back, same as closing a fresh connection did. A command that fails
+# is rolled back to where it started, including what it committed. The real
+# COMMIT happens at transaction-group boundaries.
+class CommandConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def _savepoint(self, statement):
+        with self._conn.cursor() as cur:
+            cur.execute(statement)
+
+    def start(self):
+        self._savepoint('SAVEPOINT cli_run')
+        self.begin()
+
+    def begin(self):
+        self._savepoint('SAVEPOINT cli_command')
+
+    def commit(self):
+        self._savepoint('RELEASE SAVEPOINT cli_command')
+        self.begin()
+
+    def rollback(self):
+        self._savepoint('ROLLBACK TO SAVEPOINT cli_command')
+
+    def commit_group(self):
+        self._conn.commit()
+
+    def finish(self, succeeded):
+        from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+        ok = succeeded and self._conn.get_transaction_status() != TRANSACTION_STATUS_INERROR
+        if ok:
+            self.rollback()
+        else:
+            self._savepoint('ROLLBACK TO SAVEPOINT cli_run')
+        self._savepoint('RELEASE SAVEPOINT cli_run')
+        return ok
+
 def is_valid_email(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email)
 
@@ -36,55 +104,64 @@ def is_valid_expiry(expiry):
     except Exception:
         return False
 
+# session.txt is read once per process and then kept in memory.
+_session = None
+
 def save_session(email, role):
+    global _session
     with open(SESSION_FILE, 'w') as f:
         f.write(f"{email},{role}")
+    _session = (email, role)
 
 def load_session():
-    if os.path.exists(SESSION_FILE):
+    global _session
+    if _session is None:
+        if not os.path.exists(SESSION_FILE):
+            return None, None
         with open(SESSION_FILE, 'r') as f:
             email, role = f.read().strip().split(',')
-            return email, role
-    return None, None
+            _session = (email, role)
+    return _session
 
 def clear_session():
+    global _session
+    _session = None
     if os.path.exists(SESSION_FILE):
         os.remove(SESSION_FILE)
 
 def login(email):
     try:
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT Email FROM Renter WHERE Email = %s', (email,))
-                renter_result = cur.fetchone()
-                cur.execute('SELECT Email FROM Agent WHERE Email = %s', (email,))
-                agent_result = cur.fetchone()
-                if renter_result:
-                    save_session(email, 'renter')
-                    print(f"Logged in as {email} (renter)")
-                elif agent_result:
-                    save_session(email, 'agent')
-                    print(f"Logged in as {email} (agent)")
+                role = repository.get_user_role(cur, email)
+                if role:
+                    save_session(email, role)
+                    print(f"Logged in as {email} ({role})")
                 else:
                     print("Login failed: User not found.")
+                    return False
     except Exception as e:
         print(f"Error logging in: {str(e)}")
+        return False
 
 def register_user(email, name, user_type):
     if not is_valid_email(email):
         print("Invalid email format.")
-        return
+        return False
     try:
+        import invalidation
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('SELECT 1 FROM "User" WHERE Email = %s', (email,))
                 if cur.fetchone():
                     print(f"Registration failed: Email {email} already exists.")
-                    return
+                    return False
                 cur.execute('''
                     INSERT INTO "User" (Email, Name)
                     VALUES (%s, %s)
                 ''', (email, name))
+                invalidation.publish(cur, 'user', email)
                 if user_type == 'agent':
                     cur.execute('''
                         INSERT INTO Agent (Email, Job_Title, Agency, Contact_Info)
@@ -95,6 +172,8 @@ def register_user(email, name, user_type):
                         INSERT INTO Renter (Email, Budget, Preferred_Location, Move_in_Date, Reward_Points)
                         VALUES (%s, %s, %s, %s, %s)
                     ''', (email, 0.0, 'Preferred Location', '2025-01-01', 0))
+                    # CLI renters have always earned points, so enroll them.
+                    cur.execute('INSERT INTO RewardProgram (Email, Points) VALUES (%s, %s)', (email, 0))
                 conn.commit()
         print(f"""Registration successful!
               User: {name}
@@ -103,37 +182,37 @@ def register_user(email, name, user_type):
               """)
     except Exception as e:
         print(f"Error registering user: {str(e)}")
+        return False
 
 def manage_payment_info(action, card_info=None, billing_address=None, expiry="2025-01-01", cvv=None):
     session_email, role = load_session()
     if role != 'renter':
         print("Access denied: Only renters can manage payment information.")
-        return
+        return False
 
     if action in ['add', 'modify']:
         if not is_valid_card(card_info):
             print("Invalid card number. Must be 16 digits.")
-            return
+            return False
         if not is_valid_expiry(expiry):
             print("Invalid expiry date. Must be in YYYY-MM-DD format and in the future.")
-            return
+            return False
         if not (cvv and cvv.isdigit() and len(cvv) == 3):
             print("Invalid CVV. Must be 3 digits.")
-            return
+            return False
 
     try:
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 if action == 'add':
-                    cur.execute('SELECT 1 FROM Address WHERE Email = %s AND AddressID = %s', (session_email, billing_address))
-                    if not cur.fetchone():
+                    address_ok, added = repository.add_card(cur, session_email, card_info, cvv, expiry, billing_address)
+                    if not address_ok:
                         print("Billing address does not exist or does not belong to you.")
-                        return
-                    cur.execute('''
-                        INSERT INTO CreditCard (Card_Number, CVV, Expiry_Date, Renter_Email, Billing_Address)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON CONFLICT (Renter_Email, Card_Number) DO NOTHING;
-                    ''', (card_info, cvv, expiry, session_email, billing_address))
+                        return False
+                    if not added:
+                        print("This card is already registered.")
+                        return False
                     print(f"""Credit card added!
                           Card Number: {card_info}
                           Billing Address ID: {billing_address}
@@ -141,15 +220,9 @@ def manage_payment_info(action, card_info=None, billing_address=None, expiry="20
                           CVV: {cvv}
                           """)
                 elif action == 'modify':
-                    cur.execute('SELECT 1 FROM CreditCard WHERE Renter_Email = %s AND Card_Number = %s', (session_email, card_info))
-                    if not cur.fetchone():
+                    if not repository.update_card(cur, session_email, card_info, cvv, expiry, billing_address):
                         print("Credit card not found.")
-                        return
-                    cur.execute('''
-                        UPDATE CreditCard
-                        SET CVV = %s, Expiry_Date = %s, Billing_Address = %s
-                        WHERE Renter_Email = %s AND Card_Number = %s;
-                    ''', (cvv, expiry, billing_address, session_email, card_info))
+                        return False
                     print(f"""Credit card modified!
                           Card Number: {card_info}
                           Billing Address ID: {billing_address}
@@ -157,42 +230,41 @@ def manage_payment_info(action, card_info=None, billing_address=None, expiry="20
                           CVV: {cvv}
                           """)
                 elif action == 'delete':
-                    cur.execute('''
-                        SELECT 1 FROM Booking
-                        WHERE Renter_Email = %s AND Card_Number = %s
-                    ''', (session_email, card_info))
-                    if cur.fetchone():
+                    if repository.card_in_use(cur, session_email, card_info):
                         print("Cannot delete credit card: It is used in one or more bookings.")
-                        return
-                    cur.execute('''
-                        DELETE FROM CreditCard
-                        WHERE Renter_Email = %s AND Card_Number = %s;
-                    ''', (session_email, card_info))
+                        return False
+                    repository.delete_card(cur, session_email, card_info)
                     print(f"""Credit card deleted!
                           Card Number: {card_info}
                           """)
                 conn.commit()
     except Exception as e:
         print(f"Error managing payment info: {str(e)}")
+        return False
 
 def manage_properties(action, property_id=None, property_info=None):
     session_email, role = load_session()
     if role != 'agent':
         print("Access denied: Only agents can manage properties.")
-        return
+        return False
 
     try:
+        import invalidation
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 if action == 'add':
                     if not property_info:
                         print("Property information required.")
-                        return
+                        return False
                     # Expecting: Street, City, State, Zip, Price, Availability, Square_Footage, Description, Type, Neighborhood, [Subtype-specific fields]
                     info = property_info.split(', ')
                     if len(info) < 10:
                         print("Property information must have at least 10 fields: Street, City, State, Zip, Price, Availability, Square_Footage, Description, Type, Neighborhood")
-                        return
+                        return False
+                    # The shell has the names cached, so a typo costs no round trip.
+                    if _reference_cache is not None and info[9] not in {n.name for n in _reference_cache.neighborhoods()}:
+                        print(f"Unknown neighborhood: {info[9]}")
+                        return False
                     
                     # Insert into Property table
                     cur.execute('''
@@ -207,7 +279,7 @@ def manage_properties(action, property_id=None, property_info=None):
                     if property_type == 'house':
                         if len(info) < 11:
                             print("House properties require number of rooms.")
-                            return
+                            return False
                         cur.execute('''
                             INSERT INTO House (Property_ID, Number_of_rooms)
                             VALUES (%s, %s);
@@ -215,7 +287,7 @@ def manage_properties(action, property_id=None, property_info=None):
                     elif property_type == 'apartment':
                         if len(info) < 12:
                             print("Apartment properties require number of rooms and floor.")
-                            return
+                            return False
                         cur.execute('''
                             INSERT INTO Apartment (Property_ID, Number_of_rooms, Floor)
                             VALUES (%s, %s, %s);
@@ -223,7 +295,7 @@ def manage_properties(action, property_id=None, property_info=None):
                     elif property_type == 'vacation_home':
                         if len(info) < 12:
                             print("Vacation home properties require number of rooms and amenities.")
-                            return
+                            return False
                         cur.execute('''
                             INSERT INTO Vacation_Home (Property_ID, Number_of_rooms, Amenities)
                             VALUES (%s, %s, %s);
@@ -250,24 +322,28 @@ def manage_properties(action, property_id=None, property_info=None):
                     elif property_type == 'vacation_home':
                         print(f"Number of rooms: {info[10]}")
                         print(f"Amenities: {info[11]}")
+                    invalidation.publish(cur, 'property', property_id, info[1])
 
                 elif action == 'modify':
                     if not property_id or not property_info:
                         print("Property ID and new info required.")
-                        return
+                        return False
                     # property_info: Price, Availability, Square_Footage, Description, Type, Neighborhood, [Subtype-specific fields]
                     fields = property_info.split(', ')
                     if len(fields) < 2:
                         print("Property info must have at least Price and Availability.")
-                        return
+                        return False
                     price, availability = fields[0], fields[1]
                     
                     # Update Property table
                     cur.execute('''
                         UPDATE Property
                         SET Price = %s, Availability = %s
-                        WHERE Agent_Email = %s AND Property_ID = %s;
+                        WHERE Agent_Email = %s AND Property_ID = %s
+                        RETURNING City;
                     ''', (price, availability, session_email, property_id))
+                    for (city,) in cur.fetchall():
+                        invalidation.publish(cur, 'property', property_id, city)
 
                     # Update subtype-specific information if provided
                     if len(fields) > 5:  # If subtype info is provided
@@ -300,11 +376,17 @@ def manage_properties(action, property_id=None, property_info=None):
                 elif action == 'delete':
                     if not property_id:
                         print("Property ID required.")
-                        return
+                        return False
                     
                     # Delete from subtype table first
-                    cur.execute('SELECT Type FROM Property WHERE Property_ID = %s', (property_id,))
-                    property_type = cur.fetchone()[0].lower()
+                    cur.execute('SELECT Type, City FROM Property WHERE Property_ID = %s AND Agent_Email = %s',
+                                (property_id, session_email))
+                    found = cur.fetchone()
+                    if not found:
+                        print(f"Error: Property {property_id} not found or not owned by you.")
+                        return False
+                    property_type, city = found
+                    property_type = property_type.lower()
                     
                     if property_type == 'house':
                         cur.execute('DELETE FROM House WHERE Property_ID = %s', (property_id,))
@@ -318,132 +400,101 @@ def manage_properties(action, property_id=None, property_info=None):
                         DELETE FROM Property
                         WHERE Agent_Email = %s AND Property_ID = %s;
                     ''', (session_email, property_id))
+                    invalidation.publish(cur, 'property', property_id, city)
                     print(f"""Property deleted!
                           Property ID: {property_id}
                           """)
                 conn.commit()
     except Exception as e:
         print(f"Error managing properties: {str(e)}")
+        return False
 
-def search_properties(location, date, property_type=None, min_bedrooms=None, max_bedrooms=None, min_price=None, max_price=None, order_by=None):
+def search_properties(location, date, property_type=None, min_bedrooms=None, max_bedrooms=None, min_price=None, max_price=None, order_by=None, keywords=None, neighborhood=None):
     try:
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                query = '''
-                    SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description, 
-                        COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, NULL) as Bedrooms,
-                        p.Square_Footage, p.Neighborhood,
-                        CASE 
-                            WHEN p.Type = 'House' THEN h.Number_of_rooms::text
-                            WHEN p.Type = 'Apartment' THEN a.Number_of_rooms::text || ', Floor ' || a.Floor::text
-                            WHEN p.Type = 'Vacation_Home' THEN v.Number_of_rooms::text || ', ' || v.Amenities
-                            ELSE NULL
-                        END as Subtype_Info
-                    FROM Property p
-                    LEFT JOIN House h ON p.Property_ID = h.Property_ID
-                    LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
-                    LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
-                    WHERE p.City = %s AND p.Availability = TRUE
-                    AND NOT EXISTS (
-                        SELECT 1 FROM Booking b
-                        WHERE b.Property_ID = p.Property_ID
-                          AND %s BETWEEN b.Start_Date AND b.End_Date
-                    )
-                '''
-                params = [location, date]
-                if property_type:
-                    query += ' AND p.Type = %s'
-                    params.append(property_type)
-                if min_bedrooms:
-                    query += ' AND COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, 0) >= %s'
-                    params.append(min_bedrooms)
-                if max_bedrooms:
-                    query += ' AND COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, 100) <= %s'
-                    params.append(max_bedrooms)
-                if min_price:
-                    query += ' AND p.Price >= %s'
-                    params.append(min_price)
-                if max_price:
-                    query += ' AND p.Price <= %s'
-                    params.append(max_price)
-                if order_by in ['price', 'bedrooms']:
-                    query += f' ORDER BY { "p.Price" if order_by == "price" else "Bedrooms" }'
-                cur.execute(query, params)
-                results = cur.fetchall()
+                found = repository.search_properties(cur, location, date.date(), property_type, min_bedrooms,
+                                                     max_bedrooms, min_price, max_price, order_by, keywords,
+                                                     neighborhood)
+                if found.suggested_city or found.suggested_neighborhood:
+                    suggestion = ', '.join(name for name in (found.suggested_city, found.suggested_neighborhood) if name)
+                    print(f"Did you mean {suggestion}? Showing results for that instead.")
+                results = found.results
                 if not results:
                     print("No properties found matching your criteria.")
                 for result in results:
                     print(f"""Property Found!
-                          Property ID: {result[0]}
-                          Address: {result[1]}, {result[2]}, {result[3]} {result[4]}
-                          Price: {result[5]}
-                          Type: {result[6]}
-                          Description: {result[7]}
-                          Bedrooms: {result[8]}
-                          Square Footage: {result[9]}
-                          Neighborhood: {result[10]}
-                          Subtype Info: {result[11]}
+                          Property ID: {result.property_id}
+                          Address: {result.street}, {result.city}, {result.state} {result.zip}
+                          Price: {result.price}
+                          Type: {result.type}
+                          Description: {result.description}
+                          Bedrooms: {result.bedrooms}
+                          Square Footage: {result.square_footage}
+                          Neighborhood: {result.neighborhood}
+                          Neighborhood listings: {result.neighborhood_listings or 0} (average price {result.neighborhood_average_price or 'N/A'})
+                          Neighborhood bookings (last 30 days): {result.neighborhood_bookings_30d or 0}
+                          Subtype Info: {result.subtype_info}
                           """)
     except Exception as e:
         print(f"Error searching properties: {str(e)}")
+        return False
 
 def book_property(property_id, start_date, end_date, payment_method):
     session_email, role = load_session()
     if role != 'renter':
         print("Access denied: Only renters can book properties.")
-        return
+        return False
 
     try:
+        import repository
+        import invalidation
+        import jobs
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT 1 FROM CreditCard WHERE Renter_Email = %s AND Card_Number = %s', (session_email, payment_method))
-                if not cur.fetchone():
+                if _reference_cache is not None:
+                    card_ok = any(c.card_number == payment_method for c in _reference_cache.cards(session_email))
+                else:
+                    card_ok = repository.get_card(cur, session_email, payment_method)
+                if not card_ok:
                     print("Invalid payment method.")
-                    return
+                    return False
 
-                cur.execute('''
-                    SELECT 1 FROM Booking
-                    WHERE Property_ID = %s
-                    AND (
-                        (Start_Date <= %s AND End_Date >= %s) OR
-                        (Start_Date <= %s AND End_Date >= %s) OR
-                        (Start_Date >= %s AND End_Date <= %s)
-                    )
-                ''', (property_id, start_date, start_date, end_date, end_date, start_date, end_date))
-                if cur.fetchone():
+                if repository.booking_overlaps(cur, property_id, start_date.date(), end_date.date()):
                     print("Property is not available for the selected period.")
-                    return
+                    return False
 
                 cur.execute('SELECT Price, Street, City, State, Zip, Type, Description FROM Property WHERE Property_ID = %s', (property_id,))
                 prop = cur.fetchone()
                 if not prop:
                     print("Property not found.")
-                    return
+                    return False
                 price = float(prop[0])
 
                 days = (end_date - start_date).days
                 if days <= 0:
                     print("End date must be after start date.")
-                    return
+                    return False
+                if days > repository.MAX_STAY_NIGHTS:
+                    print(f"Stays are limited to {repository.MAX_STAY_NIGHTS} nights.")
+                    return False
                 total_cost = days * price
 
-                # Add reward points equal to the rental price
                 cur.execute('''
-                    UPDATE Renter
-                    SET Reward_Points = Reward_Points + %s
-                    WHERE Email = %s
-                ''', (total_cost, session_email))
+                    INSERT INTO Booking (Property_ID, Renter_Email, Booking_Date, Card_Number, Start_Date, End_Date, Stay_Date)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    RETURNING Booking_ID
+                ''', (property_id, session_email, datetime.now().date(), payment_method, start_date, end_date,
+                      start_date.date()))
+                booking_id = cur.fetchone()[0]
+                invalidation.publish(cur, 'booking', property_id, prop[2])
 
-                cur.execute('''
-                    INSERT INTO Booking (Property_ID, Renter_Email, Booking_Date, Card_Number, Start_Date, End_Date)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                ''', (property_id, session_email, datetime.now().date(), payment_method, start_date, end_date))
+                # Reward points equal to the rental price, credited by the job worker
+                jobs.enqueue(cur, 'booking_reward', email=session_email, points=total_cost, property_id=property_id,
+                             booking_id=booking_id, nights=days)
                 conn.commit()
 
-                # Get updated reward points
-                cur.execute('SELECT Reward_Points FROM Renter WHERE Email = %s', (session_email,))
-                reward_points = cur.fetchone()[0]
-
                 print(f"""Booking successful!
                       Property ID: {property_id}
                       Address: {prop[1]}, {prop[2]}, {prop[3]} {prop[4]}
@@ -453,95 +504,57 @@ def book_property(property_id, start_date, end_date, payment_method):
                       Rental period: {start_date} to {end_date}
                       Payment method: {payment_method}
                       Total cost: ${total_cost:.2f}
-                      Reward points earned: {total_cost}
-                      Total reward points: {reward_points}
+                      Reward points: {total_cost} for reward program members (see view_rewards)
                       """)
     except Exception as e:
         print(f"Error booking property: {str(e)}")
+        return False
 
 def manage_bookings(action, booking_id=None):
     session_email, role = load_session()
     if role not in ['renter', 'agent']:
         print("Access denied: Only renters and agents can manage bookings.")
-        return
+        return False
 
     try:
+        import invalidation
+        import jobs
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 if action == 'view':
-                    if role == 'renter':
-                        cur.execute('''
-                            SELECT b.Booking_ID, b.Property_ID, b.Start_Date, b.End_Date, b.Card_Number, p.Price, p.Street, p.City, p.State, p.Zip, p.Type, p.Description
-                            FROM Booking b
-                            JOIN Property p ON b.Property_ID = p.Property_ID
-                            WHERE b.Renter_Email = %s;
-                        ''', (session_email,))
-                        bookings = cur.fetchall()
-                        for booking in bookings:
-                            start_date = booking[2]
-                            end_date = booking[3]
-                            if start_date is None or end_date is None:
-                                print(f"""BookingID: {booking[0]}
-                                      PropertyID: {booking[1]}
-                                      Period: MISSING DATES
-                                      Card: {booking[4]}
-                                      Total: UNKNOWN
-                                      """)
-                                continue
-                            days = (end_date - start_date).days
-                            total_cost = days * float(booking[5])
-                            print(f"""BookingID: {booking[0]}
-                                  PropertyID: {booking[1]}
-                                  Address: {booking[6]}, {booking[7]}, {booking[8]} {booking[9]}
-                                  Type: {booking[10]}
-                                  Description: {booking[11]}
-                                  Period: {start_date} to {end_date}
-                                  Card: {booking[4]}
-                                  Total: ${total_cost:.2f}
-                                  """)
-                    elif role == 'agent':
-                        cur.execute('''
-                            SELECT b.Booking_ID, b.Property_ID, b.Start_Date, b.End_Date, b.Card_Number, b.Renter_Email, p.Price, p.Street, p.City, p.State, p.Zip, p.Type, p.Description
-                            FROM Booking b
-                            JOIN Property p ON b.Property_ID = p.Property_ID
-                            WHERE p.Agent_Email = %s;
-                        ''', (session_email,))
-                        bookings = cur.fetchall()
-                        for booking in bookings:
-                            start_date = booking[2]
-                            end_date = booking[3]
-                            if start_date is None or end_date is None:
-                                print(f"""BookingID: {booking[0]}
-                                      PropertyID: {booking[1]}
-                                      Period: MISSING DATES
-                                      Card: {booking[4]}
-                                      Renter: {booking[5]}
-                                      Total: UNKNOWN
-                                      """)
-                                continue
-                            days = (end_date - start_date).days
-                            total_cost = days * float(booking[6])
-                            print(f"""BookingID: {booking[0]}
-                                  PropertyID: {booking[1]}
-                                  Address: {booking[7]}, {booking[8]}, {booking[9]} {booking[10]}
-                                  Type: {booking[11]}
-                                  Description: {booking[12]}
-                                  Period: {start_date} to {end_date}
-                                  Card: {booking[4]}
-                                  Renter: {booking[5]}
-                                  Total: ${total_cost:.2f}
-                                  """)
+                    for booking in repository.list_bookings(cur, session_email, role):
+                        renter = f"\n                              Renter: {booking.renter_email}" if role == 'agent' else ''
+                        if booking.nights is None:
+                            print(f"""BookingID: {booking.booking_id}
+                              PropertyID: {booking.property_id}
+                              Period: MISSING DATES
+                              Card: {booking.card_number}{renter}
+                              Total: UNKNOWN
+                              """)
+                            continue
+                        total_cost = booking.nights * booking.price
+                        print(f"""BookingID: {booking.booking_id}
+                              PropertyID: {booking.property_id}
+                              Address: {booking.street}, {booking.city}, {booking.state} {booking.zip}
+                              Type: {booking.type}
+                              Description: {booking.description}
+                              Period: {booking.start_date} to {booking.end_date}
+                              Card: {booking.card_number}{renter}
+                              Total: ${total_cost:.2f}
+                              """)
                 elif action == 'cancel' and booking_id:
                     # Fetch booking details for refund message
                     cur.execute('''
-                        SELECT Card_Number, Renter_Email FROM Booking
+                        SELECT Card_Number, Renter_Email, Property_ID, COALESCE(End_Date::date - Start_Date::date, 1)
+                        FROM Booking
                         WHERE Booking_ID = %s
                     ''', (booking_id,))
                     booking = cur.fetchone()
                     if not booking:
                         print("Booking not found.")
-                        return
-                    card, renter = booking
+                        return False
+                    card, renter, booked_property, nights = booking
                     if role == 'renter':
                         cur.execute('''
                             DELETE FROM Booking
@@ -563,29 +576,28 @@ def manage_bookings(action, booking_id=None):
                               Booking ID: {booking_id}
                               Refund issued to renter {renter} on card: {card}
                               """)
+                    if cur.rowcount:
+                        invalidation.publish(cur, 'booking', booked_property)
+                        jobs.enqueue(cur, 'booking_cancelled', email=renter, property_id=booked_property,
+                                     booking_id=booking_id, nights=nights)
                     conn.commit()
     except Exception as e:
         print(f"Error managing bookings: {str(e)}")
+        return False
 
 def add_address(address_info):
     session_email, role = load_session()
     if role != 'renter':
         print("Access denied: Only renters can manage addresses.")
-        return
+        return False
 
     try:
         street, city, state, zip_code, primary_address = address_info.split(', ')
         primary_address = primary_address.upper() == 'TRUE'
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                if primary_address:
-                    cur.execute('UPDATE Address SET Primary_Address = FALSE WHERE Email = %s', (session_email,))
-                cur.execute('''
-                    INSERT INTO Address (Street, City, State, Zip, Email, Primary_Address)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING AddressID
-                ''', (street, city, state, zip_code, session_email, primary_address))
-                new_address_id = cur.fetchone()[0]
+                new_address_id = repository.add_address(cur, session_email, street, city, state, zip_code, primary_address)
                 conn.commit()
         print(f"""Address added!
               AddressID: {new_address_id}
@@ -597,29 +609,24 @@ def add_address(address_info):
               """)
     except Exception as e:
         print(f"Error adding address: {str(e)}")
+        return False
 
 def modify_address(address_id, address_info):
     session_email, role = load_session()
     if role != 'renter':
         print("Access denied: Only renters can manage addresses.")
-        return
+        return False
 
     try:
         street, city, state, zip_code, primary_address = address_info.split(', ')
         primary_address = primary_address.upper() == 'TRUE'
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT 1 FROM Address WHERE Email = %s AND AddressID = %s', (session_email, address_id))
-                if not cur.fetchone():
+                if not repository.get_address(cur, session_email, address_id):
                     print(f"Error: Address {address_id} not found or not owned by you.")
-                    return
-                if primary_address:
-                    cur.execute('UPDATE Address SET Primary_Address = FALSE WHERE Email = %s', (session_email,))
-                cur.execute('''
-                    UPDATE Address
-                    SET Street = %s, City = %s, State = %s, Zip = %s, Primary_Address = %s
-                    WHERE Email = %s AND AddressID = %s
-                ''', (street, city, state, zip_code, primary_address, session_email, address_id))
+                    return False
+                repository.update_address(cur, session_email, address_id, street, city, state, zip_code, primary_address)
                 conn.commit()
         print(f"""Address modified!
               AddressID: {address_id}
@@ -631,179 +638,773 @@ def modify_address(address_id, address_info):
               """)
     except Exception as e:
         print(f"Error modifying address: {str(e)}")
+        return False
 
 def delete_address(address_id):
     session_email, role = load_session()
     if role != 'renter':
         print("Access denied: Only renters can manage addresses.")
-        return
+        return False
 
     try:
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT Street, City, State, Zip, Primary_Address FROM Address WHERE Email = %s AND AddressID = %s', (session_email, address_id))
-                address = cur.fetchone()
+                address = repository.get_address(cur, session_email, address_id)
                 if not address:
                     print(f"Error: Address {address_id} not found or not owned by you.")
-                    return
-                cur.execute('''
-                    SELECT 1 FROM CreditCard
-                    WHERE Billing_Address = %s AND Renter_Email = %s
-                ''', (address_id, session_email))
-                if cur.fetchone():
+                    return False
+                if repository.address_is_billing(cur, session_email, address_id):
                     print("Cannot delete address: It is used as a billing address for a credit card.")
-                    return
-                cur.execute('''
-                    DELETE FROM Address
-                    WHERE Email = %s AND AddressID = %s
-                ''', (session_email, address_id))
+                    return False
+                repository.delete_address(cur, session_email, address_id)
                 conn.commit()
         print(f"""Address deleted!
               AddressID: {address_id}
-              Street: {address[0]}
-              City: {address[1]}
-              State: {address[2]}
-              Zip: {address[3]}
-              Primary: {address[4]}
+              Street: {address.street}
+              City: {address.city}
+              State: {address.state}
+              Zip: {address.zip}
+              Primary: {address.primary_address}
               """)
     except Exception as e:
         print(f"Error deleting address: {str(e)}")
+        return False
+
+def import_properties(path, fmt=None, dry_run=False):
+    session_email, role = load_session()
+    if role != 'agent':
+        print("Access denied: Only agents can import properties.")
+        return False
+
+    try:
+        import bulk
+        with get_db_connection() as conn:
+            imported, errors = bulk.import_properties(conn, session_email, path, fmt)
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+        for row_no, message in errors:
+            print(f"Row {row_no}: {message}")
+        print(f"""Property import {'checked' if dry_run else 'finished'}!
+              File: {path}
+              Imported: {0 if dry_run else imported}{f' (would import {imported})' if dry_run else ''}
+              Rejected: {len(errors)}
+              """)
+    except Exception as e:
+        print(f"Error importing properties: {str(e)}")
+        return False
+
+def bulk_adjust(city=None, neighborhood=None, property_type=None, property_ids=None, percent=None, amount=None,
+                availability=None, preview=False, batch_size=None):
+    session_email, role = load_session()
+    if role != 'agent':
+        print("Access denied: Only agents can update properties.")
+        return False
+    if not preview and percent is None and amount is None and availability is None:
+        print("Nothing to change: give --percent or --amount and/or --availability.")
+        return False
+
+    try:
+        import bulk
+        filters = dict(city=city, neighborhood=neighborhood, property_type=property_type, property_ids=property_ids)
+        with get_db_connection() as conn:
+            if preview:
+                with conn.cursor() as cur:
+                    count, low, high = bulk.preview_adjustment(cur, session_email, **filters)
+                print(f"""Bulk update preview:
+              Matching properties: {count}
+              Price range: {f'${low} - ${high}' if count else 'N/A'}
+              """)
+                return
+            updated = bulk.adjust_properties(conn, session_email, percent=percent, amount=amount,
+                                             availability=availability,
+                                             batch_size=batch_size or bulk.ADJUST_BATCH_SIZE, **filters)
+        print(f"""Bulk update finished!
+              Updated properties: {updated}
+              """)
+    except Exception as e:
+        print(f"Error updating properties: {str(e)}")
+        return False
+
+def view_analytics(start_date=None, end_date=None):
+    session_email, role = load_session()
+    if role != 'agent':
+        print("Access denied: Only agents can view analytics.")
+        return False
+    end_date = end_date or datetime.now().date()
+    start_date = start_date or end_date - timedelta(days=364)
+    if start_date > end_date:
+        print("Start date must be on or before end date.")
+        return False
+
+    try:
+        import repository
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                stats = repository.agent_analytics(cur, session_email, start_date, end_date)
+        days = (end_date - start_date).days + 1
+        for s in stats:
+            print(f"""PropertyID: {s.property_id}
+                  Address: {s.street}, {s.city}, {s.state} {s.zip}
+                  Type: {s.type}
+                  Occupancy: {100 * s.nights / days:.1f}% ({s.nights} nights)
+                  Revenue: ${s.revenue:.2f}
+                  Average nightly revenue: ${s.revenue / s.nights if s.nights else 0:.2f}
+                  Bookings: {s.stays}
+                  """)
+        nights = sum(s.nights for s in stats)
+        revenue = sum(s.revenue for s in stats)
+        print(f"""Analytics {start_date} to {end_date}:
+              Properties: {len(stats)}
+              Occupancy: {100 * nights / (days * len(stats)) if stats else 0:.1f}%
+              Revenue: ${revenue:.2f}
+              Bookings: {sum(s.stays for s in stats)}
+              """)
+    except Exception as e:
+        print(f"Error viewing analytics: {str(e)}")
+        return False
+
+def require_admin(action):
+    session_email, role = load_session()
+    import repository
+    if role != 'agent' or not repository.is_admin(session_email):
+        print(f"Access denied: Only admins can {action}.")
+        return False
+    return True
+
+def export_data(kind, fmt='csv', output='-', agent=None, start_date=None, end_date=None):
+    session_email, role = load_session()
+    if role != 'agent':
+        print("Access denied: Only agents can export data.")
+        return False
+    import repository
+    if not repository.is_admin(session_email):
+        if agent and agent != session_email:
+            print("Access denied: Only admins can export other agents' data.")
+            return False
+        agent = session_email
+    if fmt == 'parquet' and output == '-':
+        print("Parquet exports need an --output file.")
+        return False
+
+    try:
+        import bulk
+        with get_db_connection() as conn:
+            if output == '-':
+                bulk.write_export(conn, kind, fmt, sys.stdout, agent_email=agent, start_date=start_date, end_date=end_date)
+                return
+            mode, newline = ('wb', None) if fmt == 'parquet' else ('w', '')
+            with open(output, mode, newline=newline) as out:
+                bulk.write_export(conn, kind, fmt, out, agent_email=agent, start_date=start_date, end_date=end_date)
+        print(f"""Export finished!
+              Data: {kind}
+              Format: {fmt}
+              File: {output}
+              Agent: {agent or 'all agents'}
+              """)
+    except Exception as e:
+        print(f"Error exporting data: {str(e)}")
+        return False
 
 def view_addresses():
     session_email, role = load_session()
     if not session_email:
         print("Not logged in.")
-        return
+        return False
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute('SELECT AddressID, Street, City, State, Zip, Primary_Address FROM Address WHERE Email = %s', (session_email,))
-                addresses = cur.fetchall()
-                if addresses:
-                    for address in addresses:
-                        print(f"""AddressID: {address[0]}
-                              Street: {address[1]}
-                              City: {address[2]}
-                              State: {address[3]}
-                              Zip: {address[4]}
-                              Primary: {address[5]}
-                              """)
-                else:
-                    print("No addresses found for this user.")
+        if _reference_cache is not None:
+            addresses = _reference_cache.addresses(session_email)
+        else:
+            import repository
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    addresses = repository.list_addresses(cur, session_email)
+        if addresses:
+            for address in addresses:
+                print(f"""AddressID: {address.address_id}
+                      Street: {address.street}
+                      City: {address.city}
+                      State: {address.state}
+                      Zip: {address.zip}
+                      Primary: {address.primary_address}
+                      """)
+        else:
+            print("No addresses found for this user.")
     except Exception as e:
         print(f"Error viewing addresses: {str(e)}")
+        return False
 
 def view_reward_points():
     session_email, role = load_session()
     if role != 'renter':
         print("Access denied: Only renters can view reward points.")
-        return
+        return False
 
     try:
+        import repository
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT Reward_Points FROM Renter WHERE Email = %s', (session_email,))
-                result = cur.fetchone()
-                if result:
+                points = repository.reward_balance(cur, session_email)
+                if points is not None:
                     print(f"""Reward Points Information:
                           Email: {session_email}
-                          Total Reward Points: {result[0]}
+                          Total Reward Points: {points}
                           """)
                 else:
                     print("No reward points information found.")
     except Exception as e:
         print(f"Error viewing reward points: {str(e)}")
+        return False
 
-def main():
+def run_migrations():
+    if not require_admin('apply migrations'):
+        return False
+    try:
+        import db
+        with get_db_connection() as conn:
+            applied = db.migrate(conn)
+        for name in applied:
+            print(f"Applied {name}")
+        print(f"Migrations up to date ({len(applied)} applied).")
+    except Exception as e:
+        print(f"Error applying migrations: {str(e)}")
+        return False
+
+def init_shards():
+    if not require_admin('prepare shards'):
+        return False
+    try:
+        import db
+        if not db.SHARDS:
+            print("DB_SHARD_DSNS is not set; nothing to do.")
+            return
+        for index, shard in enumerate(db.SHARDS):
+            conn = shard.connect()
+            try:
+                applied = db.migrate(conn)
+                db.prepare_shard(conn, index, len(db.SHARDS))
+            finally:
+                conn.close()
+            print(f"{shard.name}: {len(applied)} migrations applied, new IDs are {index} mod {len(db.SHARDS)}.")
+    except Exception as e:
+        print(f"Error preparing shards: {str(e)}")
+        return False
+
+def booking_partitions(months_ahead):
+    if not require_admin('create booking partitions'):
+        return False
+    try:
+        import partitions
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                created = partitions.create_ahead(cur, months_ahead)
+                conn.commit()
+                months = partitions.list_partitions(cur)
+        print(f"Created {created} booking partitions; {len(months)} months from {months[0][1]:%Y-%m} to {months[-1][1]:%Y-%m}." if months else "No booking partitions.")
+    except Exception as e:
+        print(f"Error creating booking partitions: {str(e)}")
+        return False
+
+def archive_bookings(retention_months, output_dir=None):
+    if not require_admin('archive bookings'):
+        return False
+    try:
+        import partitions
+        before = partitions.add_months(datetime.now().date(), -retention_months)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with get_db_connection() as conn:
+            archived, held = partitions.archive(conn, before, output_dir)
+        for name, rows in archived:
+            print(f"Archived {name}: {rows} bookings{f' to {output_dir}' if output_dir else ''}")
+        if held:
+            print(f"Kept {held} and later months: {held} has a stay that ends on or after {before}.")
+        print(f"Archived {len(archived)} months of stays before {before}.")
+    except Exception as e:
+        print(f"Error archiving bookings: {str(e)}")
+        return False
+
+def check_neighborhood_stats(repair=False):
+    if repair and not require_admin('rebuild neighborhood stats'):
+        return False
+    try:
+        import repository
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                drift = repository.neighborhood_stats_drift(cur)
+                for d in drift:
+                    print(f"{d.neighborhood}{f' {d.day}' if d.day else ''} {d.field}: stored {d.stored}, expected {d.expected}")
+                if drift and repair:
+                    repository.rebuild_neighborhood_stats(cur)
+                    conn.commit()
+        print(f"""Neighborhood stats check finished!
+              Differences: {len(drift)}
+              {'Rebuilt from Property and Booking.' if drift and repair else 'Use --repair to rebuild.' if drift else 'Rollups match.'}
+              """)
+    except Exception as e:
+        print(f"Error checking neighborhood stats: {str(e)}")
+        return False
+
+# Meant for cron: folds new ledger entries into the balance snapshots so
+# reading a balance only sums a short tail.
+def compact_rewards():
+    if not require_admin('compact rewards'):
+        return False
+    try:
+        import repository
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                horizon = repository.reward_compaction_horizon(cur)
+                conn.commit()
+                compacted = repository.compact_reward_balances(cur, horizon)
+                conn.commit()
+        print(f"""Reward compaction finished!
+              Up to entry: {horizon}
+              Renters updated: {compacted}
+              """)
+    except Exception as e:
+        print(f"Error compacting rewards: {str(e)}")
+        return False
+
+def run_command(parser, argv):
+    import io
+    from contextlib import redirect_stderr, redirect_stdout
+    out = io.StringIO()
+    ok = False
+    with redirect_stdout(out), redirect_stderr(out):
+        try:
+            args = parser.parse_args(argv)
+            if args.command in (None, 'batch', 'shell'):
+                print(f"Command not available here: {args.command}")
+            elif args.command in OWN_CONNECTION:
+                ok = run_unshared(parser, args)
+            else:
+                # Commands return False when they fail and print why.
+                succeeded = False
+                _shared_conn.start()
+                try:
+                    succeeded = dispatch(parser, args) is not False
+                finally:
+                    ok = _shared_conn.finish(succeeded)
+        except SystemExit:
+            pass
+        except Exception as e:
+            ok = False
+            print(f"Error running command: {str(e)}")
+    return ok, out.getvalue().strip()
+
+def run_unshared(parser, args):
+    global _shared_conn
+    shared = _shared_conn
+    # Otherwise the open group's row locks could block the command itself.
+    shared.commit_group()
+    _shared_conn = None
+    try:
+        return dispatch(parser, args) is not False
+    finally:
+        _shared_conn = shared
+
+def run_batch(parser, source, group_size=1):
+    global _shared_conn
+    import json
+    stream = sys.stdin if source == '-' else open(source)
+    conn = connect(prepared=True)
+    _shared_conn = CommandConnection(conn)
+    pending = 0
+    try:
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            result = {'line': line_no}
+            try:
+                # Either ["login", "a@b.com"] or {"id": ..., "argv": [...]}
+                entry = json.loads(line)
+                if isinstance(entry, dict):
+                    if 'id' in entry:
+                        result['id'] = entry['id']
+                    entry = entry['argv']
+                if not isinstance(entry, list) or not entry:
+                    raise TypeError("expected a non-empty argv list")
+                argv = [str(arg) for arg in entry]
+            except (ValueError, KeyError, TypeError) as e:
+                result.update(command=None, ok=False, output=f"Invalid command line: {str(e)}")
+            else:
+                result['command'] = argv[0]
+                result['ok'], result['output'] = run_command(parser, argv)
+                pending += 1
+                if group_size > 0 and pending >= group_size:
+                    conn.commit()
+                    pending = 0
+            print(json.dumps(result), flush=True)
+        conn.commit()
+    finally:
+        _shared_conn = None
+        conn.close()
+        if stream is not sys.stdin:
+            stream.close()
+
+# Which cached reference data each command can make stale.
+SHELL_INVALIDATES = {
+    'login': ('cards', 'addresses'),
+    'register': ('cards', 'addresses'),
+    'manage_payment': ('cards',),
+    'manage_address': ('addresses',),
+}
+
+class ReferenceCache:
+    def __init__(self, conn):
+        import repository
+        self.repository = repository
+        self.conn = conn
+        self.data = {}
+
+    # Loads may run inside a command's savepoint, so they leave committing to
+    # the shell, which commits after every line.
+    def _load(self, key, loader, *args):
+        if key not in self.data:
+            with self.conn.cursor() as cur:
+                self.data[key] = loader(cur, *args)
+        return self.data[key]
+
+    def neighborhoods(self):
+        return self._load('neighborhoods', self.repository.list_neighborhoods)
+
+    def cards(self, email):
+        return self._load('cards', self.repository.list_cards, email)
+
+    def addresses(self, email):
+        return self._load('addresses', self.repository.list_addresses, email)
+
+    def invalidate(self, *keys):
+        for key in keys or list(self.data):
+            self.data.pop(key, None)
+
+class Shell(cmd.Cmd):
+    intro = "Real Estate Management shell. Type help or ? to list commands, exit to quit."
+
+    def __init__(self, parser, conn):
+        super().__init__()
+        self.parser = parser
+        self.conn = conn
+        self.cache = ReferenceCache(conn)
+        subparsers = next(a for a in parser._actions if isinstance(a, argparse._SubParsersAction))
+        self.subcommands = {name: sub for name, sub in subparsers.choices.items() if name not in ('batch', 'shell')}
+        self.update_prompt()
+
+    def update_prompt(self):
+        email, role = load_session()
+        self.prompt = f"({email} {role}) > " if email else "(not logged in) > "
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            print(f"Error parsing command: {str(e)}")
+            return
+        if argv[0] not in self.subcommands:
+            print(f"Unknown command: {argv[0]}")
+            return
+        ok, output = run_command(self.parser, argv)
+        if output:
+            print(output)
+        if ok and not (argv[0] == 'manage_address' and argv[1:2] == ['view']):
+            self.cache.invalidate(*SHELL_INVALIDATES.get(argv[0], ()))
+        self.update_prompt()
+
+    def postcmd(self, stop, line):
+        self.conn.commit()
+        return stop
+
+    def completenames(self, text, *ignored):
+        names = list(self.subcommands) + [name[3:] for name in self.get_names() if name.startswith('do_')]
+        return sorted(name for name in set(names) if name.startswith(text))
+
+    def completedefault(self, text, line, begidx, endidx):
+        words = line[:begidx].split()
+        sub = self.subcommands.get(words[0]) if words else None
+        if sub is None:
+            return []
+        options = []
+        for action in sub._actions:
+            options.extend(action.option_strings)
+            if action.choices and not action.option_strings and len(words) == 1:
+                options.extend(action.choices)
+        return sorted(option for option in options if option.startswith(text))
+
+    def do_neighborhoods(self, arg):
+        """List neighborhoods (cached)."""
+        for n in self.cache.neighborhoods():
+            print(f"{n.name}: crime rate {n.crime_rate}, nearby schools {n.nearby_schools}")
+
+    def do_cards(self, arg):
+        """List your credit cards (cached)."""
+        email, role = load_session()
+        if role != 'renter':
+            print("Access denied: Only renters have credit cards.")
+            return
+        for card in self.cache.cards(email):
+            print(f"Card {card.card_number}: expires {card.expiry_date}, billing address {card.billing_address}")
+
+    def do_addresses(self, arg):
+        """List your addresses (cached)."""
+        email, role = load_session()
+        if not email:
+            print("Not logged in.")
+            return
+        for a in self.cache.addresses(email):
+            print(f"AddressID {a.address_id}: {a.street}, {a.city}, {a.state} {a.zip}{' (primary)' if a.primary_address else ''}")
+
+    def do_refresh(self, arg):
+        """Drop cached reference data."""
+        self.cache.invalidate()
+
+    def do_whoami(self, arg):
+        """Show the logged in user."""
+        email, role = load_session()
+        print(f"{email} ({role})" if email else "Not logged in.")
+
+    def do_exit(self, arg):
+        """Leave the shell."""
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, arg):
+        print()
+        return True
+
+    def do_help(self, arg):
+        if arg in self.subcommands:
+            self.subcommands[arg].print_help()
+        else:
+            super().do_help(arg)
+            print("Subcommands (same arguments as the CLI):")
+            self.columnize(sorted(self.subcommands))
+
+def run_shell(parser):
+    global _shared_conn, _reference_cache
+    conn = connect(prepared=True)
+    _shared_conn = CommandConnection(conn)
+    try:
+        shell = Shell(parser, conn)
+        _reference_cache = shell.cache
+        shell.cmdloop()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        _shared_conn = None
+        _reference_cache = None
+        conn.close()
+
+def _login_args(p):
+    p.add_argument('email', type=str, help='Email of the user')
+
+def _register_args(p):
+    p.add_argument('email', type=str, help='Email of the user')
+    p.add_argument('name', type=str, help='Name of the user')
+    p.add_argument('user_type', type=str, choices=['agent', 'renter'], help='Type of user')
+
+def _payment_args(p):
+    p.add_argument('action', type=str, choices=['add', 'modify', 'delete'], help='Action to perform')
+    p.add_argument('--card_info', type=str, help='Credit card information')
+    p.add_argument('--billing_address', type=int, help='Billing address ID')
+    p.add_argument('--expiry', type=str, default="2025-01-01", help='Expiry date (YYYY-MM-DD)')
+    p.add_argument('--cvv', type=str, help='CVV (3 digits)')
+
+def _property_args(p):
+    p.add_argument('action', type=str, choices=['add', 'modify', 'delete'], help='Action to perform')
+    p.add_argument('--property_id', type=int, help='ID of the property (for modify/delete)')
+    p.add_argument('--property_info', type=str, help='Property information')
+
+def _search_args(p):
+    p.add_argument('location', type=str, help='Location to search')
+    p.add_argument('date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help='Date for availability')
+    p.add_argument('--property_type', type=str, help='Property type')
+    p.add_argument('--min_bedrooms', type=int, help='Minimum bedrooms')
+    p.add_argument('--max_bedrooms', type=int, help='Maximum bedrooms')
+    p.add_argument('--min_price', type=float, help='Minimum price')
+    p.add_argument('--max_price', type=float, help='Maximum price')
+    p.add_argument('--order_by', type=str, choices=['price', 'bedrooms'], help='Order by')
+    p.add_argument('--keywords', type=str, help='Words to find in descriptions and amenities, e.g. \'pool "ocean view"\'')
+    p.add_argument('--neighborhood', type=str, help='Neighborhood to search (close misspellings are matched)')
+
+def _book_args(p):
+    p.add_argument('property_id', type=int, help='ID of the property')
+    p.add_argument('start_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help='Start date of rental')
+    p.add_argument('end_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help='End date of rental')
+    p.add_argument('payment_method', type=str, help='Payment method to use')
+
+def _booking_args(p):
+    p.add_argument('action', type=str, choices=['view', 'cancel'], help='Action to perform')
+    p.add_argument('--booking_id', type=int, help='ID of the booking to manage')
+
+def _address_args(p):
+    p.add_argument('action', type=str, choices=['add', 'view', 'modify', 'delete'], help='Action to perform')
+    p.add_argument('--address_info', type=str, help='Address information')
+    p.add_argument('--address_id', type=int, help='ID of the address to modify or delete')
+
+def _import_args(p):
+    p.add_argument('file', type=str, help='CSV (with header) or NDJSON file of properties')
+    p.add_argument('--format', type=str, choices=['csv', 'ndjson'], help='File format (default: from extension)')
+    p.add_argument('--dry_run', action='store_true', help='Validate and report without saving')
+
+def _export_args(p):
+    p.add_argument('kind', type=str, choices=['bookings', 'properties'], help='Data to export')
+    p.add_argument('--format', type=str, choices=['csv', 'ndjson', 'parquet'], default='csv', help='Output format')
+    p.add_argument('--output', type=str, default='-', help='Output file (default: stdout)')
+    p.add_argument('--agent', type=str, help='Agent email to export (admins only; defaults to yourself)')
+    p.add_argument('--start_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), help='Only stays ending after this date (YYYY-MM-DD)')
+    p.add_argument('--end_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), help='Only stays starting on or before this date (YYYY-MM-DD)')
+
+def _analytics_args(p):
+    p.add_argument('--start_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), help='First night (YYYY-MM-DD, default: a year before end)')
+    p.add_argument('--end_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), help='Last night (YYYY-MM-DD, default: today)')
+
+def _bulk_adjust_args(p):
+    p.add_argument('--city', type=str, help='Only properties in this city')
+    p.add_argument('--neighborhood', type=str, help='Only properties in this neighborhood')
+    p.add_argument('--property_type', type=str, help='Only properties of this type')
+    p.add_argument('--property_ids', type=lambda s: [int(i) for i in s.split(',')], help='Comma-separated property IDs')
+    change = p.add_mutually_exclusive_group()
+    change.add_argument('--percent', type=float, help='Change prices by this percentage (e.g. -10)')
+    change.add_argument('--amount', type=float, help='Change prices by this amount (e.g. 25)')
+    p.add_argument('--availability', type=str, choices=['available', 'unavailable'], help='Set availability')
+    p.add_argument('--preview', action='store_true', help='Only show how many properties match')
+    p.add_argument('--batch_size', type=int, help='Properties updated per transaction')
+
+def _partition_args(p):
+    p.add_argument('--months_ahead', type=int, default=24, help='Create monthly partitions this far ahead')
+
+def _archive_args(p):
+    p.add_argument('--retention_months', type=int, default=24, help='Keep stays from this many months back in Booking')
+    p.add_argument('--output_dir', type=str, help='Write each archived month to a CSV file here instead of BookingArchive')
+
+def _check_stats_args(p):
+    p.add_argument('--repair', action='store_true', help='Rebuild the rollups if they differ')
+
+def _batch_args(p):
+    p.add_argument('file', type=str, nargs='?', default='-', help='NDJSON command file (default: stdin)')
+    p.add_argument('--group_size', type=int, default=1, help='Commands per transaction (0 = whole batch in one transaction)')
+
+def _no_args(p):
+    pass
+
+SUBCOMMANDS = [
+    ('login', 'Login as a user', _login_args),
+    ('register', 'Register a new user', _register_args),
+    ('manage_payment', 'Manage payment and address information', _payment_args),
+    ('manage_properties', 'Manage properties', _property_args),
+    ('search_properties', 'Search for properties', _search_args),
+    ('book_property', 'Book a property', _book_args),
+    ('manage_bookings', 'Manage bookings', _booking_args),
+    ('manage_address', 'Manage addresses', _address_args),
+    ('import_properties', 'Bulk import properties from CSV or NDJSON', _import_args),
+    ('export_data', 'Stream bookings or properties to CSV, NDJSON or Parquet', _export_args),
+    ('bulk_adjust', 'Change price and/or availability of many properties at once', _bulk_adjust_args),
+    ('analytics', 'Occupancy, revenue and bookings per property', _analytics_args),
+    ('view_rewards', 'View reward points', _no_args),
+    ('migrate', 'Apply pending database migrations', _no_args),
+    ('init_shards', 'Migrate the DB_SHARD_DSNS databases and stride their IDs', _no_args),
+    ('compact_rewards', 'Fold new reward ledger entries into balance snapshots', _no_args),
+    ('check_neighborhood_stats', 'Recompute neighborhood rollups and report differences', _check_stats_args),
+    ('booking_partitions', 'Create monthly Booking partitions ahead of time', _partition_args),
+    ('archive_bookings', 'Move months of past stays out of Booking', _archive_args),
+    ('batch', 'Run NDJSON commands over one connection', _batch_args),
+    ('shell', 'Interactive shell with a persistent connection', _no_args),
+]
+
+# Every subcommand is listed for --help, but only the one being run (or all of
+# them when only is None) gets its arguments added.
+def build_parser(only=None):
     parser = argparse.ArgumentParser(description="Real Estate Management CLI")
     subparsers = parser.add_subparsers(dest='command')
+    for name, help_text, add_arguments in SUBCOMMANDS:
+        subparser = subparsers.add_parser(name, help=help_text)
+        if only is None or only == name:
+            add_arguments(subparser)
+    return parser
 
-    # Login
-    login_parser = subparsers.add_parser('login', help='Login as a user')
-    login_parser.add_argument('email', type=str, help='Email of the user')
-
-    # Register user
-    register_parser = subparsers.add_parser('register', help='Register a new user')
-    register_parser.add_argument('email', type=str, help='Email of the user')
-    register_parser.add_argument('name', type=str, help='Name of the user')
-    register_parser.add_argument('user_type', type=str, choices=['agent', 'renter'], help='Type of user')
-
-    # Manage payment info
-    payment_parser = subparsers.add_parser('manage_payment', help='Manage payment and address information')
-    payment_parser.add_argument('action', type=str, choices=['add', 'modify', 'delete'], help='Action to perform')
-    payment_parser.add_argument('--card_info', type=str, help='Credit card information')
-    payment_parser.add_argument('--billing_address', type=int, help='Billing address ID')
-    payment_parser.add_argument('--expiry', type=str, default="2025-01-01", help='Expiry date (YYYY-MM-DD)')
-    payment_parser.add_argument('--cvv', type=str, help='CVV (3 digits)')
-
-    # Manage properties
-    property_parser = subparsers.add_parser('manage_properties', help='Manage properties')
-    property_parser.add_argument('action', type=str, choices=['add', 'modify', 'delete'], help='Action to perform')
-    property_parser.add_argument('--property_id', type=int, help='ID of the property (for modify/delete)')
-    property_parser.add_argument('--property_info', type=str, help='Property information')
-
-    # Search properties
-    search_parser = subparsers.add_parser('search_properties', help='Search for properties')
-    search_parser.add_argument('location', type=str, help='Location to search')
-    search_parser.add_argument('date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help='Date for availability')
-    search_parser.add_argument('--property_type', type=str, help='Property type')
-    search_parser.add_argument('--min_bedrooms', type=int, help='Minimum bedrooms')
-    search_parser.add_argument('--max_bedrooms', type=int, help='Maximum bedrooms')
-    search_parser.add_argument('--min_price', type=float, help='Minimum price')
-    search_parser.add_argument('--max_price', type=float, help='Maximum price')
-    search_parser.add_argument('--order_by', type=str, choices=['price', 'bedrooms'], help='Order by')
-
-    # Book property
-    book_parser = subparsers.add_parser('book_property', help='Book a property')
-    book_parser.add_argument('property_id', type=int, help='ID of the property')
-    book_parser.add_argument('start_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help='Start date of rental')
-    book_parser.add_argument('end_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help='End date of rental')
-    book_parser.add_argument('payment_method', type=str, help='Payment method to use')
-
-    # Manage bookings
-    booking_parser = subparsers.add_parser('manage_bookings', help='Manage bookings')
-    booking_parser.add_argument('action', type=str, choices=['view', 'cancel'], help='Action to perform')
-    booking_parser.add_argument('--booking_id', type=int, help='ID of the booking to manage')
-
-    # Manage addresses
-    address_parser = subparsers.add_parser('manage_address', help='Manage addresses')
-    address_parser.add_argument('action', type=str, choices=['add', 'view', 'modify', 'delete'], help='Action to perform')
-    address_parser.add_argument('--address_info', type=str, help='Address information')
-    address_parser.add_argument('--address_id', type=int, help='ID of the address to modify or delete')
-
-    # View reward points
-    reward_parser = subparsers.add_parser('view_rewards', help='View reward points')
-
-    args = parser.parse_args()
+# Commands that read or write Property and Booking rows. With DB_SHARD_DSNS
+# set those rows live on the shards and the CLI only talks to the primary.
+SHARDED_COMMANDS = {'manage_properties', 'search_properties', 'book_property', 'manage_bookings',
+                    'import_properties', 'export_data', 'bulk_adjust', 'analytics', 'check_neighborhood_stats',
+                    'archive_bookings'}
 
+def dispatch(parser, args):
+    if args.command in SHARDED_COMMANDS:
+        import db
+        if db.SHARDS:
+            print(f"{args.command} is not available when DB_SHARD_DSNS is set; use the web app.")
+            return False
     if args.command == 'login':
-        login(args.email)
+        return login(args.email)
     elif args.command == 'register':
-        register_user(args.email, args.name, args.user_type)
+        return register_user(args.email, args.name, args.user_type)
     elif args.command == 'manage_payment':
-        manage_payment_info(args.action, args.card_info, args.billing_address, args.expiry, args.cvv)
+        return manage_payment_info(args.action, args.card_info, args.billing_address, args.expiry, args.cvv)
     elif args.command == 'manage_properties':
-        manage_properties(args.action, args.property_id, args.property_info)
+        return manage_properties(args.action, args.property_id, args.property_info)
     elif args.command == 'search_properties':
-        search_properties(args.location, args.date, args.property_type, args.min_bedrooms, args.max_bedrooms, args.min_price, args.max_price, args.order_by)
+        return search_properties(args.location, args.date, args.property_type, args.min_bedrooms, args.max_bedrooms, args.min_price, args.max_price, args.order_by, args.keywords, args.neighborhood)
     elif args.command == 'book_property':
-        book_property(args.property_id, args.start_date, args.end_date, args.payment_method)
+        return book_property(args.property_id, args.start_date, args.end_date, args.payment_method)
     elif args.command == 'manage_bookings':
-        manage_bookings(args.action, args.booking_id)
+        return manage_bookings(args.action, args.booking_id)
     elif args.command == 'manage_address':
         if args.action == 'add':
-            add_address(args.address_info)
+            return add_address(args.address_info)
         elif args.action == 'view':
-            view_addresses()
+            return view_addresses()
         elif args.action == 'modify':
-            modify_address(args.address_id, args.address_info)
+            return modify_address(args.address_id, args.address_info)
         elif args.action == 'delete':
-            delete_address(args.address_id)
+            return delete_address(args.address_id)
+    elif args.command == 'import_properties':
+        return import_properties(args.file, args.format, args.dry_run)
+    elif args.command == 'export_data':
+        return export_data(args.kind, args.format, args.output, args.agent, args.start_date, args.end_date)
+    elif args.command == 'bulk_adjust':
+        availability = {'available': True, 'unavailable': False}.get(args.availability)
+        return bulk_adjust(args.city, args.neighborhood, args.property_type, args.property_ids, args.percent, args.amount,
+                           availability, args.preview, args.batch_size)
+    elif args.command == 'analytics':
+        return view_analytics(args.start_date, args.end_date)
     elif args.command == 'view_rewards':
-        view_reward_points()
+        return view_reward_points()
+    elif args.command == 'migrate':
+        return run_migrations()
+    elif args.command == 'init_shards':
+        return init_shards()
+    elif args.command == 'compact_rewards':
+        return compact_rewards()
+    elif args.command == 'check_neighborhood_stats':
+        return check_neighborhood_stats(args.repair)
+    elif args.command == 'booking_partitions':
+        return booking_partitions(args.months_ahead)
+    elif args.command == 'archive_bookings':
+        return archive_bookings(args.retention_months, args.output_dir)
+    elif args.command == 'batch':
+        run_batch(build_parser(), args.file, args.group_size)
+    elif args.command == 'shell':
+        run_shell(build_parser())
     else:
         parser.print_help()
 
+def main():
+    argv = sys.argv[1:]
+    parser = build_parser(argv[0] if argv else '')
+    args = parser.parse_args(argv)
+    # Before anything imports db, which reads DB_SHARD_DSNS on import.
+    from dotenv import load_dotenv
+    load_dotenv()
+    if dispatch(parser, args) is False:
+        sys.exit(1)
+
 if __name__ == '__main__':
     main()
-
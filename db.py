@@ -0,0 +1,287 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2 import sql
+
+import metrics
+
+_round_trips = threading.local()
+_settings = threading.local()
+
+def round_trips():
+    # Statements sent by this thread so far; callers diff two readings.
+    return getattr(_round_trips, 'count', 0)
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def _sent(self):
+        _round_trips.count = round_trips() + 1
+
+    def execute(self, query, vars=None):
+        self._sent()
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._sent()
+        return super().copy_expert(sql, file, size)
+
+class PreparedConnection(psycopg2.extensions.connection):
+    # Tracks the server-side prepared statements that exist on this connection
+    # so repository.py only sends PREPARE once per pooled connection.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = CountingCursor
+        self.statement_timeout = None
+
+def connection_params():
+    return dict(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=int(os.getenv('DB_PORT', '5432')),
+        database=os.getenv('DB_NAME', 'realestate_db'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', '1234')
+    )
+
+def connect(**overrides):
+    return psycopg2.connect(connection_factory=PreparedConnection, **{**connection_params(), **overrides})
+
+_pool = None
+_pool_pid = None
+
+def get_pool():
+    global _pool, _pool_pid
+    # Pools are per process; a forked worker must not reuse its parent's sockets.
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            int(os.getenv('DB_POOL_MIN', '1')),
+            int(os.getenv('DB_POOL_MAX', '10')),
+            connection_factory=PreparedConnection,
+            **connection_params()
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+@contextmanager
+def statement_timeout(ms):
+    # Connections borrowed by this thread inside the block get this
+    # statement_timeout (None = server default).
+    previous = getattr(_settings, 'statement_timeout', None)
+    _settings.statement_timeout = ms
+    try:
+        yield
+    finally:
+        _settings.statement_timeout = previous
+
+def current_statement_timeout():
+    return getattr(_settings, 'statement_timeout', None)
+
+def _apply_settings(conn):
+    # Only sends SET when this connection's last value differs. Committed
+    # straight away so a rollback later in the request cannot undo it.
+    wanted = current_statement_timeout()
+    if conn.statement_timeout == wanted:
+        return
+    with conn.cursor() as cur:
+        if wanted is None:
+            cur.execute('RESET statement_timeout')
+        else:
+            cur.execute('SET statement_timeout = %s', (int(wanted),))
+    conn.commit()
+    conn.statement_timeout = wanted
+
+# Read replicas, as comma-separated libpq DSNs. get_db_connection(replica=True)
+# borrows from them in turn, skipping any that failed a connect or health
+# check in the last REPLICA_CHECK_INTERVAL seconds or that are more than
+# REPLICA_MAX_LAG seconds behind, and falls back to the primary when none is
+# usable. Only pure reads that can tolerate that much staleness should ask
+# for a replica.
+REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '5'))
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+
+_REPLICA_LAG = '''
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+'''
+
+class Database:
+    # A database other than the primary, reached by libpq DSN, with its own
+    # per-process pool.
+    def __init__(self, name, dsn):
+        self.name = name
+        self.dsn = dsn
+        self._pool = None
+        self._pool_pid = None
+
+    def pool(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                0, int(os.getenv('DB_POOL_MAX', '10')), self.dsn, connection_factory=PreparedConnection)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def connect(self, **overrides):
+        return psycopg2.connect(self.dsn, connection_factory=PreparedConnection, **overrides)
+
+class Replica(Database):
+    def __init__(self, name, dsn):
+        super().__init__(name, dsn)
+        self.down_until = 0
+        self.checked_at = float('-inf')
+        self.lag = 0
+
+    def borrow(self):
+        # A healthy connection that is not too far behind, or None.
+        now = time.monotonic()
+        if now < self.down_until:
+            return None
+        try:
+            pool = self.pool()
+            conn = pool.getconn()
+        except psycopg2.pool.PoolError:
+            return None
+        except psycopg2.Error:
+            self.down_until = now + REPLICA_CHECK_INTERVAL
+            return None
+        if now - self.checked_at >= REPLICA_CHECK_INTERVAL:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(_REPLICA_LAG)
+                    self.lag = float(cur.fetchone()[0])
+                conn.commit()
+            except psycopg2.Error:
+                pool.putconn(conn, close=True)
+                self.down_until = now + REPLICA_CHECK_INTERVAL
+                return None
+            self.checked_at = now
+        if self.lag > REPLICA_MAX_LAG:
+            pool.putconn(conn)
+            return None
+        return conn
+
+REPLICAS = [Replica(f'replica{i}', dsn.strip())
+            for i, dsn in enumerate(os.getenv('DB_REPLICA_DSNS', '').split(',')) if dsn.strip()]
+_next_replica = itertools.count()
+
+# Sharded mode: DB_SHARD_DSNS lists one DSN per shard, in an order that must
+# never change. Property (with its subtype and rollup rows) and Booking live on
+# the shard picked by a stable hash of the owning agent's email; users, cards,
+# addresses, neighborhoods, rewards and jobs stay on the primary.
+# `python connect_db.py init_shards` strides each shard's ID sequences so that
+# an ID modulo the shard count is its shard, so a property or booking ID is
+# routed without a lookup. Without DB_SHARD_DSNS the shard_for_* functions
+# return None, which get_db_connection takes to mean the primary.
+SHARDS = [Database(f'shard{i}', dsn.strip())
+          for i, dsn in enumerate(os.getenv('DB_SHARD_DSNS', '').split(',')) if dsn.strip()]
+
+def shard_for_agent(email):
+    if not SHARDS:
+        return None
+    digest = hashlib.blake2b(email.strip().lower().encode(), digest_size=8).digest()
+    return SHARDS[int.from_bytes(digest, 'big') % len(SHARDS)]
+
+def shard_for_id(property_or_booking_id):
+    return SHARDS[int(property_or_booking_id) % len(SHARDS)] if SHARDS else None
+
+# Tables that live on the shards. Everything they reference elsewhere stays on
+# the primary, where the application checks it instead of a foreign key.
+SHARDED_TABLES = ['property', 'house', 'apartment', 'vacation_home', 'land', 'commercial_building', 'booking']
+
+def prepare_shard(conn, index, count):
+    # Run on shard `index` of `count` after its schema and migrations are in
+    # place and before it holds any rows.
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT conrelid::regclass::text, conname FROM pg_constraint
+            WHERE contype = 'f' AND conrelid::regclass::text = ANY(%s) AND NOT confrelid::regclass::text = ANY(%s)
+        ''', (SHARDED_TABLES, SHARDED_TABLES))
+        for table, constraint in cur.fetchall():
+            cur.execute(sql.SQL('ALTER TABLE {} DROP CONSTRAINT {}').format(sql.SQL(table), sql.Identifier(constraint)))
+        for table, column in (('property', 'property_id'), ('booking', 'booking_id')):
+            cur.execute('SELECT pg_get_serial_sequence(%s, %s)', (table, column))
+            sequence = cur.fetchone()[0]
+            if sequence is None:
+                raise ValueError(f'{table}.{column} is not backed by a sequence')
+            cur.execute(sql.SQL('SELECT COALESCE(MAX({}), 0) FROM {}').format(sql.Identifier(column), sql.Identifier(table)))
+            after = cur.fetchone()[0] + 1
+            cur.execute(sql.SQL('ALTER SEQUENCE {} INCREMENT BY {} RESTART WITH {}').format(
+                sql.SQL(sequence), sql.Literal(count), sql.Literal(after + (index - after) % count)))
+        # Partitions on every shard are kept by the primary's booking_partitions
+        # job; the shard's own copy would only be relayed back as a duplicate.
+        cur.execute("DELETE FROM Job WHERE Kind = 'booking_partitions'")
+    conn.commit()
+
+def _borrow(replica):
+    if replica and REPLICAS:
+        start = next(_next_replica)
+        for i in range(len(REPLICAS)):
+            candidate = REPLICAS[(start + i) % len(REPLICAS)]
+            conn = candidate.borrow()
+            if conn is not None:
+                metrics.increment('db_reads_total', target=candidate.name)
+                return candidate.pool(), conn
+        metrics.increment('db_reads_total', target='primary')
+    pool = get_pool()
+    return pool, pool.getconn()
+
+@contextmanager
+def get_db_connection(replica=False, shard=None):
+    if shard is not None:
+        pool = shard.pool()
+        conn = pool.getconn()
+    else:
+        pool, conn = _borrow(replica)
+    try:
+        _apply_settings(conn)
+        yield conn
+        conn.commit()
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# Arbitrary key for pg_advisory_xact_lock so two deploys cannot migrate at once.
+MIGRATION_LOCK = 72177
+
+def pending_migrations(conn, directory=MIGRATIONS_DIR):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                Name VARCHAR(255) PRIMARY KEY,
+                Applied_At TIMESTAMP NOT NULL DEFAULT now()
+            )
+        ''')
+        cur.execute('SELECT Name FROM schema_migrations')
+        applied = {name for (name,) in cur.fetchall()}
+    conn.commit()
+    return [name for name in sorted(os.listdir(directory)) if name.endswith('.sql') and name not in applied]
+
+def migrate(conn, directory=MIGRATIONS_DIR):
+    # Applies migrations/*.sql in name order, each in its own transaction, and
+    # returns the names applied.
+    applied = []
+    for name in pending_migrations(conn, directory):
+        with open(os.path.join(directory, name)) as f:
+            sql = f.read()
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK,))
+                cur.execute('SELECT 1 FROM schema_migrations WHERE Name = %s', (name,))
+                if not cur.fetchone():
+                    cur.execute(sql)
+                    cur.execute('INSERT INTO schema_migrations (Name) VALUES (%s)', (name,))
+                    applied.append(name)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
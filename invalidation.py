@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+import psycopg2
+
+import db
+
+# Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+#
+# Writers call publish() inside their transaction; Postgres only delivers the
+# notification once it commits. Every web worker runs one listener thread that
+# collects events for BATCH_WINDOW seconds, drops duplicates, and hands each
+# subscriber the events for its entity in one call. After a reconnect, or when
+# a burst is too large to be worth handling event by event, subscribers are told
+# to flush everything instead.
+#
+# `id` is whatever caches key on: the property id for property and booking
+# events, the email for user, card and address events, the name for
+# neighborhood events. `city` is set when the change can affect searches.
+
+log = logging.getLogger(__name__)
+
+CHANNEL = 'cache_invalidation'
+BATCH_WINDOW = 0.05
+MAX_EVENTS_PER_BATCH = 500
+LISTEN_TIMEOUT = 5
+RECONNECT_DELAY = 2
+
+class Event(NamedTuple):
+    entity: str
+    id: Optional[str] = None
+    city: Optional[str] = None
+
+def payload(entity, id=None, city=None):
+    # For statements that call pg_notify(CHANNEL, ...) themselves to save a round trip.
+    return json.dumps([entity, None if id is None else str(id), city])
+
+def publish(cur, entity, id=None, city=None):
+    cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, payload(entity, id, city)))
+
+def publish_many(cur, entity, pairs):
+    # One round trip for many (id, city) events, e.g. after a set-based UPDATE.
+    payloads = [payload(entity, id, city) for id, city in pairs]
+    if payloads:
+        cur.execute('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload', (CHANNEL, payloads))
+
+_subscribers = defaultdict(list)
+_lock = threading.Lock()
+_listener_pid = None
+
+def subscribe(entity, on_events, on_flush):
+    # on_events(events) gets a list of distinct Events for `entity`; an Event
+    # without an id means "anything of this entity may have changed".
+    # on_flush() must drop everything the subscriber has cached.
+    _subscribers[entity].append((on_events, on_flush))
+
+def flush_all():
+    for subscribers in list(_subscribers.values()):
+        for on_events, on_flush in subscribers:
+            try:
+                on_flush()
+            except Exception:
+                log.exception('Flushing a cache failed')
+
+def dispatch(events):
+    by_entity = defaultdict(list)
+    for event in dict.fromkeys(events):
+        by_entity[event.entity].append(event)
+    for entity, entity_events in by_entity.items():
+        for on_events, on_flush in _subscribers.get(entity, ()):
+            try:
+                if len(entity_events) > MAX_EVENTS_PER_BATCH:
+                    on_flush()
+                else:
+                    on_events(entity_events)
+            except Exception:
+                # A subscriber that missed its events may now be stale.
+                log.exception('Cache invalidation for %s failed, flushing all caches', entity)
+                flush_all()
+
+def ensure_listening():
+    # One listener per process and database (the primary and each of
+    # db.SHARDS, whose writes notify on their own connection); forked workers
+    # start their own. Returns once LISTEN is in place (or failed) so callers
+    # can load without missing a change.
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        waits = []
+        for name, connect in [('primary', db.connect)] + [(shard.name, shard.connect) for shard in db.SHARDS]:
+            ready = threading.Event()
+            threading.Thread(target=_listen, args=(ready, connect), name=f'cache-invalidation-{name}',
+                             daemon=True).start()
+            waits.append(ready)
+    deadline = time.monotonic() + LISTEN_TIMEOUT
+    for ready in waits:
+        ready.wait(max(0, deadline - time.monotonic()))
+
+def _parse(payload):
+    try:
+        entity, id, city = json.loads(payload)
+    except (TypeError, ValueError):
+        return None
+    return Event(entity, id, city)
+
+def _drain(conn):
+    conn.poll()
+    events = [_parse(n.payload) for n in conn.notifies]
+    conn.notifies.clear()
+    return [event for event in events if event is not None]
+
+def _listen(ready, connect):
+    global _listener_pid
+    try:
+        _listen_forever(ready, connect)
+    finally:
+        # Let the next ensure_listening() start over rather than trust caches
+        # nothing is invalidating any more.
+        _listener_pid = None
+        ready.set()
+        flush_all()
+
+def _listen_forever(ready, connect):
+    while True:
+        conn = None
+        try:
+            conn = connect()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {CHANNEL}')
+            # Anything may have changed while we were not listening.
+            flush_all()
+            ready.set()
+            while True:
+                if select.select([conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                    continue
+                events = _drain(conn)
+                if not events:
+                    continue
+                # Let the rest of a burst arrive so it is handled in one pass.
+                deadline = time.monotonic() + BATCH_WINDOW
+                while (remaining := deadline - time.monotonic()) > 0:
+                    if select.select([conn], [], [], remaining) != ([], [], []):
+                        events.extend(_drain(conn))
+                dispatch(events)
+        except Exception as e:
+            if not isinstance(e, psycopg2.Error):
+                log.exception('Cache invalidation listener failed, reconnecting')
+            ready.set()
+            flush_all()
+            if conn is not None:
+                conn.close()
+            time.sleep(RECONNECT_DELAY)
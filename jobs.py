@@ -0,0 +1,177 @@
+import json
+import logging
+import random
+import time
+
+import psycopg2
+
+import db
+import partitions
+import repository
+
+# Postgres-backed queue for work that does not need to finish before the
+# response goes out.
+#
+# enqueue() inserts into Job in the caller's transaction, so a job exists
+# exactly when the write that produced it commits. Workers (worker.py) claim
+# one due job at a time with FOR UPDATE SKIP LOCKED, so any number of them can
+# share the table without two running the same job. The handler runs inside
+# a savepoint in the same transaction that deletes the job: either its writes
+# and the delete commit together, or neither does. A failing job is retried
+# with exponential backoff and moved to DeadJob after MAX_ATTEMPTS.
+#
+# Writes on a shard (db.SHARDS) enqueue into the shard's own Job table, in the
+# shard's transaction. Workers relay() those jobs to the primary, where all
+# handlers run: the primary commits the copy before the shard deletes it, so
+# a crash in between delivers a job twice rather than never, and the handlers
+# ignore a repeat.
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2
+MAX_BACKOFF = 600
+POLL_INTERVAL = 1
+RECONNECT_DELAY = 2
+PARTITION_INTERVAL = 24 * 3600
+RELAY_BATCH_SIZE = 100
+
+log = logging.getLogger(__name__)
+
+_handlers = {}
+
+def handler(kind):
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+def enqueue(cur, kind, delay=0, **payload):
+    # delay: seconds before the job is due.
+    cur.execute('INSERT INTO Job (Kind, Payload, Run_At) VALUES (%s, %s, now() + make_interval(secs => %s))',
+                (kind, json.dumps(payload, default=str), delay))
+
+def relay(conn, shard, batch_size=RELAY_BATCH_SIZE):
+    # Moves up to batch_size jobs from `shard` to the primary (`conn`).
+    # Returns how many were moved.
+    with db.get_db_connection(shard=shard) as shard_conn:
+        with shard_conn.cursor() as shard_cur:
+            shard_cur.execute('''
+                SELECT Job_ID, Kind, Payload, Run_At FROM Job
+                ORDER BY Job_ID
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (batch_size,))
+            queued = shard_cur.fetchall()
+            if not queued:
+                return 0
+            with conn.cursor() as cur:
+                cur.executemany('INSERT INTO Job (Kind, Payload, Run_At) VALUES (%s, %s, %s)',
+                                [(kind, json.dumps(payload), run_at) for _, kind, payload, run_at in queued])
+            conn.commit()
+            shard_cur.execute('DELETE FROM Job WHERE Job_ID = ANY(%s)', ([job_id for job_id, _, _, _ in queued],))
+    return len(queued)
+
+def backoff(attempts):
+    # Seconds until the next try; jitter keeps a batch of failures from retrying in lockstep.
+    delay = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(1, 1.5)
+
+def run_one(conn):
+    # Runs at most one due job and commits. Returns its Job_ID, or None if
+    # nothing was due.
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT Job_ID, Kind, Payload, Attempts FROM Job
+            WHERE Run_At <= now()
+            ORDER BY Run_At, Job_ID
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ''')
+        job = cur.fetchone()
+        if job is None:
+            conn.commit()
+            return None
+        job_id, kind, payload, attempts = job
+        cur.execute('SAVEPOINT job')
+        try:
+            if kind not in _handlers:
+                raise LookupError(f'no handler for job kind {kind!r}')
+            _handlers[kind](cur, **payload)
+        except Exception as e:
+            if conn.closed:
+                raise
+            cur.execute('ROLLBACK TO SAVEPOINT job')
+            _failed(cur, job_id, kind, attempts + 1, f'{type(e).__name__}: {e}')
+        else:
+            cur.execute('DELETE FROM Job WHERE Job_ID = %s', (job_id,))
+    conn.commit()
+    return job_id
+
+def _failed(cur, job_id, kind, attempts, error):
+    if attempts >= MAX_ATTEMPTS:
+        cur.execute('''
+            WITH dead AS (DELETE FROM Job WHERE Job_ID = %s RETURNING *)
+            INSERT INTO DeadJob (Job_ID, Kind, Payload, Attempts, Last_Error, Created_At)
+            SELECT Job_ID, Kind, Payload, %s, %s, Created_At FROM dead
+        ''', (job_id, attempts, error))
+        log.error('Job %s (%s) failed %s times, moved to DeadJob: %s', job_id, kind, attempts, error)
+        return
+    delay = backoff(attempts)
+    cur.execute('''
+        UPDATE Job SET Attempts = %s, Last_Error = %s, Run_At = now() + make_interval(secs => %s)
+        WHERE Job_ID = %s
+    ''', (attempts, error, delay, job_id))
+    log.warning('Job %s (%s) failed, retrying in %.0fs: %s', job_id, kind, delay, error)
+
+def work(once=False, poll_interval=POLL_INTERVAL):
+    # Processes jobs until interrupted; with once=True, until none are due.
+    # Returns the number of jobs processed.
+    processed = 0
+    conn = None
+    while True:
+        try:
+            if conn is None:
+                conn = db.connect()
+            for shard in db.SHARDS:
+                while relay(conn, shard):
+                    pass
+            while run_one(conn) is not None:
+                processed += 1
+            if once:
+                conn.close()
+                return processed
+            time.sleep(poll_interval)
+        except psycopg2.Error as e:
+            if conn is not None:
+                conn.close()
+                conn = None
+            if once:
+                raise
+            log.warning('Job worker lost its connection, reconnecting: %s', e)
+            time.sleep(RECONNECT_DELAY)
+
+# --- Handlers ---
+
+# A cancellation can run before the credit it cancels (say, while the credit
+# is backing off after a failure); see reward_reverse for how that is settled.
+@handler('booking_reward')
+def booking_reward(cur, email, points, property_id, booking_id, nights, booking_ids=None):
+    repository.lock_rewards(cur, email)
+    repository.record_booking_reward(cur, email, points, property_id, booking_id, nights, booking_ids)
+
+@handler('booking_cancelled')
+def booking_cancelled(cur, email, property_id, booking_id, nights):
+    repository.lock_rewards(cur, email)
+    repository.reverse_booking_reward(cur, email, property_id, booking_id, nights)
+
+# Seeded by 005_booking_partitions.sql; runs daily by queueing its next run.
+@handler('booking_partitions')
+def booking_partitions(cur):
+    partitions.create_ahead(cur)
+    for shard in db.SHARDS:
+        with db.get_db_connection(shard=shard) as conn:
+            with conn.cursor() as shard_cur:
+                partitions.create_ahead(shard_cur)
+    # This run's own row is still there; more than one means a duplicate chain.
+    cur.execute("SELECT COUNT(*) FROM Job WHERE Kind = 'booking_partitions'")
+    if cur.fetchone()[0] <= 1:
+        enqueue(cur, 'booking_partitions', delay=PARTITION_INTERVAL)
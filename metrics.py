@@ -0,0 +1,54 @@
+import threading
+from collections import defaultdict
+
+# In-process counters, exposed in Prometheus text format by the /metrics route.
+# Each worker process keeps its own counts; the scraper sums them.
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_help = {}
+
+def describe(name, text):
+    _help[name] = text
+
+def increment(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += value
+
+def gauge(name, read, **labels):
+    # read() is called at scrape time for the current value.
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = read
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+def render():
+    lines = []
+    by_name = defaultdict(list)
+    kinds = {}
+    for (name, labels), value in sorted(snapshot().items()):
+        by_name[name].append((labels, value))
+        kinds[name] = 'counter'
+    with _lock:
+        gauges = sorted(_gauges.items())
+    for (name, labels), read in gauges:
+        by_name[name].append((labels, read()))
+        kinds[name] = 'gauge'
+    for name, samples in by_name.items():
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} {kinds[name]}')
+        for labels, value in samples:
+            label_text = ','.join(f'{label}="{text}"' for label, text in labels)
+            lines.append(f'{name}{{{label_text}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+describe('property_edits_total', 'Property edit form submissions, by whether anything changed.')
+describe('property_edit_rows_total', 'Rows written by property edits, by table.')
+describe('http_requests_total', 'Requests served, by endpoint.')
+describe('db_round_trips_total', 'Statements sent to Postgres while serving requests, by endpoint.')
+describe('db_reads_total', 'Replica-eligible reads, by where they ran (a replica, or the primary as fallback).')
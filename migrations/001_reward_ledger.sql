@@ -0,0 +1,73 @@
+-- Append-only reward ledger.
+--
+-- Bookings append a RewardLedger entry instead of updating a per-renter
+-- counter. A renter's balance is their RewardBalance snapshot plus the ledger
+-- entries after its Last_Entry_ID; `python connect_db.py compact_rewards`
+-- folds new entries into the snapshots. RewardProgram rows still mark who is
+-- enrolled, but RewardProgram.Points and Renter.Reward_Points are no longer
+-- written.
+
+CREATE TABLE RewardLedger (
+    Entry_ID BIGSERIAL PRIMARY KEY,
+    Email VARCHAR(255) NOT NULL,
+    Points NUMERIC(12, 2) NOT NULL,
+    Reason VARCHAR(32) NOT NULL,
+    Property_ID INTEGER,
+    Booking_ID INTEGER,
+    Nights INTEGER,
+    Created_At TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX RewardLedger_Email_Entry_ID ON RewardLedger (Email, Entry_ID);
+
+CREATE TABLE RewardBalance (
+    Email VARCHAR(255) PRIMARY KEY,
+    Points NUMERIC(12, 2) NOT NULL,
+    Last_Entry_ID BIGINT NOT NULL,
+    Compacted_At TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Balances as they stand today, from both old counters.
+CREATE TEMP TABLE legacy_points AS
+SELECT Email, Points::numeric AS Points FROM RewardProgram;
+
+DO $$
+BEGIN
+    -- Only databases created through the CLI have Renter.Reward_Points.
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'renter' AND column_name = 'reward_points') THEN
+        -- The CLI credited every renter, so enroll the ones it credited.
+        INSERT INTO RewardProgram (Email, Points)
+        SELECT r.Email, 0 FROM Renter r
+        WHERE r.Reward_Points > 0
+          AND NOT EXISTS (SELECT 1 FROM RewardProgram p WHERE p.Email = r.Email);
+        INSERT INTO legacy_points
+        SELECT Email, Reward_Points FROM Renter WHERE Reward_Points > 0;
+    END IF;
+END
+$$;
+
+-- History: one entry per past stay, grouped the way rewards_history used to.
+INSERT INTO RewardLedger (Email, Points, Reason, Property_ID, Booking_ID, Nights, Created_At)
+SELECT g.Renter_Email, g.Nights * p.Price, 'booking', g.Property_ID, g.Booking_ID, g.Nights, g.Booking_Date
+FROM (
+    SELECT MIN(b.Booking_ID) AS Booking_ID, MIN(b.Booking_Date) AS Booking_Date, b.Property_ID, b.Renter_Email,
+           SUM(COALESCE(b.End_Date::date - b.Start_Date::date, 1)) AS Nights
+    FROM Booking b
+    WHERE b.Renter_Email IN (SELECT Email FROM RewardProgram)
+    GROUP BY b.Property_ID, b.Renter_Email, b.Booking_Date::date
+) g
+JOIN Property p ON p.Property_ID = g.Property_ID
+ORDER BY g.Booking_Date;
+
+-- Make each renter's ledger total match their old balance exactly.
+INSERT INTO RewardLedger (Email, Points, Reason)
+SELECT l.Email, l.Points - COALESCE(e.Points, 0), 'migration'
+FROM (SELECT Email, SUM(Points) AS Points FROM legacy_points GROUP BY Email) l
+LEFT JOIN (SELECT Email, SUM(Points) AS Points FROM RewardLedger GROUP BY Email) e ON e.Email = l.Email
+WHERE l.Points <> COALESCE(e.Points, 0);
+
+INSERT INTO RewardBalance (Email, Points, Last_Entry_ID)
+SELECT Email, SUM(Points), MAX(Entry_ID) FROM RewardLedger GROUP BY Email;
+
+DROP TABLE legacy_points;
@@ -0,0 +1,61 @@
+-- Per-property, per-night booking rollup for the agent analytics dashboard.
+--
+-- Triggers on Booking keep it current, so the web app, the CLI and any
+-- cascading deletes all update it in the same transaction as the booking.
+-- A Booking row covers the nights from Start_Date up to the night before
+-- End_Date (CLI bookings), or just Booking_Date (web bookings, one row per
+-- night). Revenue is the property's price when the night was booked.
+
+CREATE TABLE PropertyDailyStats (
+    Property_ID INTEGER NOT NULL,
+    Stay_Date DATE NOT NULL,
+    Nights_Booked INTEGER NOT NULL,
+    Revenue NUMERIC(12, 2) NOT NULL,
+    PRIMARY KEY (Property_ID, Stay_Date)
+);
+
+CREATE FUNCTION booking_nights(start_date date, end_date date, booking_date date)
+RETURNS SETOF date LANGUAGE sql IMMUTABLE AS $$
+    SELECT d::date FROM generate_series(
+        COALESCE(start_date, booking_date),
+        GREATEST(COALESCE(end_date - 1, booking_date), COALESCE(start_date, booking_date)),
+        interval '1 day') d
+$$;
+
+CREATE FUNCTION property_daily_stats_maintain() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        -- Overlapping bookings are refused, so a night is normally booked
+        -- once and this removes exactly the revenue that was added.
+        UPDATE PropertyDailyStats s
+        SET Nights_Booked = s.Nights_Booked - 1,
+            Revenue = s.Revenue - s.Revenue / s.Nights_Booked
+        WHERE s.Property_ID = OLD.Property_ID
+          AND s.Stay_Date IN (SELECT booking_nights(OLD.Start_Date::date, OLD.End_Date::date, OLD.Booking_Date::date));
+        DELETE FROM PropertyDailyStats
+        WHERE Property_ID = OLD.Property_ID AND Nights_Booked <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO PropertyDailyStats (Property_ID, Stay_Date, Nights_Booked, Revenue)
+        SELECT NEW.Property_ID, night, 1, p.Price
+        FROM booking_nights(NEW.Start_Date::date, NEW.End_Date::date, NEW.Booking_Date::date) night
+        JOIN Property p ON p.Property_ID = NEW.Property_ID
+        ON CONFLICT (Property_ID, Stay_Date) DO UPDATE
+        SET Nights_Booked = PropertyDailyStats.Nights_Booked + 1,
+            Revenue = PropertyDailyStats.Revenue + EXCLUDED.Revenue;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER booking_daily_stats
+AFTER INSERT OR UPDATE OF Property_ID, Booking_Date, Start_Date, End_Date OR DELETE ON Booking
+FOR EACH ROW EXECUTE FUNCTION property_daily_stats_maintain();
+
+-- Existing bookings, at today's prices.
+INSERT INTO PropertyDailyStats (Property_ID, Stay_Date, Nights_Booked, Revenue)
+SELECT b.Property_ID, night, COUNT(*), SUM(p.Price)
+FROM Booking b
+JOIN Property p ON p.Property_ID = b.Property_ID
+CROSS JOIN LATERAL booking_nights(b.Start_Date::date, b.End_Date::date, b.Booking_Date::date) night
+GROUP BY b.Property_ID, night;
@@ -0,0 +1,115 @@
+-- Per-neighborhood aggregates for /neighborhoods and search results.
+--
+-- NeighborhoodStats keeps listing count, price sum and available count;
+-- NeighborhoodDailyBookings counts Booking rows per neighborhood per
+-- Booking_Date so "bookings in the last 30 days" sums at most 30 rows.
+-- Triggers on Property and Booking keep both current. Bookings are counted
+-- against the property's current neighborhood and move with it.
+-- `python connect_db.py check_neighborhood_stats` rebuilds and diffs them.
+
+CREATE TABLE NeighborhoodStats (
+    Neighborhood VARCHAR(255) PRIMARY KEY,
+    Listings INTEGER NOT NULL,
+    Available INTEGER NOT NULL,
+    Price_Sum NUMERIC(14, 2) NOT NULL
+);
+
+CREATE TABLE NeighborhoodDailyBookings (
+    Neighborhood VARCHAR(255) NOT NULL,
+    Booking_Day DATE NOT NULL,
+    Bookings INTEGER NOT NULL,
+    PRIMARY KEY (Neighborhood, Booking_Day)
+);
+
+CREATE VIEW NeighborhoodSummary AS
+SELECT s.Neighborhood, s.Listings, s.Available,
+       ROUND(s.Price_Sum / NULLIF(s.Listings, 0), 2) AS Average_Price,
+       COALESCE((SELECT SUM(d.Bookings) FROM NeighborhoodDailyBookings d
+                 WHERE d.Neighborhood = s.Neighborhood
+                   AND d.Booking_Day > current_date - 30), 0)::integer AS Bookings_30d
+FROM NeighborhoodStats s;
+
+CREATE FUNCTION neighborhood_stats_property() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.Neighborhood IS NOT NULL THEN
+        UPDATE NeighborhoodStats
+        SET Listings = Listings - 1,
+            Available = Available - CASE WHEN OLD.Availability THEN 1 ELSE 0 END,
+            Price_Sum = Price_Sum - COALESCE(OLD.Price, 0)
+        WHERE Neighborhood = OLD.Neighborhood;
+        DELETE FROM NeighborhoodStats WHERE Neighborhood = OLD.Neighborhood AND Listings <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.Neighborhood IS NOT NULL THEN
+        INSERT INTO NeighborhoodStats (Neighborhood, Listings, Available, Price_Sum)
+        VALUES (NEW.Neighborhood, 1, CASE WHEN NEW.Availability THEN 1 ELSE 0 END, COALESCE(NEW.Price, 0))
+        ON CONFLICT (Neighborhood) DO UPDATE
+        SET Listings = NeighborhoodStats.Listings + 1,
+            Available = NeighborhoodStats.Available + EXCLUDED.Available,
+            Price_Sum = NeighborhoodStats.Price_Sum + EXCLUDED.Price_Sum;
+    END IF;
+    -- Take the property's bookings out of its old neighborhood. This runs
+    -- BEFORE DELETE, while the bookings are still there; bookings removed by
+    -- a cascade afterwards no longer find the property and are skipped.
+    IF (TG_OP = 'DELETE' OR OLD.Neighborhood IS DISTINCT FROM NEW.Neighborhood) AND OLD.Neighborhood IS NOT NULL THEN
+        UPDATE NeighborhoodDailyBookings d
+        SET Bookings = d.Bookings - b.Bookings
+        FROM (SELECT Booking_Date::date AS Booking_Day, COUNT(*) AS Bookings
+              FROM Booking WHERE Property_ID = OLD.Property_ID GROUP BY 1) b
+        WHERE d.Neighborhood = OLD.Neighborhood AND d.Booking_Day = b.Booking_Day;
+        DELETE FROM NeighborhoodDailyBookings WHERE Neighborhood = OLD.Neighborhood AND Bookings <= 0;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.Neighborhood IS DISTINCT FROM NEW.Neighborhood AND NEW.Neighborhood IS NOT NULL THEN
+        INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings)
+        SELECT NEW.Neighborhood, Booking_Date::date, COUNT(*)
+        FROM Booking WHERE Property_ID = NEW.Property_ID GROUP BY 2
+        ON CONFLICT (Neighborhood, Booking_Day) DO UPDATE
+        SET Bookings = NeighborhoodDailyBookings.Bookings + EXCLUDED.Bookings;
+    END IF;
+    RETURN OLD;
+END
+$$;
+
+CREATE TRIGGER property_neighborhood_stats
+AFTER INSERT OR UPDATE OF Neighborhood, Price, Availability ON Property
+FOR EACH ROW EXECUTE FUNCTION neighborhood_stats_property();
+
+CREATE TRIGGER property_neighborhood_stats_delete
+BEFORE DELETE ON Property
+FOR EACH ROW EXECUTE FUNCTION neighborhood_stats_property();
+
+CREATE FUNCTION neighborhood_stats_booking() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE NeighborhoodDailyBookings d
+        SET Bookings = d.Bookings - 1
+        FROM Property p
+        WHERE p.Property_ID = OLD.Property_ID
+          AND d.Neighborhood = p.Neighborhood AND d.Booking_Day = OLD.Booking_Date::date;
+        DELETE FROM NeighborhoodDailyBookings WHERE Booking_Day = OLD.Booking_Date::date AND Bookings <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings)
+        SELECT p.Neighborhood, NEW.Booking_Date::date, 1
+        FROM Property p
+        WHERE p.Property_ID = NEW.Property_ID AND p.Neighborhood IS NOT NULL
+        ON CONFLICT (Neighborhood, Booking_Day) DO UPDATE
+        SET Bookings = NeighborhoodDailyBookings.Bookings + 1;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER booking_neighborhood_stats
+AFTER INSERT OR UPDATE OF Property_ID, Booking_Date OR DELETE ON Booking
+FOR EACH ROW EXECUTE FUNCTION neighborhood_stats_booking();
+
+INSERT INTO NeighborhoodStats (Neighborhood, Listings, Available, Price_Sum)
+SELECT Neighborhood, COUNT(*), COUNT(*) FILTER (WHERE Availability), COALESCE(SUM(Price), 0)
+FROM Property WHERE Neighborhood IS NOT NULL
+GROUP BY Neighborhood;
+
+INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings)
+SELECT p.Neighborhood, b.Booking_Date::date, COUNT(*)
+FROM Booking b JOIN Property p ON p.Property_ID = b.Property_ID
+WHERE p.Neighborhood IS NOT NULL
+GROUP BY 1, 2;
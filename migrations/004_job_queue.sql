@@ -0,0 +1,27 @@
+-- Background job queue (jobs.py, worker.py).
+--
+-- Workers claim due jobs with FOR UPDATE SKIP LOCKED and delete them when
+-- done. Failed jobs are retried later (Run_At moves forward) and end up in
+-- DeadJob after too many attempts.
+
+CREATE TABLE Job (
+    Job_ID BIGSERIAL PRIMARY KEY,
+    Kind VARCHAR(64) NOT NULL,
+    Payload JSONB NOT NULL DEFAULT '{}',
+    Attempts INTEGER NOT NULL DEFAULT 0,
+    Last_Error TEXT,
+    Run_At TIMESTAMP NOT NULL DEFAULT now(),
+    Created_At TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX Job_Run_At ON Job (Run_At, Job_ID);
+
+CREATE TABLE DeadJob (
+    Job_ID BIGINT PRIMARY KEY,
+    Kind VARCHAR(64) NOT NULL,
+    Payload JSONB NOT NULL,
+    Attempts INTEGER NOT NULL,
+    Last_Error TEXT,
+    Created_At TIMESTAMP NOT NULL,
+    Failed_At TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,108 @@
+-- Booking, range partitioned by month of stay.
+--
+-- Stay_Date is the first night (Start_Date for CLI bookings, Booking_Date
+-- for web bookings, one row per night) and is the partition key; writers
+-- set it and the CHECK keeps it honest. Queries that bound Stay_Date only
+-- touch the months they need, and each month's indexes stay small.
+-- Partitions are named Booking_YYYY_MM. create_booking_partitions() adds
+-- missing months and is run ahead of time by the booking_partitions job;
+-- a stay outside every month lands in Booking_Default until its month is
+-- created. `python connect_db.py archive_bookings` detaches old months into
+-- BookingArchive (or files) and drops them.
+
+ALTER TABLE Booking RENAME TO Booking_Unpartitioned;
+
+CREATE TABLE Booking (
+    LIKE Booking_Unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+    Stay_Date DATE NOT NULL,
+    CONSTRAINT booking_stay_date CHECK (Stay_Date = COALESCE(Start_Date::date, Booking_Date::date))
+) PARTITION BY RANGE (Stay_Date);
+
+CREATE TABLE Booking_Default PARTITION OF Booking DEFAULT;
+
+-- Cold storage for archived months: same columns, no constraints to check.
+CREATE TABLE BookingArchive (LIKE Booking);
+CREATE INDEX bookingarchive_renter ON BookingArchive (Renter_Email);
+
+CREATE FUNCTION create_booking_partition(month date) RETURNS boolean LANGUAGE plpgsql AS $$
+DECLARE
+    first_day date := date_trunc('month', month)::date;
+    next_day date := (date_trunc('month', month) + interval '1 month')::date;
+    partition_name text := 'booking_' || to_char(first_day, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN false;
+    END IF;
+    -- A month cannot be split off the default partition while it holds rows
+    -- for it, so those rows move over. The delete and re-insert pass through
+    -- the rollup triggers, which cancel out (revenue is re-added at the
+    -- property's current price).
+    CREATE TEMP TABLE booking_moving AS
+        SELECT * FROM Booking_Default WHERE Stay_Date >= first_day AND Stay_Date < next_day;
+    DELETE FROM Booking_Default WHERE Stay_Date >= first_day AND Stay_Date < next_day;
+    EXECUTE format('CREATE TABLE %I PARTITION OF Booking FOR VALUES FROM (%L) TO (%L)',
+                   partition_name, first_day, next_day);
+    INSERT INTO Booking SELECT * FROM booking_moving;
+    DROP TABLE booking_moving;
+    RETURN true;
+END
+$$;
+
+CREATE FUNCTION create_booking_partitions(first_month date, last_month date) RETURNS integer LANGUAGE plpgsql AS $$
+DECLARE
+    month date := date_trunc('month', first_month)::date;
+    created integer := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        IF create_booking_partition(month) THEN
+            created := created + 1;
+        END IF;
+        month := (month + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+SELECT create_booking_partitions(
+    LEAST(current_date, (SELECT MIN(COALESCE(Start_Date::date, Booking_Date::date)) FROM Booking_Unpartitioned)),
+    (current_date + interval '24 months')::date);
+
+-- Rollups already count these rows; the triggers are only created below.
+INSERT INTO Booking
+SELECT b.*, COALESCE(b.Start_Date::date, b.Booking_Date::date) FROM Booking_Unpartitioned b;
+
+DO $$
+DECLARE
+    sequence_name text := pg_get_serial_sequence('booking_unpartitioned', 'booking_id');
+    fk record;
+BEGIN
+    IF sequence_name IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY Booking.Booking_ID', sequence_name);
+    END IF;
+    FOR fk IN SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+              WHERE conrelid = 'booking_unpartitioned'::regclass AND contype = 'f' LOOP
+        EXECUTE format('ALTER TABLE Booking_Unpartitioned DROP CONSTRAINT %I', fk.conname);
+        EXECUTE format('ALTER TABLE Booking ADD CONSTRAINT %I %s', fk.conname, fk.definition);
+    END LOOP;
+END
+$$;
+
+DROP TABLE Booking_Unpartitioned;
+
+-- The primary key has to include the partition key, so it only makes
+-- (Booking_ID, Stay_Date) unique: Booking_ID is unique within a partition,
+-- and across partitions only because every insert takes it from the one
+-- sequence. Never insert an explicit Booking_ID.
+ALTER TABLE Booking ADD CONSTRAINT booking_partitioned_pkey PRIMARY KEY (Booking_ID, Stay_Date);
+CREATE INDEX booking_property_stay ON Booking (Property_ID, Stay_Date);
+CREATE INDEX booking_renter ON Booking (Renter_Email, Booking_ID);
+
+CREATE TRIGGER booking_daily_stats
+AFTER INSERT OR UPDATE OF Property_ID, Booking_Date, Start_Date, End_Date OR DELETE ON Booking
+FOR EACH ROW EXECUTE FUNCTION property_daily_stats_maintain();
+
+CREATE TRIGGER booking_neighborhood_stats
+AFTER INSERT OR UPDATE OF Property_ID, Booking_Date OR DELETE ON Booking
+FOR EACH ROW EXECUTE FUNCTION neighborhood_stats_booking();
+
+INSERT INTO Job (Kind, Payload) VALUES ('booking_partitions', '{}');
@@ -0,0 +1,47 @@
+-- Keyword search over listings ("pool", "ocean view", "pet friendly").
+--
+-- Property.Search_Vector holds the listing's words, weighted amenities (A),
+-- description (B), then type and neighborhood (C), and is GIN indexed.
+-- A BEFORE trigger on Property and an AFTER trigger on Vacation_Home (where
+-- amenities live) keep it current, so every writer is covered.
+
+ALTER TABLE Property ADD COLUMN Search_Vector tsvector;
+
+-- Parameters are named apart from the columns: in SQL functions a column
+-- name wins over a parameter of the same name.
+CREATE FUNCTION property_search_vector(listing_id integer, listing_description text, listing_type text,
+                                       listing_neighborhood text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('english', COALESCE((SELECT v.Amenities FROM Vacation_Home v
+                                                      WHERE v.Property_ID = listing_id), '')), 'A')
+        || setweight(to_tsvector('english', COALESCE(listing_description, '')), 'B')
+        || setweight(to_tsvector('english', COALESCE(listing_type, '') || ' ' || COALESCE(listing_neighborhood, '')), 'C')
+$$;
+
+CREATE FUNCTION property_search_vector_property() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.Search_Vector := property_search_vector(NEW.Property_ID, NEW.Description, NEW.Type, NEW.Neighborhood);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER property_search_vector
+BEFORE INSERT OR UPDATE OF Description, Type, Neighborhood ON Property
+FOR EACH ROW EXECUTE FUNCTION property_search_vector_property();
+
+CREATE FUNCTION property_search_vector_amenities() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE Property p
+    SET Search_Vector = property_search_vector(p.Property_ID, p.Description, p.Type, p.Neighborhood)
+    WHERE p.Property_ID IN (OLD.Property_ID, NEW.Property_ID);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER vacation_home_search_vector
+AFTER INSERT OR UPDATE OR DELETE ON Vacation_Home
+FOR EACH ROW EXECUTE FUNCTION property_search_vector_amenities();
+
+UPDATE Property SET Search_Vector = property_search_vector(Property_ID, Description, Type, Neighborhood);
+
+CREATE INDEX property_search_vector_idx ON Property USING GIN (Search_Vector);
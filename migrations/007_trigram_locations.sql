@@ -0,0 +1,39 @@
+-- Typo-tolerant city and neighborhood search ("San Fransisco", "Brooklin").
+--
+-- Search matches a city or neighborhood exactly when one exists and
+-- otherwise takes the most similar known name (pg_trgm, stock contrib).
+-- Candidates come from small per-name tables rather than Property itself,
+-- so a near miss compares against each distinct name once: PropertyCities
+-- (kept by a trigger on Property, like NeighborhoodStats) and
+-- NeighborhoodStats. Both get a GIN trigram index for the % operator.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE PropertyCities (
+    City VARCHAR(255) PRIMARY KEY,
+    Listings INTEGER NOT NULL
+);
+
+CREATE FUNCTION property_cities_maintain() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.City IS NOT NULL THEN
+        UPDATE PropertyCities SET Listings = Listings - 1 WHERE City = OLD.City;
+        DELETE FROM PropertyCities WHERE City = OLD.City AND Listings <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.City IS NOT NULL THEN
+        INSERT INTO PropertyCities (City, Listings) VALUES (NEW.City, 1)
+        ON CONFLICT (City) DO UPDATE SET Listings = PropertyCities.Listings + 1;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER property_cities
+AFTER INSERT OR UPDATE OF City OR DELETE ON Property
+FOR EACH ROW EXECUTE FUNCTION property_cities_maintain();
+
+INSERT INTO PropertyCities (City, Listings)
+SELECT City, COUNT(*) FROM Property WHERE City IS NOT NULL GROUP BY City;
+
+CREATE INDEX propertycities_city_trgm ON PropertyCities USING GIN (City gin_trgm_ops);
+CREATE INDEX neighborhoodstats_neighborhood_trgm ON NeighborhoodStats USING GIN (Neighborhood gin_trgm_ops);
@@ -0,0 +1,143 @@
+-- "Bookings in the last 30 days" counts stays by the day they were booked.
+--
+-- NeighborhoodDailyBookings used to count Booking rows by Booking_Date. Web
+-- bookings store one row per night with Booking_Date set to that night, so
+-- it counted nights, and upcoming nights counted as "recent". Booking.Booked_On
+-- now records the day a stay was booked. BookingStays has one row per stay
+-- (property, renter and day booked) with its number of Booking rows, and the
+-- daily count moves only when a stay appears or its last row goes.
+-- NeighborhoodSummary reads days up to today only.
+
+ALTER TABLE Booking ADD COLUMN Booked_On DATE;
+ALTER TABLE BookingArchive ADD COLUMN Booked_On DATE;
+
+-- CLI bookings carry the day they were made in Booking_Date. Older web
+-- bookings did not record it; each run of consecutive nights counts as one
+-- stay booked on its first night.
+UPDATE Booking SET Booked_On = Booking_Date::date WHERE Start_Date IS NOT NULL;
+UPDATE Booking b SET Booked_On = r.First_Night
+FROM (
+    SELECT Booking_ID, Stay_Date,
+           MIN(Stay_Date) OVER (PARTITION BY Property_ID, Renter_Email, Run) AS First_Night
+    FROM (SELECT Booking_ID, Property_ID, Renter_Email, Stay_Date,
+                 Stay_Date - (ROW_NUMBER() OVER (PARTITION BY Property_ID, Renter_Email ORDER BY Stay_Date))::integer AS Run
+          FROM Booking WHERE Start_Date IS NULL) n
+) r
+WHERE b.Booking_ID = r.Booking_ID AND b.Stay_Date = r.Stay_Date;
+UPDATE BookingArchive SET Booked_On = COALESCE(Start_Date::date, Booking_Date::date);
+
+ALTER TABLE Booking ALTER COLUMN Booked_On SET DEFAULT current_date;
+ALTER TABLE Booking ALTER COLUMN Booked_On SET NOT NULL;
+
+CREATE TABLE BookingStays (
+    Property_ID INTEGER NOT NULL,
+    Renter_Email VARCHAR(255) NOT NULL,
+    Booked_On DATE NOT NULL,
+    Booking_Rows INTEGER NOT NULL,
+    PRIMARY KEY (Property_ID, Renter_Email, Booked_On)
+);
+
+CREATE OR REPLACE FUNCTION neighborhood_stats_booking() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    remaining integer;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.Renter_Email IS NOT NULL THEN
+        UPDATE BookingStays SET Booking_Rows = Booking_Rows - 1
+        WHERE Property_ID = OLD.Property_ID AND Renter_Email = OLD.Renter_Email AND Booked_On = OLD.Booked_On
+        RETURNING Booking_Rows INTO remaining;
+        IF remaining <= 0 THEN
+            DELETE FROM BookingStays
+            WHERE Property_ID = OLD.Property_ID AND Renter_Email = OLD.Renter_Email AND Booked_On = OLD.Booked_On;
+            UPDATE NeighborhoodDailyBookings d
+            SET Bookings = d.Bookings - 1
+            FROM Property p
+            WHERE p.Property_ID = OLD.Property_ID
+              AND d.Neighborhood = p.Neighborhood AND d.Booking_Day = OLD.Booked_On;
+            DELETE FROM NeighborhoodDailyBookings WHERE Booking_Day = OLD.Booked_On AND Bookings <= 0;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.Renter_Email IS NOT NULL THEN
+        INSERT INTO BookingStays (Property_ID, Renter_Email, Booked_On, Booking_Rows)
+        VALUES (NEW.Property_ID, NEW.Renter_Email, NEW.Booked_On, 1)
+        ON CONFLICT (Property_ID, Renter_Email, Booked_On) DO UPDATE
+        SET Booking_Rows = BookingStays.Booking_Rows + 1
+        RETURNING Booking_Rows INTO remaining;
+        IF remaining = 1 THEN
+            INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings)
+            SELECT p.Neighborhood, NEW.Booked_On, 1
+            FROM Property p
+            WHERE p.Property_ID = NEW.Property_ID AND p.Neighborhood IS NOT NULL
+            ON CONFLICT (Neighborhood, Booking_Day) DO UPDATE
+            SET Bookings = NeighborhoodDailyBookings.Bookings + 1;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER booking_neighborhood_stats ON Booking;
+CREATE TRIGGER booking_neighborhood_stats
+AFTER INSERT OR UPDATE OF Property_ID, Renter_Email, Booked_On OR DELETE ON Booking
+FOR EACH ROW EXECUTE FUNCTION neighborhood_stats_booking();
+
+-- Same as in 003, except that a property's stays (not its Booking rows) move
+-- with it to a new neighborhood.
+CREATE OR REPLACE FUNCTION neighborhood_stats_property() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.Neighborhood IS NOT NULL THEN
+        UPDATE NeighborhoodStats
+        SET Listings = Listings - 1,
+            Available = Available - CASE WHEN OLD.Availability THEN 1 ELSE 0 END,
+            Price_Sum = Price_Sum - COALESCE(OLD.Price, 0)
+        WHERE Neighborhood = OLD.Neighborhood;
+        DELETE FROM NeighborhoodStats WHERE Neighborhood = OLD.Neighborhood AND Listings <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.Neighborhood IS NOT NULL THEN
+        INSERT INTO NeighborhoodStats (Neighborhood, Listings, Available, Price_Sum)
+        VALUES (NEW.Neighborhood, 1, CASE WHEN NEW.Availability THEN 1 ELSE 0 END, COALESCE(NEW.Price, 0))
+        ON CONFLICT (Neighborhood) DO UPDATE
+        SET Listings = NeighborhoodStats.Listings + 1,
+            Available = NeighborhoodStats.Available + EXCLUDED.Available,
+            Price_Sum = NeighborhoodStats.Price_Sum + EXCLUDED.Price_Sum;
+    END IF;
+    -- Runs BEFORE DELETE, while the property's stays are still there; bookings
+    -- removed by a cascade afterwards no longer find the property and are skipped.
+    IF (TG_OP = 'DELETE' OR OLD.Neighborhood IS DISTINCT FROM NEW.Neighborhood) AND OLD.Neighborhood IS NOT NULL THEN
+        UPDATE NeighborhoodDailyBookings d
+        SET Bookings = d.Bookings - s.Stays
+        FROM (SELECT Booked_On, COUNT(*) AS Stays
+              FROM BookingStays WHERE Property_ID = OLD.Property_ID GROUP BY 1) s
+        WHERE d.Neighborhood = OLD.Neighborhood AND d.Booking_Day = s.Booked_On;
+        DELETE FROM NeighborhoodDailyBookings WHERE Neighborhood = OLD.Neighborhood AND Bookings <= 0;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.Neighborhood IS DISTINCT FROM NEW.Neighborhood AND NEW.Neighborhood IS NOT NULL THEN
+        INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings)
+        SELECT NEW.Neighborhood, Booked_On, COUNT(*)
+        FROM BookingStays WHERE Property_ID = NEW.Property_ID GROUP BY 2
+        ON CONFLICT (Neighborhood, Booking_Day) DO UPDATE
+        SET Bookings = NeighborhoodDailyBookings.Bookings + EXCLUDED.Bookings;
+    END IF;
+    RETURN OLD;
+END
+$$;
+
+INSERT INTO BookingStays (Property_ID, Renter_Email, Booked_On, Booking_Rows)
+SELECT Property_ID, Renter_Email, Booked_On, COUNT(*)
+FROM Booking WHERE Renter_Email IS NOT NULL
+GROUP BY 1, 2, 3;
+
+DELETE FROM NeighborhoodDailyBookings;
+INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings)
+SELECT p.Neighborhood, s.Booked_On, COUNT(*)
+FROM BookingStays s JOIN Property p ON p.Property_ID = s.Property_ID
+WHERE p.Neighborhood IS NOT NULL
+GROUP BY 1, 2;
+
+CREATE OR REPLACE VIEW NeighborhoodSummary AS
+SELECT s.Neighborhood, s.Listings, s.Available,
+       ROUND(s.Price_Sum / NULLIF(s.Listings, 0), 2) AS Average_Price,
+       COALESCE((SELECT SUM(d.Bookings) FROM NeighborhoodDailyBookings d
+                 WHERE d.Neighborhood = s.Neighborhood
+                   AND d.Booking_Day > current_date - 30
+                   AND d.Booking_Day <= current_date), 0)::integer AS Bookings_30d
+FROM NeighborhoodStats s;
@@ -0,0 +1,11 @@
+-- Caps a booking's Start_Date/End_Date range at 365 nights
+-- (repository.MAX_STAY_NIGHTS).
+--
+-- Stay_Date is a stay's first night, so a stay overlapping a given night has
+-- its Stay_Date within MAX_STAY_NIGHTS before it. With the cap, overlap checks
+-- and search bound Stay_Date on both sides and only scan the partitions for
+-- that window. Web bookings are one row per night and always satisfy it.
+-- Fails if an existing booking is longer; shorten or split it first.
+
+ALTER TABLE Booking ADD CONSTRAINT booking_max_stay
+    CHECK (End_Date IS NULL OR Start_Date IS NULL OR End_Date::date - Start_Date::date <= 365);
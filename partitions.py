@@ -0,0 +1,76 @@
+import datetime
+import os
+import re
+
+from psycopg2 import sql
+
+# Maintenance for the monthly Booking partitions (005_booking_partitions.sql).
+#
+# create_ahead() makes sure every month up to MONTHS_AHEAD from now has its
+# partition; the booking_partitions job runs it daily. archive() detaches
+# months whose stays all ended before a cutoff and moves them out of the hot
+# table, one month per transaction, so bookings() and the overlap checks only
+# ever touch recent months. A CLI stay lives in the month it starts, so a
+# month still holding a stay that runs past the cutoff is kept, and so is
+# every later month. Rollups (analytics, neighborhood stats) keep
+# counting archived stays.
+
+MONTHS_AHEAD = 24
+RETENTION_MONTHS = 24
+
+PARTITION_NAME = re.compile(r'booking_(\d{4})_(\d{2})')
+
+def add_months(day, months):
+    month = day.year * 12 + day.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+def create_ahead(cur, months_ahead=MONTHS_AHEAD):
+    # Returns the number of partitions created.
+    cur.execute('SELECT create_booking_partitions(current_date, (current_date + make_interval(months => %s))::date)',
+                (months_ahead,))
+    return cur.fetchone()[0]
+
+def list_partitions(cur):
+    # (name, first day) of each monthly partition, oldest first.
+    cur.execute('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'booking'::regclass
+    ''')
+    months = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.fullmatch(name)
+        if match:
+            months.append((name, datetime.date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(months, key=lambda month: month[1])
+
+def archive(conn, before, directory=None):
+    # Archives every month that ends on or before `before`: into BookingArchive,
+    # or as <directory>/booking_YYYY_MM.csv. Returns ([(name, rows)], the
+    # month archiving stopped at because a stay in it ends on or after
+    # `before`, or None).
+    with conn.cursor() as cur:
+        months = [(name, first) for name, first in list_partitions(cur) if add_months(first, 1) <= before]
+    conn.commit()
+    archived = []
+    for name, first in months:
+        partition = sql.Identifier(name)
+        with conn.cursor() as cur:
+            # Locks the month against new bookings until it is detached.
+            cur.execute(sql.SQL('LOCK TABLE {} IN SHARE MODE').format(partition))
+            cur.execute(sql.SQL('''
+                SELECT EXISTS (SELECT 1 FROM {} WHERE COALESCE(End_Date::date, Booking_Date::date) >= %s)
+            ''').format(partition), (before,))
+            if cur.fetchone()[0]:
+                conn.rollback()
+                return archived, name
+            cur.execute(sql.SQL('ALTER TABLE Booking DETACH PARTITION {}').format(partition))
+            if directory:
+                with open(os.path.join(directory, f'{name}.csv'), 'w', newline='') as f:
+                    cur.copy_expert(sql.SQL('COPY {} TO STDOUT WITH (FORMAT csv, HEADER)').format(partition).as_string(conn), f)
+            else:
+                cur.execute(sql.SQL('INSERT INTO BookingArchive SELECT * FROM {}').format(partition))
+            rows = cur.rowcount
+            cur.execute(sql.SQL('DROP TABLE {}').format(partition))
+        conn.commit()
+        archived.append((name, rows))
+    return archived, None
@@ -0,0 +1,151 @@
+import fcntl
+import functools
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import Response, request, session
+
+import metrics
+
+# Per-client token buckets for the Flask routes that are cheap to call and
+# expensive to serve (/login and /register look the user up, /search scans
+# listings, booking writes).
+#
+# A policy refills RATE tokens a second up to BURST; each request takes one.
+# Clients are the signed-in user, or the IP address before login, so one
+# scraper cannot spread its load over many sessions and a whole office behind
+# one NAT is not throttled together once signed in. Over the limit is a 429
+# with Retry-After. Settings come from RATE_LIMIT_<POLICY>_RATE/_BURST; a
+# rate of 0 turns the policy off.
+#
+# Buckets live in this process by default, so each worker enforces the limit
+# on its own. Point RATE_LIMIT_SHARED_FILE at a file (on /dev/shm, say) to
+# share one table between all the workers on a host instead.
+# If the app runs behind a proxy, wrap it in werkzeug's ProxyFix so
+# remote_addr is the client's address.
+
+DEFAULTS = {
+    # policy: (tokens per second, burst)
+    'auth': (0.2, 10),
+    'search': (1, 20),
+    'booking': (0.5, 10),
+    'bulk': (0.1, 5),
+}
+
+MAX_KEYS = 100000
+SHARED_SLOTS = 65536
+
+class LocalBuckets:
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        # 0 if a token was taken, otherwise seconds until the next one.
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # The third field is when the bucket will be full again.
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+        return 0 if allowed else (1 - tokens) / rate
+
+    def _evict(self, now):
+        # A bucket that has refilled is the same as no bucket at all.
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+
+class SharedBuckets:
+    # A fixed table of SHARED_SLOTS buckets in a memory-mapped file. Keys are
+    # hashed to a slot; a different key landing on an occupied slot starts
+    # from a full bucket, which errs on the side of letting requests through.
+    # Each slot is locked on its own with fcntl, so workers only contend when
+    # they hit the same slot. fcntl locks do not exclude threads of the same
+    # process, hence the thread lock as well.
+    SLOT = struct.Struct('<Qdd')
+
+    def __init__(self, path, slots=SHARED_SLOTS):
+        self.slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        offset = (digest % self.slots) * self.SLOT.size
+        now = time.monotonic()
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT.size, offset)
+            try:
+                owner, tokens, stamp = self.SLOT.unpack_from(self._map, offset)
+                if owner != digest:
+                    tokens, stamp = burst, now
+                tokens = min(burst, tokens + (now - stamp) * rate)
+                allowed = tokens >= 1
+                self.SLOT.pack_into(self._map, offset, digest, tokens - 1 if allowed else tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT.size, offset)
+        return 0 if allowed else (1 - tokens) / rate
+
+def _store():
+    path = os.getenv('RATE_LIMIT_SHARED_FILE')
+    return SharedBuckets(path) if path else LocalBuckets()
+
+def _policies():
+    policies = {}
+    for name, (rate, burst) in DEFAULTS.items():
+        policies[name] = (float(os.getenv(f'RATE_LIMIT_{name.upper()}_RATE', rate)),
+                          float(os.getenv(f'RATE_LIMIT_{name.upper()}_BURST', burst)))
+    return policies
+
+store = _store()
+POLICIES = _policies()
+
+def client_keys():
+    # Every request is charged to its IP, and a signed-in one to its user as
+    # well, so rotating accounts from one address does not get around a limit.
+    user = session.get('user')
+    keys = [f'ip:{request.remote_addr}']
+    if user:
+        keys.append(f'user:{user}')
+    return keys
+
+def limit(policy, methods=None):
+    # Goes under @app.route, above @admission.admit, so a throttled client
+    # never takes an admission slot. methods limits which requests are
+    # charged, e.g. only the POST that submits a form.
+    rate, burst = POLICIES[policy]
+    def decorate(view):
+        if rate <= 0:
+            return view
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if methods and request.method not in methods:
+                return view(*args, **kwargs)
+            wait = 0
+            for key in client_keys():
+                wait = store.take(f'{policy}:{key}', rate, burst)
+                if wait:
+                    break
+            if wait:
+                metrics.increment('rate_limited_total', policy=policy)
+                return Response('Too many requests, slow down.\n', status=429, mimetype='text/plain',
+                                headers={'Retry-After': str(math.ceil(wait))})
+            return view(*args, **kwargs)
+        return wrapped
+    return decorate
+
+metrics.describe('rate_limited_total', 'Requests refused with 429 by a rate limit policy, by policy.')
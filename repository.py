@@ -0,0 +1,729 @@
+import datetime
+import decimal
+import os
+import re
+from typing import NamedTuple, Optional
+
+import invalidation
+import rows
+
+# Data access shared by app.py and connect_db.py. Functions take a cursor and
+# never commit; the caller owns the transaction. Writes publish their
+# invalidation event in that same transaction.
+
+class Address(NamedTuple):
+    address_id: int
+    street: str
+    city: str
+    state: str
+    zip: str
+    primary_address: bool
+
+class CreditCard(NamedTuple):
+    card_number: str
+    cvv: str
+    expiry_date: datetime.date
+    billing_address: Optional[int]
+    street: Optional[str]
+    city: Optional[str]
+    state: Optional[str]
+    zip: Optional[str]
+
+class Neighborhood(NamedTuple):
+    name: str
+    crime_rate: Optional[decimal.Decimal]
+    nearby_schools: Optional[str]
+
+class NeighborhoodSummary(NamedTuple):
+    neighborhood: str
+    listings: int
+    available: int
+    average_price: Optional[decimal.Decimal]
+    bookings_30d: int
+
+class StatsDrift(NamedTuple):
+    neighborhood: str
+    day: Optional[datetime.date]
+    field: str
+    stored: Optional[decimal.Decimal]
+    expected: Optional[decimal.Decimal]
+
+class RewardEntry(NamedTuple):
+    booking_id: Optional[int]
+    created_at: datetime.datetime
+    property_id: Optional[int]
+    street: Optional[str]
+    city: Optional[str]
+    state: Optional[str]
+    zip: Optional[str]
+    price: Optional[decimal.Decimal]
+    points: decimal.Decimal
+    nights: Optional[int]
+    reason: str
+
+class PropertyDetail(NamedTuple):
+    property_id: int
+    street: str
+    city: str
+    state: str
+    zip: str
+    price: decimal.Decimal
+    type: str
+    description: Optional[str]
+    neighborhood: Optional[str]
+
+class PropertyStats(NamedTuple):
+    property_id: int
+    street: str
+    city: str
+    state: str
+    zip: str
+    type: str
+    nights: int
+    revenue: decimal.Decimal
+    stays: int
+
+class PropertyResult(NamedTuple):
+    property_id: int
+    street: str
+    city: str
+    state: str
+    zip: str
+    price: decimal.Decimal
+    type: str
+    description: Optional[str]
+    bedrooms: Optional[int]
+    square_footage: decimal.Decimal
+    neighborhood: Optional[str]
+    crime_rate: Optional[decimal.Decimal]
+    nearby_schools: Optional[str]
+    floor: Optional[int]
+    purpose_of_land: Optional[str]
+    business_type: Optional[str]
+    amenities: Optional[str]
+    neighborhood_listings: Optional[int]
+    neighborhood_average_price: Optional[decimal.Decimal]
+    neighborhood_bookings_30d: Optional[int]
+    rank: Optional[float]
+
+    @property
+    def subtype_info(self):
+        if self.type == 'House':
+            return self.bedrooms
+        if self.type == 'Apartment':
+            return f"{self.bedrooms}, Floor {self.floor}"
+        if self.type in ('Vacation Home', 'Vacation_Home'):
+            return f"{self.bedrooms}, {self.amenities}"
+        return None
+
+class SearchResults(NamedTuple):
+    results: list
+    # The names searched: as given, corrected, or None if nothing was close.
+    city: Optional[str]
+    neighborhood: Optional[str]
+    # Set when a city or neighborhood with no exact match was searched as
+    # this closest known name instead.
+    suggested_city: Optional[str]
+    suggested_neighborhood: Optional[str]
+
+BEDROOMS = 'COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms)'
+
+# Longest Start_Date/End_Date range (009_booking_max_stay.sql). A stay that
+# covers a night starts at most this many nights before it, which bounds
+# Stay_Date from below for partition pruning.
+MAX_STAY_NIGHTS = 365
+
+# Columns of rows.Property.
+AGENT_PROPERTY = f'''
+        SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Price, p.Availability, p.Square_Footage,
+               p.Description, p.Type, p.Neighborhood, {BEDROOMS} AS Bedrooms,
+               a.Floor, l.Purpose_of_land, c.Business_Type
+        FROM Property p
+        LEFT JOIN House h ON p.Property_ID = h.Property_ID
+        LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
+        LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
+        LEFT JOIN Land l ON p.Property_ID = l.Property_ID
+        LEFT JOIN Commercial_Building c ON p.Property_ID = c.Property_ID'''
+
+STATEMENTS = {
+    'user_role': '''
+        SELECT CASE WHEN EXISTS (SELECT 1 FROM Renter WHERE Email = $1) THEN 'renter'
+                    WHEN EXISTS (SELECT 1 FROM Agent WHERE Email = $1) THEN 'agent' END
+    ''',
+    'neighborhoods': 'SELECT Name, Crime_Rate, Nearby_Schools FROM Neighborhood ORDER BY Name',
+    'neighborhood_summary': '''
+        SELECT Neighborhood, Listings, Available, Average_Price, Bookings_30d
+        FROM NeighborhoodSummary ORDER BY Neighborhood
+    ''',
+    'addresses': 'SELECT AddressID, Street, City, State, Zip, Primary_Address FROM Address WHERE Email = $1 ORDER BY AddressID',
+    'address': 'SELECT AddressID, Street, City, State, Zip, Primary_Address FROM Address WHERE Email = $1 AND AddressID = $2',
+    'address_clear_primary': 'UPDATE Address SET Primary_Address = FALSE WHERE Email = $1 AND Primary_Address',
+    'address_insert': '''
+        INSERT INTO Address (Street, City, State, Zip, Email, Primary_Address)
+        VALUES ($2, $3, $4, $5, $1, $6)
+        RETURNING AddressID
+    ''',
+    'address_update': '''
+        UPDATE Address SET Street = $3, City = $4, State = $5, Zip = $6, Primary_Address = $7
+        WHERE Email = $1 AND AddressID = $2
+    ''',
+    'address_delete': 'DELETE FROM Address WHERE Email = $1 AND AddressID = $2',
+    'address_is_billing': 'SELECT EXISTS (SELECT 1 FROM CreditCard WHERE Renter_Email = $1 AND Billing_Address = $2)',
+    'cards': '''
+        SELECT c.Card_Number, c.CVV, c.Expiry_Date, c.Billing_Address, a.Street, a.City, a.State, a.Zip
+        FROM CreditCard c
+        LEFT JOIN Address a ON c.Billing_Address = a.AddressID AND c.Renter_Email = a.Email
+        WHERE c.Renter_Email = $1
+        ORDER BY c.Card_Number
+    ''',
+    'card': '''
+        SELECT c.Card_Number, c.CVV, c.Expiry_Date, c.Billing_Address, a.Street, a.City, a.State, a.Zip
+        FROM CreditCard c
+        LEFT JOIN Address a ON c.Billing_Address = a.AddressID AND c.Renter_Email = a.Email
+        WHERE c.Renter_Email = $1 AND c.Card_Number = $2
+    ''',
+    # Ownership check, insert and change event in one round trip.
+    'card_insert': '''
+        WITH owned AS (
+            SELECT 1 FROM Address WHERE Email = $1 AND AddressID = $5
+        ), inserted AS (
+            INSERT INTO CreditCard (Card_Number, CVV, Expiry_Date, Renter_Email, Billing_Address)
+            SELECT $2, $3, $4, $1, $5 WHERE EXISTS (SELECT 1 FROM owned)
+            ON CONFLICT (Renter_Email, Card_Number) DO NOTHING
+            RETURNING Card_Number
+        )
+        SELECT EXISTS (SELECT 1 FROM owned), EXISTS (SELECT 1 FROM inserted),
+               (SELECT pg_notify($6, $7) FROM inserted)
+    ''',
+    'card_update': '''
+        UPDATE CreditCard SET CVV = $3, Expiry_Date = $4, Billing_Address = $5
+        WHERE Renter_Email = $1 AND Card_Number = $2
+    ''',
+    'card_delete': 'DELETE FROM CreditCard WHERE Renter_Email = $1 AND Card_Number = $2',
+    'card_in_use': 'SELECT EXISTS (SELECT 1 FROM Booking WHERE Renter_Email = $1 AND Card_Number = $2)',
+    # With shards, bookings and cards are in different databases: booking with a
+    # card and deleting it take this lock on the booking's shard instead of
+    # relying on a foreign key.
+    'card_lock': "SELECT pg_advisory_xact_lock(hashtext('card ' || $1::text || ' ' || $2::text))",
+    # The price a booking is charged, read in the booking's transaction; FOR
+    # SHARE holds off a price change until the booking commits.
+    'property_price_lock': 'SELECT Price FROM Property WHERE Property_ID = $1 FOR SHARE',
+    'property_detail': '''
+        SELECT Property_ID, Street, City, State, Zip, Price, Type, Description, Neighborhood
+        FROM Property WHERE Property_ID = $1
+    ''',
+    # Everything the booking page reads: the property (NULL if missing) and one
+    # row per card (a single row of NULLs if the renter has none).
+    'booking_page': '''
+        SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description, p.Neighborhood,
+               c.Card_Number, c.CVV, c.Expiry_Date, c.Billing_Address, a.Street, a.City, a.State, a.Zip
+        FROM (SELECT 1) one
+        LEFT JOIN Property p ON p.Property_ID = $2
+        LEFT JOIN CreditCard c ON c.Renter_Email = $1
+        LEFT JOIN Address a ON c.Billing_Address = a.AddressID AND c.Renter_Email = a.Email
+        ORDER BY c.Card_Number
+    ''',
+    'agent_properties': f'''
+        {AGENT_PROPERTY}
+        WHERE p.Agent_Email = $1
+        ORDER BY p.Property_ID
+    ''',
+    'agent_property': f'''
+        {AGENT_PROPERTY}
+        WHERE p.Agent_Email = $1 AND p.Property_ID = $2
+    ''',
+    'renter_bookings': '''
+        SELECT b.Booking_ID, b.Property_ID, b.Booking_Date, b.Start_Date, b.End_Date, b.Card_Number, b.Renter_Email,
+               p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description
+        FROM Booking b
+        JOIN Property p ON b.Property_ID = p.Property_ID
+        WHERE b.Renter_Email = $1
+        ORDER BY b.Booking_ID
+    ''',
+    'agent_bookings': '''
+        SELECT b.Booking_ID, b.Property_ID, b.Booking_Date, b.Start_Date, b.End_Date, b.Card_Number, b.Renter_Email,
+               p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description
+        FROM Booking b
+        JOIN Property p ON b.Property_ID = p.Property_ID
+        WHERE p.Agent_Email = $1
+        ORDER BY b.Booking_ID
+    ''',
+    # Reward and cancellation jobs for one renter run one at a time, so a
+    # cancellation sees every credit committed before it.
+    'reward_lock': "SELECT pg_advisory_xact_lock(hashtext('reward ' || $1::text))",
+    # Only renters enrolled in the reward program earn points, once per stay
+    # ($4, its first Booking_ID). Nights whose rows ($6) were cancelled before
+    # the credit ran are left out of it.
+    'reward_record': '''
+        INSERT INTO RewardLedger (Email, Points, Reason, Property_ID, Booking_ID, Nights)
+        SELECT $1::varchar, ROUND($2::numeric * ($5::integer - c.Nights) / $5::integer, 2), 'booking',
+               $3::integer, $4::integer, $5::integer - c.Nights
+        FROM (SELECT COALESCE(SUM(Nights), 0)::integer AS Nights FROM RewardLedger
+              WHERE Email = $1 AND Reason = 'cancellation' AND Points = 0
+                AND Booking_ID = ANY($6::integer[])) c
+        WHERE EXISTS (SELECT 1 FROM RewardProgram WHERE Email = $1)
+          AND c.Nights < $5::integer
+          AND NOT EXISTS (SELECT 1 FROM RewardLedger WHERE Email = $1 AND Reason = 'booking' AND Booking_ID = $4)
+        RETURNING Points
+    ''',
+    # Takes back the points a cancelled booking row earned, at the per-night
+    # rate of the ledger entry it was credited under. Web bookings are credited
+    # once under their first night's Booking_ID, hence the <= and LIMIT 1.
+    # When the credit has not run yet, a zero-point cancellation is recorded
+    # instead and reward_record leaves those nights out.
+    'reward_reverse': '''
+        WITH reversed AS (
+            INSERT INTO RewardLedger (Email, Points, Reason, Property_ID, Booking_ID, Nights)
+            SELECT l.Email, -ROUND(l.Points * $4::integer / l.Nights, 2), 'cancellation', l.Property_ID,
+                   $3::integer, $4::integer
+            FROM RewardLedger l
+            WHERE l.Email = $1 AND l.Property_ID = $2 AND l.Reason = 'booking' AND l.Booking_ID <= $3 AND l.Nights > 0
+              AND NOT EXISTS (SELECT 1 FROM RewardLedger c
+                              WHERE c.Email = $1 AND c.Reason = 'cancellation' AND c.Booking_ID = $3)
+            ORDER BY l.Booking_ID DESC
+            LIMIT 1
+            RETURNING Points
+        ), pending AS (
+            INSERT INTO RewardLedger (Email, Points, Reason, Property_ID, Booking_ID, Nights)
+            SELECT $1::varchar, 0, 'cancellation', $2::integer, $3::integer, $4::integer
+            WHERE NOT EXISTS (SELECT 1 FROM reversed)
+              AND EXISTS (SELECT 1 FROM RewardProgram WHERE Email = $1)
+              AND NOT EXISTS (SELECT 1 FROM RewardLedger c
+                              WHERE c.Email = $1 AND c.Reason = 'cancellation' AND c.Booking_ID = $3)
+            RETURNING Points
+        )
+        SELECT Points FROM reversed UNION ALL SELECT Points FROM pending
+    ''',
+    # Snapshot plus the entries appended since it was taken; NULL if not enrolled.
+    'reward_balance': '''
+        SELECT CASE WHEN EXISTS (SELECT 1 FROM RewardProgram WHERE Email = $1) THEN
+            COALESCE(b.Points, 0) + COALESCE((
+                SELECT SUM(l.Points) FROM RewardLedger l
+                WHERE l.Email = $1 AND l.Entry_ID > COALESCE(b.Last_Entry_ID, 0)), 0)
+        END
+        FROM (SELECT 1) one
+        LEFT JOIN RewardBalance b ON b.Email = $1
+    ''',
+    # Balance on every row, then the history; one row of NULL history when
+    # there is none, and no rows at all when the renter is not enrolled.
+    'reward_page': '''
+        SELECT balance.Points, h.Booking_ID, h.Created_At, h.Property_ID, h.Street, h.City, h.State, h.Zip,
+               h.Price, h.Points, h.Nights, h.Reason
+        FROM (SELECT COALESCE(b.Points, 0) + COALESCE((
+                  SELECT SUM(l.Points) FROM RewardLedger l
+                  WHERE l.Email = $1 AND l.Entry_ID > COALESCE(b.Last_Entry_ID, 0)), 0) AS Points
+              FROM RewardProgram r
+              LEFT JOIN RewardBalance b ON b.Email = r.Email
+              WHERE r.Email = $1) balance
+        LEFT JOIN LATERAL (
+            SELECT l.Entry_ID, l.Booking_ID, l.Created_At, l.Property_ID, p.Street, p.City, p.State, p.Zip,
+                   p.Price, l.Points, l.Nights, l.Reason
+            FROM RewardLedger l
+            LEFT JOIN Property p ON p.Property_ID = l.Property_ID
+            WHERE l.Email = $1
+        ) h ON TRUE
+        ORDER BY h.Entry_ID DESC
+    ''',
+    # Web bookings are one row per night (Booking_Date), CLI bookings carry a
+    # Start_Date/End_Date range; both count as occupied.
+    'booking_overlap': f'''
+        SELECT EXISTS (
+            SELECT 1 FROM Booking
+            WHERE Property_ID = $1
+              AND Stay_Date BETWEEN $2::date - {MAX_STAY_NIGHTS} AND $3::date
+              AND COALESCE(Start_Date::date, Booking_Date::date) <= $3::date
+              AND COALESCE(End_Date::date, Booking_Date::date) >= $2::date
+        )
+    ''',
+    # Reads the PropertyDailyStats rollup, never Booking. A stay starts on any
+    # booked night whose previous night is not booked.
+    'agent_analytics': '''
+        WITH nights AS (
+            SELECT s.Property_ID, s.Stay_Date, s.Nights_Booked, s.Revenue,
+                   LAG(s.Stay_Date) OVER (PARTITION BY s.Property_ID ORDER BY s.Stay_Date) AS Previous_Night
+            FROM PropertyDailyStats s
+            JOIN Property p ON p.Property_ID = s.Property_ID
+            WHERE p.Agent_Email = $1 AND s.Stay_Date BETWEEN $2::date AND $3::date
+        )
+        SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Type,
+               COALESCE(SUM(n.Nights_Booked), 0)::integer, COALESCE(SUM(n.Revenue), 0),
+               COUNT(n.Stay_Date) FILTER (WHERE n.Previous_Night IS DISTINCT FROM n.Stay_Date - 1)::integer
+        FROM Property p
+        LEFT JOIN nights n ON n.Property_ID = p.Property_ID
+        WHERE p.Agent_Email = $1
+        GROUP BY p.Property_ID
+        ORDER BY p.Property_ID
+    ''',
+    # Optional filters are NULL-able parameters so one plan serves every search.
+    # A city or neighborhood with no exact match is swapped for the most similar
+    # known name (007_trigram_locations.sql), or NULL when none is close. The
+    # names searched come first in every row, and a search with no results
+    # still returns one row.
+    'search_properties': f'''
+        WITH wanted AS (
+            SELECT CASE WHEN $1::text IS NULL OR EXISTS (SELECT 1 FROM PropertyCities WHERE City = $1) THEN $1
+                        ELSE (SELECT City FROM PropertyCities WHERE City % $1
+                              ORDER BY similarity(City, $1) DESC, City LIMIT 1)
+                   END AS City,
+                   CASE WHEN $10::text IS NULL
+                          OR EXISTS (SELECT 1 FROM NeighborhoodStats WHERE Neighborhood = $10) THEN $10
+                        ELSE (SELECT Neighborhood FROM NeighborhoodStats WHERE Neighborhood % $10
+                              ORDER BY similarity(Neighborhood, $10) DESC, Neighborhood LIMIT 1)
+                   END AS Neighborhood
+        )
+        SELECT w.City, w.Neighborhood, r.*
+        FROM wanted w
+        LEFT JOIN LATERAL (
+            SELECT p.Property_ID, p.Street, p.City, p.State, p.Zip, p.Price, p.Type, p.Description,
+                   {BEDROOMS} AS Bedrooms, p.Square_Footage, p.Neighborhood, n.Crime_Rate, n.Nearby_Schools,
+                   a.Floor, l.Purpose_of_land, c.Business_Type, v.Amenities,
+                   ns.Listings, ns.Average_Price, ns.Bookings_30d, ts_rank_cd(p.Search_Vector, kw.Query) AS Rank
+            FROM Property p
+            CROSS JOIN (SELECT websearch_to_tsquery('english', $9::text) AS Query) kw
+            LEFT JOIN House h ON p.Property_ID = h.Property_ID
+            LEFT JOIN Apartment a ON p.Property_ID = a.Property_ID
+            LEFT JOIN Vacation_Home v ON p.Property_ID = v.Property_ID
+            LEFT JOIN Land l ON p.Property_ID = l.Property_ID
+            LEFT JOIN Commercial_Building c ON p.Property_ID = c.Property_ID
+            LEFT JOIN Neighborhood n ON p.Neighborhood = n.Name
+            LEFT JOIN NeighborhoodSummary ns ON ns.Neighborhood = p.Neighborhood
+            WHERE p.Availability = TRUE
+              AND ($1::text IS NULL OR p.City = w.City)
+              AND ($10::text IS NULL OR p.Neighborhood = w.Neighborhood)
+              AND ($2::date IS NULL OR NOT EXISTS (
+                    SELECT 1 FROM Booking b
+                    WHERE b.Property_ID = p.Property_ID
+                      AND b.Stay_Date BETWEEN $2::date - {MAX_STAY_NIGHTS} AND $2
+                      AND $2 BETWEEN COALESCE(b.Start_Date::date, b.Booking_Date::date)
+                                 AND COALESCE(b.End_Date::date, b.Booking_Date::date)))
+              AND ($3::text IS NULL OR p.Type = $3)
+              AND ($4::integer IS NULL OR COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, 0) >= $4)
+              AND ($5::integer IS NULL OR COALESCE(h.Number_of_rooms, a.Number_of_rooms, v.Number_of_rooms, 100) <= $5)
+              AND ($6::numeric IS NULL OR p.Price >= $6)
+              AND ($7::numeric IS NULL OR p.Price <= $7)
+              AND (kw.Query IS NULL OR p.Search_Vector @@ kw.Query)
+            ORDER BY CASE WHEN $8::text = 'price' THEN p.Price END,
+                     CASE WHEN $8::text = 'bedrooms' THEN {BEDROOMS} END,
+                     Rank DESC NULLS LAST,
+                     p.Property_ID
+        ) r ON TRUE
+    ''',
+}
+
+# Connections without a `prepared` set (e.g. the one-shot CLI) run the same SQL
+# unprepared, with $n rewritten to named pyformat placeholders.
+_UNPREPARED = {name: re.sub(r'\$(\d+)', r'%(p\1)s', sql.replace('%', '%%')) for name, sql in STATEMENTS.items()}
+
+def execute(cur, name, *params):
+    prepared = getattr(cur.connection, 'prepared', None)
+    if prepared is None:
+        cur.execute(_UNPREPARED[name], {f'p{i}': value for i, value in enumerate(params, 1)})
+        return cur
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {STATEMENTS[name]}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+    return cur
+
+def _scalar(cur):
+    row = cur.fetchone()
+    return row[0] if row else None
+
+# --- Users ---
+
+def get_user_role(cur, email):
+    return _scalar(execute(cur, 'user_role', email))
+
+# Admins are the agents whose emails are listed in ADMIN_EMAILS.
+def is_admin(email):
+    return email in [e.strip() for e in os.getenv('ADMIN_EMAILS', '').split(',') if e.strip()]
+
+# --- Neighborhoods ---
+
+def list_neighborhoods(cur):
+    return [Neighborhood._make(row) for row in execute(cur, 'neighborhoods').fetchall()]
+
+def neighborhood_summaries(cur):
+    return {row[0]: NeighborhoodSummary._make(row) for row in execute(cur, 'neighborhood_summary').fetchall()}
+
+# What the trigger-maintained rollups should hold, computed from scratch.
+_NEIGHBORHOOD_TOTALS = '''
+    SELECT Neighborhood, COUNT(*) AS Listings, COUNT(*) FILTER (WHERE Availability) AS Available,
+           COALESCE(SUM(Price), 0) AS Price_Sum
+    FROM Property WHERE Neighborhood IS NOT NULL
+    GROUP BY Neighborhood
+'''
+# One stay per property, renter and day booked (008_neighborhood_stays.sql).
+_BOOKING_STAYS = '''
+    SELECT Property_ID, Renter_Email, Booked_On, COUNT(*) AS Booking_Rows
+    FROM Booking WHERE Renter_Email IS NOT NULL
+    GROUP BY 1, 2, 3
+'''
+_NEIGHBORHOOD_DAILY = f'''
+    SELECT p.Neighborhood, s.Booked_On AS Booking_Day, COUNT(*) AS Bookings
+    FROM ({_BOOKING_STAYS}) s JOIN Property p ON p.Property_ID = s.Property_ID
+    WHERE p.Neighborhood IS NOT NULL
+    GROUP BY 1, 2
+'''
+
+def neighborhood_stats_drift(cur):
+    # One statement, so stored and recomputed values come from the same snapshot.
+    cur.execute(f'''
+        WITH totals AS ({_NEIGHBORHOOD_TOTALS}), daily AS ({_NEIGHBORHOOD_DAILY})
+        SELECT COALESCE(s.Neighborhood, t.Neighborhood), NULL::date, c.Field, c.Stored, c.Expected
+        FROM NeighborhoodStats s
+        FULL JOIN totals t ON t.Neighborhood = s.Neighborhood
+        CROSS JOIN LATERAL (VALUES ('listings', s.Listings::numeric, t.Listings::numeric),
+                                   ('available', s.Available::numeric, t.Available::numeric),
+                                   ('price_sum', s.Price_Sum, t.Price_Sum)) c(Field, Stored, Expected)
+        WHERE c.Stored IS DISTINCT FROM c.Expected
+        UNION ALL
+        SELECT COALESCE(d.Neighborhood, e.Neighborhood), COALESCE(d.Booking_Day, e.Booking_Day), 'bookings',
+               d.Bookings, e.Bookings
+        FROM NeighborhoodDailyBookings d
+        FULL JOIN daily e ON e.Neighborhood = d.Neighborhood AND e.Booking_Day = d.Booking_Day
+        -- Only the days NeighborhoodSummary reads; older bookings may be archived.
+        WHERE d.Bookings IS DISTINCT FROM e.Bookings
+          AND COALESCE(d.Booking_Day, e.Booking_Day) > current_date - 30
+        ORDER BY 1, 2 NULLS FIRST, 3
+    ''')
+    return [StatsDrift._make(row) for row in cur.fetchall()]
+
+def rebuild_neighborhood_stats(cur):
+    # Blocks property and booking writes until the caller commits.
+    cur.execute('LOCK TABLE Property, Booking IN SHARE MODE')
+    cur.execute('DELETE FROM NeighborhoodStats')
+    cur.execute(f'INSERT INTO NeighborhoodStats (Neighborhood, Listings, Available, Price_Sum) {_NEIGHBORHOOD_TOTALS}')
+    cur.execute('DELETE FROM BookingStays')
+    cur.execute(f'INSERT INTO BookingStays (Property_ID, Renter_Email, Booked_On, Booking_Rows) {_BOOKING_STAYS}')
+    cur.execute('DELETE FROM NeighborhoodDailyBookings')
+    cur.execute(f'INSERT INTO NeighborhoodDailyBookings (Neighborhood, Booking_Day, Bookings) {_NEIGHBORHOOD_DAILY}')
+
+# --- Addresses ---
+
+def list_addresses(cur, email):
+    return [Address._make(row) for row in execute(cur, 'addresses', email).fetchall()]
+
+def get_address(cur, email, address_id):
+    row = execute(cur, 'address', email, address_id).fetchone()
+    return Address._make(row) if row else None
+
+def add_address(cur, email, street, city, state, zip_code, primary):
+    if primary:
+        execute(cur, 'address_clear_primary', email)
+    invalidation.publish(cur, 'address', email)
+    return _scalar(execute(cur, 'address_insert', email, street, city, state, zip_code, primary))
+
+def update_address(cur, email, address_id, street, city, state, zip_code, primary):
+    if primary:
+        execute(cur, 'address_clear_primary', email)
+    invalidation.publish(cur, 'address', email)
+    return execute(cur, 'address_update', email, address_id, street, city, state, zip_code, primary).rowcount
+
+def delete_address(cur, email, address_id):
+    invalidation.publish(cur, 'address', email)
+    return execute(cur, 'address_delete', email, address_id).rowcount
+
+def address_is_billing(cur, email, address_id):
+    return _scalar(execute(cur, 'address_is_billing', email, address_id))
+
+# --- Credit cards ---
+
+def list_cards(cur, email):
+    return [CreditCard._make(row) for row in execute(cur, 'cards', email).fetchall()]
+
+def get_card(cur, email, card_number):
+    row = execute(cur, 'card', email, card_number).fetchone()
+    return CreditCard._make(row) if row else None
+
+def add_card(cur, email, card_number, cvv, expiry_date, billing_address):
+    # Returns (address_ok, added): the billing address must belong to the
+    # renter, and added is False when they already have this card.
+    address_ok, added, _ = execute(cur, 'card_insert', email, card_number, cvv, expiry_date, billing_address,
+                                   invalidation.CHANNEL, invalidation.payload('card', email)).fetchone()
+    return address_ok, added
+
+def update_card(cur, email, card_number, cvv, expiry_date, billing_address):
+    invalidation.publish(cur, 'card', email)
+    return execute(cur, 'card_update', email, card_number, cvv, expiry_date, billing_address).rowcount
+
+def delete_card(cur, email, card_number):
+    invalidation.publish(cur, 'card', email)
+    return execute(cur, 'card_delete', email, card_number).rowcount
+
+def card_in_use(cur, email, card_number):
+    return _scalar(execute(cur, 'card_in_use', email, card_number))
+
+def lock_card(cur, email, card_number):
+    execute(cur, 'card_lock', email, card_number)
+
+# --- Bookings ---
+
+def lock_property_price(cur, property_id):
+    return _scalar(execute(cur, 'property_price_lock', property_id))
+
+def booking_overlaps(cur, property_id, first_night, last_night):
+    return _scalar(execute(cur, 'booking_overlap', property_id, first_night, last_night))
+
+def list_bookings(cur, email, role):
+    statement = 'renter_bookings' if role == 'renter' else 'agent_bookings'
+    return rows.Booking.from_cursor(execute(cur, statement, email))
+
+def agent_analytics(cur, email, first_night, last_night):
+    return [PropertyStats._make(row) for row in execute(cur, 'agent_analytics', email, first_night, last_night).fetchall()]
+
+# --- Rewards ---
+
+def lock_rewards(cur, email):
+    execute(cur, 'reward_lock', email)
+
+def record_booking_reward(cur, email, points, property_id, booking_id, nights, booking_ids=None):
+    # Returns the points credited, or None if the renter is not enrolled, the
+    # stay was already credited or every night was cancelled first.
+    return _scalar(execute(cur, 'reward_record', email, points, property_id, booking_id, nights,
+                           booking_ids or [booking_id]))
+
+def reverse_booking_reward(cur, email, property_id, booking_id, nights):
+    return _scalar(execute(cur, 'reward_reverse', email, property_id, booking_id, nights))
+
+def reward_balance(cur, email):
+    return _scalar(execute(cur, 'reward_balance', email))
+
+def get_reward_page(cur, email):
+    # (balance, history); balance is None if the renter is not enrolled.
+    page = execute(cur, 'reward_page', email).fetchall()
+    if not page:
+        return None, []
+    return page[0][0], [RewardEntry._make(row[1:]) for row in page if row[-1] is not None]
+
+def reward_compaction_horizon(cur):
+    # Ledger IDs come from a sequence, so an entry with a lower ID can commit
+    # after one with a higher ID. Taking SHARE waits out in-flight inserts;
+    # commit straight after so bookings are only blocked for that moment.
+    cur.execute('LOCK TABLE RewardLedger IN SHARE MODE')
+    cur.execute('SELECT COALESCE(MAX(Entry_ID), 0) FROM RewardLedger')
+    return cur.fetchone()[0]
+
+def compact_reward_balances(cur, horizon):
+    # Folds ledger entries up to `horizon` into RewardBalance; returns the
+    # number of renters whose snapshot moved.
+    cur.execute('''
+        INSERT INTO RewardBalance (Email, Points, Last_Entry_ID, Compacted_At)
+        SELECT l.Email, SUM(l.Points), MAX(l.Entry_ID), now()
+        FROM RewardLedger l
+        LEFT JOIN RewardBalance b ON b.Email = l.Email
+        WHERE l.Entry_ID > COALESCE(b.Last_Entry_ID, 0) AND l.Entry_ID <= %s
+        GROUP BY l.Email
+        ON CONFLICT (Email) DO UPDATE
+        SET Points = RewardBalance.Points + EXCLUDED.Points,
+            Last_Entry_ID = EXCLUDED.Last_Entry_ID,
+            Compacted_At = EXCLUDED.Compacted_At
+    ''', (horizon,))
+    return cur.rowcount
+
+# --- Properties ---
+
+def get_booking_page(cur, email, property_id):
+    # (property or None, cards)
+    page = execute(cur, 'booking_page', email, property_id).fetchall()
+    prop = PropertyDetail._make(page[0][:9]) if page[0][0] is not None else None
+    return prop, [CreditCard._make(row[9:]) for row in page if row[9] is not None]
+
+def get_property_detail(cur, property_id):
+    row = execute(cur, 'property_detail', property_id).fetchone()
+    return PropertyDetail._make(row) if row else None
+
+def list_agent_properties(cur, email):
+    return rows.Property.from_cursor(execute(cur, 'agent_properties', email))
+
+def get_agent_property(cur, email, property_id):
+    found = rows.Property.from_cursor(execute(cur, 'agent_property', email, property_id))
+    return found[0] if found else None
+
+# rows.Property attribute -> Property column.
+PROPERTY_COLUMNS = {
+    'street': 'Street', 'city': 'City', 'state': 'State', 'zip': 'Zip', 'price': 'Price',
+    'availability': 'Availability', 'square_footage': 'Square_Footage', 'description': 'Description',
+    'type': 'Type', 'neighborhood': 'Neighborhood',
+}
+
+# Property type -> (subtype table, rows.Property attribute -> column).
+SUBTYPE_COLUMNS = {
+    'House': ('House', {'bedrooms': 'Number_of_rooms'}),
+    'Apartment': ('Apartment', {'bedrooms': 'Number_of_rooms', 'floor': 'Floor'}),
+    'Vacation Home': ('Vacation_Home', {'bedrooms': 'Number_of_rooms'}),
+    'Land': ('Land', {'purpose_of_land': 'Purpose_of_land'}),
+    'Commercial Building': ('Commercial_Building', {'business_type': 'Business_Type'}),
+}
+
+def _differs(old, new):
+    if isinstance(old, decimal.Decimal) and isinstance(new, (int, float)):
+        return decimal.Decimal(str(new)) != old
+    return old != new
+
+def update_property(cur, email, current, changes):
+    # Writes only what differs from `current` (a rows.Property loaded for this
+    # agent) and returns {table: rows touched}; empty when nothing changed.
+    touched = {}
+    changed = {name: value for name, value in changes.items() if _differs(getattr(current, name), value)}
+    columns = {PROPERTY_COLUMNS[name]: value for name, value in changed.items() if name in PROPERTY_COLUMNS}
+    if columns:
+        cur.execute(f"UPDATE Property SET {', '.join(f'{column} = %s' for column in columns)} "
+                    'WHERE Property_ID = %s AND Agent_Email = %s',
+                    (*columns.values(), current.property_id, email))
+        touched['Property'] = cur.rowcount
+
+    new_type = changes.get('type', current.type)
+    old_table, _ = SUBTYPE_COLUMNS.get(current.type, (None, {}))
+    new_table, fields = SUBTYPE_COLUMNS.get(new_type, (None, {}))
+    if new_type != current.type:
+        if old_table:
+            cur.execute(f'DELETE FROM {old_table} WHERE Property_ID = %s', (current.property_id,))
+            touched[old_table] = cur.rowcount
+        subtype = {column: changes.get(name) for name, column in fields.items()}
+    else:
+        subtype = {column: changed[name] for name, column in fields.items() if name in changed}
+    if new_table and (subtype or new_type != current.type):
+        # The subtype row can be missing for older listings, hence the upsert.
+        names = ['Property_ID', *subtype]
+        conflict = (f"DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in subtype)}"
+                    if subtype else 'DO NOTHING')
+        cur.execute(f"INSERT INTO {new_table} ({', '.join(names)}) VALUES ({', '.join(['%s'] * len(names))}) "
+                    f'ON CONFLICT (Property_ID) {conflict}',
+                    (current.property_id, *subtype.values()))
+        touched[new_table] = cur.rowcount
+
+    if touched:
+        invalidation.publish(cur, 'property', current.property_id, changes.get('city', current.city))
+        if changes.get('city', current.city) != current.city:
+            invalidation.publish(cur, 'property', current.property_id, current.city)
+    return touched
+
+# --- Search ---
+
+def _suggestion(searched, given):
+    if searched is None or given is None or searched.casefold() == given.casefold():
+        return None
+    return searched
+
+def search_results(rows, city=None, neighborhood=None):
+    # Rows of the search_properties statement: the city and neighborhood
+    # searched, then a PropertyResult that is all NULL when nothing matched.
+    searched_city, searched_neighborhood = rows[0][:2] if rows else (None, None)
+    return SearchResults([PropertyResult._make(row[2:]) for row in rows if row[2] is not None],
+                         searched_city, searched_neighborhood,
+                         _suggestion(searched_city, city), _suggestion(searched_neighborhood, neighborhood))
+
+def search_properties(cur, city=None, date=None, property_type=None, min_bedrooms=None, max_bedrooms=None,
+                      min_price=None, max_price=None, order_by=None, keywords=None, neighborhood=None):
+    # Blank form fields mean "no filter". Keywords use web search syntax
+    # ("ocean view", pool -shared) and rank matches best first unless
+    # order_by asks for price or bedrooms. A misspelt city or neighborhood
+    # is searched as the closest known one and reported back as a suggestion.
+    params = [value if value != '' else None
+              for value in (city, date, property_type, min_bedrooms, max_bedrooms, min_price, max_price, order_by,
+                            keywords, neighborhood)]
+    return search_results(execute(cur, 'search_properties', *params).fetchall(), params[0], params[9])
@@ -0,0 +1,55 @@
+# Compact row objects for result sets that can get large (an agent's listing,
+# booking history). Instances use __slots__, so there is no per-row __dict__,
+# and values in SHARED columns are deduplicated per result set: a city or a
+# price that appears on 10,000 rows is stored once instead of 10,000 times.
+
+FETCH_SIZE = 2000
+
+class Row:
+    __slots__ = ()
+    SHARED = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_cursor(cls, cur):
+        shared = [i for i, name in enumerate(cls.__slots__) if name in cls.SHARED]
+        # One table per column: 100 and Decimal('100.00') compare equal but
+        # must not stand in for each other.
+        seen = {i: {} for i in shared}
+        result = []
+        # fetchmany keeps only one batch of driver tuples alive at a time.
+        while True:
+            batch = cur.fetchmany(FETCH_SIZE)
+            if not batch:
+                return result
+            for values in batch:
+                if shared:
+                    values = list(values)
+                    for i in shared:
+                        values[i] = seen[i].setdefault(values[i], values[i])
+                result.append(cls(*values))
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+class Property(Row):
+    __slots__ = ('property_id', 'street', 'city', 'state', 'zip', 'price', 'availability', 'square_footage',
+                 'description', 'type', 'neighborhood', 'bedrooms', 'floor', 'purpose_of_land', 'business_type')
+    SHARED = ('city', 'state', 'zip', 'price', 'square_footage', 'type', 'neighborhood', 'purpose_of_land',
+              'business_type')
+
+class Booking(Row):
+    __slots__ = ('booking_id', 'property_id', 'booking_date', 'start_date', 'end_date', 'card_number',
+                 'renter_email', 'street', 'city', 'state', 'zip', 'price', 'type', 'description')
+    SHARED = ('property_id', 'booking_date', 'start_date', 'end_date', 'card_number', 'renter_email', 'street',
+              'city', 'state', 'zip', 'price', 'type', 'description')
+
+    @property
+    def nights(self):
+        if self.start_date is None or self.end_date is None:
+            return None
+        return (self.end_date - self.start_date).days
@@ -0,0 +1,122 @@
+import contextlib
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bulk
+import caches
+import db
+import repository
+
+# Reads that span every shard (see db.SHARDS): run the same repository call on
+# each shard at once and merge the already-sorted results, so one slow shard
+# costs its own latency rather than the sum of all of them.
+
+_executor = None
+_executor_pid = None
+
+def _pool():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=int(os.getenv('SHARD_FANOUT_THREADS', '32')),
+                                       thread_name_prefix='shard-fanout')
+        _executor_pid = os.getpid()
+    return _executor
+
+def each_shard(fn):
+    # fn(cur) on every shard, results in shard order. The caller's
+    # statement_timeout carries over to the fan-out threads.
+    timeout = db.current_statement_timeout()
+    def run(shard):
+        with db.statement_timeout(timeout):
+            with db.get_db_connection(shard=shard) as conn:
+                with conn.cursor() as cur:
+                    return fn(cur)
+    return list(_pool().map(run, db.SHARDS))
+
+def combine_summaries(per_shard):
+    # Neighborhood summaries from several shards as if from one database.
+    combined = {}
+    for summaries in per_shard:
+        for name, summary in summaries.items():
+            total = combined.get(name)
+            if total is None:
+                combined[name] = summary
+                continue
+            listings = total.listings + summary.listings
+            price_sum = (total.average_price or 0) * total.listings + (summary.average_price or 0) * summary.listings
+            combined[name] = repository.NeighborhoodSummary(
+                name, listings, total.available + summary.available,
+                round(price_sum / listings, 2) if listings else None,
+                total.bookings_30d + summary.bookings_30d
+            )
+    return combined
+
+def neighborhood_summaries():
+    return combine_summaries(each_shard(repository.neighborhood_summaries))
+
+def _search_order(order_by):
+    # Same order as the ORDER BY in repository's search_properties.
+    def key(result):
+        value = {'price': result.price, 'bedrooms': result.bedrooms}.get(order_by)
+        return (value is None, value if value is not None else 0,
+                result.rank is None, -(result.rank or 0), result.property_id)
+    return key
+
+def search_properties(city=None, date=None, property_type=None, min_bedrooms=None, max_bedrooms=None,
+                      min_price=None, max_price=None, order_by=None, keywords=None, neighborhood=None):
+    def search(cur):
+        return (repository.search_properties(cur, city, date, property_type, min_bedrooms, max_bedrooms,
+                                             min_price, max_price, order_by, keywords, neighborhood),
+                repository.neighborhood_summaries(cur))
+    per_shard = each_shard(search)
+    stats = combine_summaries([summaries for _, summaries in per_shard])
+    # Each shard corrects a misspelt city or neighborhood against its own
+    # names, so they can disagree. Shards that know no close name have no
+    # results; of the rest, keep those that searched the names as given if
+    # any did, else the correction with the most results.
+    candidates = [found for found, _ in per_shard
+                  if not (city and found.city is None) and not (neighborhood and found.neighborhood is None)]
+    if not candidates:
+        return repository.SearchResults([], None, None, None, None)
+    def corrections(found):
+        return (found.suggested_city is not None) + (found.suggested_neighborhood is not None)
+    best = min(candidates, key=lambda found: (corrections(found), -len(found.results)))
+    matching = [found.results for found in candidates
+                if (found.city, found.neighborhood) == (best.city, best.neighborhood)]
+    # Neighborhood rows live on the primary, so their columns come from the cache.
+    known = {n.name: n for n in caches.neighborhoods.all()}
+    results = []
+    for result in heapq.merge(*matching, key=_search_order(order_by)):
+        neighborhood_row = known.get(result.neighborhood)
+        summary = stats.get(result.neighborhood)
+        results.append(result._replace(
+            crime_rate=neighborhood_row.crime_rate if neighborhood_row else None,
+            nearby_schools=neighborhood_row.nearby_schools if neighborhood_row else None,
+            neighborhood_listings=summary.listings if summary else None,
+            neighborhood_average_price=summary.average_price if summary else None,
+            neighborhood_bookings_30d=summary.bookings_30d if summary else None
+        ))
+    return best._replace(results=results)
+
+def renter_bookings(email):
+    # A renter's bookings can be on any shard; each shard returns them by Booking_ID.
+    per_shard = each_shard(lambda cur: repository.list_bookings(cur, email, 'renter'))
+    return list(heapq.merge(*per_shard, key=lambda booking: booking.booking_id))
+
+def export_rows(kind, agent_email=None, **filters):
+    # bulk.export_rows from every shard (only the agent's, when filtering by
+    # agent), merged by the ID each export is ordered by.
+    targets = [db.shard_for_agent(agent_email)] if agent_email else db.SHARDS
+    with contextlib.ExitStack() as stack:
+        conns = [stack.enter_context(db.get_db_connection(shard=shard)) for shard in targets]
+        yield from heapq.merge(*[bulk.export_rows(conn, kind, agent_email=agent_email, **filters) for conn in conns],
+                               key=lambda row: row[0])
+
+def with_property(entry):
+    # Fills a reward history entry's property columns, which the primary
+    # cannot join in sharded mode.
+    prop = caches.property_details.get(entry.property_id) if entry.property_id is not None else None
+    if prop is None:
+        return entry
+    return entry._replace(street=prop.street, city=prop.city, state=prop.state, zip=prop.zip, price=prop.price)
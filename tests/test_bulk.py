@@ -0,0 +1,46 @@
+import pytest
+
+import bulk
+
+def row(**overrides):
+    values = dict(street='1 Main St', city='Boston', state='MA', zip='02101', price='250', availability='yes',
+                  square_footage='900', type='House', neighborhood='Back Bay', number_of_rooms='3')
+    values.update(overrides)
+    return values
+
+def test_valid_row():
+    values = dict(zip(bulk.IMPORT_COLUMNS, bulk.validate_import_row(row(description='  Sunny  '))))
+    assert values['price'] == 250.0
+    assert values['availability'] is True
+    assert values['number_of_rooms'] == 3
+    assert values['description'] == 'Sunny'
+    assert values['floor'] is None
+
+def test_type_is_normalized():
+    values = dict(zip(bulk.IMPORT_COLUMNS, bulk.validate_import_row(row(type='vacation_home', amenities='pool'))))
+    assert values['type'] == 'Vacation Home'
+
+@pytest.mark.parametrize('overrides, message', [
+    (dict(city=' '), 'city is required'),
+    (dict(type='castle'), 'type must be one of'),
+    (dict(price='cheap'), 'price must be a number'),
+    (dict(square_footage='-1'), 'square_footage must not be negative'),
+    (dict(availability='maybe'), 'availability must be true or false'),
+    (dict(type='Apartment'), 'floor is required'),
+])
+def test_invalid_rows(overrides, message):
+    with pytest.raises(ValueError, match=message):
+        bulk.validate_import_row(row(**overrides))
+
+def test_read_import_rows_reports_bad_json(tmp_path):
+    path = tmp_path / 'properties.ndjson'
+    path.write_text('{"Street": "1 Main St"}\n\nnot json\n[1]\n')
+    rows = list(bulk.read_import_rows(str(path)))
+    assert rows[0] == (1, {'street': '1 Main St'})
+    assert [row_no for row_no, _ in rows[1:]] == [3, 4]
+    assert all(isinstance(error, ValueError) for _, error in rows[1:])
+
+def test_read_import_rows_csv_headers(tmp_path):
+    path = tmp_path / 'properties.csv'
+    path.write_text(' Street ,CITY\n1 Main St,Boston\n')
+    assert list(bulk.read_import_rows(str(path))) == [(1, {'street': '1 Main St', 'city': 'Boston'})]
@@ -0,0 +1,23 @@
+import pytest
+
+import db
+
+@pytest.fixture
+def shards(monkeypatch):
+    shards = [db.Database(f'shard{i}', f'dbname=shard{i}') for i in range(3)]
+    monkeypatch.setattr(db, 'SHARDS', shards)
+    return shards
+
+def test_unsharded_means_primary(monkeypatch):
+    monkeypatch.setattr(db, 'SHARDS', [])
+    assert db.shard_for_agent('a@example.com') is None
+    assert db.shard_for_id(42) is None
+
+def test_ids_route_by_modulo(shards):
+    assert db.shard_for_id(7) is shards[1]
+    assert db.shard_for_id('9') is shards[0]
+
+def test_agents_route_stably(shards):
+    shard = db.shard_for_agent('agent@example.com')
+    assert shard in shards
+    assert db.shard_for_agent('  Agent@Example.com ') is shard
@@ -0,0 +1,37 @@
+import pytest
+
+import jobs
+
+class Cursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append((' '.join(query.split()), params))
+
+def test_backoff_grows_and_is_capped():
+    for attempts in range(1, 4):
+        delay = jobs.backoff(attempts)
+        base = jobs.BACKOFF_BASE * 2 ** (attempts - 1)
+        assert base <= delay <= base * 1.5
+    assert jobs.backoff(50) <= jobs.MAX_BACKOFF * 1.5
+
+def test_failed_job_is_rescheduled():
+    cur = Cursor()
+    jobs._failed(cur, 7, 'booking_reward', 2, 'ValueError: boom')
+    (query, (attempts, error, delay, job_id)), = cur.statements
+    assert query.startswith('UPDATE Job SET Attempts')
+    assert (attempts, error, job_id) == (2, 'ValueError: boom', 7)
+    assert jobs.BACKOFF_BASE * 2 <= delay <= jobs.BACKOFF_BASE * 2 * 1.5
+
+def test_last_attempt_moves_to_dead_job():
+    cur = Cursor()
+    jobs._failed(cur, 7, 'booking_reward', jobs.MAX_ATTEMPTS, 'ValueError: boom')
+    (query, params), = cur.statements
+    assert 'INSERT INTO DeadJob' in query
+    assert params == (7, jobs.MAX_ATTEMPTS, 'ValueError: boom')
+
+def test_failures_are_logged(caplog):
+    jobs._failed(Cursor(), 7, 'booking_reward', 1, 'ValueError: boom')
+    jobs._failed(Cursor(), 8, 'booking_reward', jobs.MAX_ATTEMPTS, 'ValueError: boom')
+    assert [record.levelname for record in caplog.records] == ['WARNING', 'ERROR']
@@ -0,0 +1,43 @@
+import pytest
+
+import ratelimit
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+def test_burst_then_refused(clock):
+    buckets = ratelimit.LocalBuckets()
+    assert [buckets.take('ip:1', 1, 3) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take('ip:1', 1, 3) == pytest.approx(1)
+
+def test_refills_at_rate(clock):
+    buckets = ratelimit.LocalBuckets()
+    for _ in range(2):
+        buckets.take('ip:1', 0.5, 2)
+    assert buckets.take('ip:1', 0.5, 2) == pytest.approx(2)
+    clock.now += 2
+    assert buckets.take('ip:1', 0.5, 2) == 0
+
+def test_keys_are_independent(clock):
+    buckets = ratelimit.LocalBuckets()
+    buckets.take('ip:1', 1, 1)
+    assert buckets.take('ip:1', 1, 1) > 0
+    assert buckets.take('user:a@b.com', 1, 1) == 0
+
+def test_evicts_only_full_buckets(clock):
+    buckets = ratelimit.LocalBuckets(max_keys=2)
+    buckets.take('old', 1, 1)
+    clock.now += 10
+    buckets.take('a', 1, 5)
+    buckets.take('b', 1, 5)
+    assert set(buckets._buckets) == {'a', 'b'}
@@ -0,0 +1,35 @@
+import datetime
+from decimal import Decimal
+
+import rows
+
+class Cursor:
+    def __init__(self, results):
+        self.results = list(results)
+
+    def fetchmany(self, size):
+        batch, self.results = self.results[:size], self.results[size:]
+        return batch
+
+def booking(booking_id, property_id, price, city='Boston'):
+    return (booking_id, property_id, datetime.date(2025, 1, 1), datetime.date(2025, 1, 1),
+            datetime.date(2025, 1, 3), '1234567812345678', 'r@example.com', '1 Main St', city, 'MA',
+            '02101', price, 'House', None)
+
+def test_values_are_shared_within_a_column():
+    first, second = rows.Booking.from_cursor(Cursor([booking(1, 7, Decimal('90')),
+                                                     booking(2, 8, Decimal('90'), city=''.join(['Bos', 'ton']))]))
+    assert first.city is second.city
+    assert first.price is second.price
+
+def test_equal_values_of_different_types_stay_apart():
+    (row,) = rows.Booking.from_cursor(Cursor([booking(1, 100, Decimal('100.00'))]))
+    assert type(row.property_id) is int
+    assert type(row.price) is Decimal
+    assert str(row.price) == '100.00'
+
+def test_reads_in_batches(monkeypatch):
+    monkeypatch.setattr(rows, 'FETCH_SIZE', 2)
+    result = rows.Booking.from_cursor(Cursor([booking(i, i, Decimal(i)) for i in range(5)]))
+    assert [row.booking_id for row in result] == [0, 1, 2, 3, 4]
+    assert result[0].nights == 2
@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+import caches
+import repository
+import shards
+
+def summary(name, listings, available, average_price, bookings_30d):
+    return repository.NeighborhoodSummary(name, listings, available, average_price, bookings_30d)
+
+def result(property_id, price, bedrooms=None, rank=None, neighborhood=None):
+    return repository.PropertyResult(property_id, 'street', 'Boston', 'MA', '02101', price, 'House', None,
+                                      bedrooms, Decimal('100'), neighborhood, None, None, None, None, None,
+                                      None, None, None, None, rank)
+
+def test_combine_summaries_weights_average_price():
+    combined = shards.combine_summaries([
+        {'Back Bay': summary('Back Bay', 1, 1, Decimal('100'), 2)},
+        {'Back Bay': summary('Back Bay', 3, 0, Decimal('200'), 1),
+         'Fenway': summary('Fenway', 2, 2, Decimal('50'), 0)},
+    ])
+    assert combined['Back Bay'] == summary('Back Bay', 4, 1, Decimal('175'), 3)
+    assert combined['Fenway'] == summary('Fenway', 2, 2, Decimal('50'), 0)
+
+def test_combine_summaries_without_listings():
+    combined = shards.combine_summaries([{'Fenway': summary('Fenway', 0, 0, None, 1)},
+                                         {'Fenway': summary('Fenway', 0, 0, None, 2)}])
+    assert combined['Fenway'] == summary('Fenway', 0, 0, None, 3)
+
+def test_search_merges_shards_in_order(monkeypatch):
+    per_shard = [
+        (repository.SearchResults([result(1, Decimal('50')), result(3, Decimal('300'))], 'Boston', None, None, None),
+         {}),
+        (repository.SearchResults([result(2, Decimal('100')), result(4, None)], 'Boston', None, None, None),
+         {}),
+    ]
+    monkeypatch.setattr(shards, 'each_shard', lambda fn: per_shard)
+    monkeypatch.setattr(caches.neighborhoods, 'all', lambda: [])
+    found = shards.search_properties('Boston', order_by='price')
+    assert [r.property_id for r in found.results] == [1, 2, 3, 4]
+
+def test_search_prefers_shards_that_matched_as_given(monkeypatch):
+    per_shard = [
+        # 'Newtown' is a city on the first shard; the second only knows 'Newton'.
+        (repository.SearchResults([result(1, Decimal('50'))], 'Newtown', None, None, None), {}),
+        (repository.SearchResults([result(2, Decimal('60')), result(4, Decimal('70'))], 'Newton', None,
+                                  'Newton', None), {}),
+        (repository.SearchResults([], None, None, None, None), {}),
+    ]
+    monkeypatch.setattr(shards, 'each_shard', lambda fn: per_shard)
+    monkeypatch.setattr(caches.neighborhoods, 'all', lambda: [])
+    found = shards.search_properties('Newtown', order_by='price')
+    assert [r.property_id for r in found.results] == [1]
+    assert found.suggested_city is None
+
+def test_renter_bookings_merge_by_booking_id(monkeypatch):
+    class Booking:
+        def __init__(self, booking_id):
+            self.booking_id = booking_id
+    monkeypatch.setattr(shards, 'each_shard', lambda fn: [[Booking(1), Booking(4)], [Booking(2), Booking(3)]])
+    assert [b.booking_id for b in shards.renter_bookings('r@example.com')] == [1, 2, 3, 4]
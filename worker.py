@@ -0,0 +1,31 @@
+# Runs background jobs (see jobs.py). Start one or more next to the web app:
+#
+#   python worker.py            # keep polling
+#   python worker.py --once     # run whatever is due, then exit (cron, tests)
+#
+# Logs go to stderr through `logging`; WORKER_LOG_LEVEL (default INFO) sets
+# the level.
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+
+import jobs
+
+def main():
+    parser = argparse.ArgumentParser(description='Real Estate Management job worker')
+    parser.add_argument('--once', action='store_true', help='Exit when no job is due')
+    parser.add_argument('--poll_interval', type=float, default=jobs.POLL_INTERVAL, help='Seconds to wait when the queue is empty')
+    args = parser.parse_args()
+    load_dotenv()
+    logging.basicConfig(level=os.getenv('WORKER_LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    try:
+        processed = jobs.work(once=args.once, poll_interval=args.poll_interval)
+        logging.getLogger('worker').info('Processed %s jobs.', processed)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()